@@ -1,23 +1,27 @@
 import sys
 import os
 import glob
+import base64
+import time
+import hashlib
 import boto3
+from collections import OrderedDict
+from datetime import datetime, timezone
 from typing import Dict, List, Optional
 import numpy as np
 import json
 import re
+import logging
+from unidecode import unidecode
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 # --------------- CONFIG KEYWORDS -------------
 _SPECIAL_TYPES = {"qrcode_payment", "transfer_out", "atm_withdrawal"}
 
-_KEYWORDS: Dict[str, List[str]] = {
-    "NEC":  ["grab", "cho", "sieu thi", "taxi", "an uong", "an nuong", "di cho"],
-    "PLY": ["netflix", "spotify", "game", "cinema", "rap phim", "tiktok", "cgv", "galaxy"],
-    "GIV": ["tu thien", "thien nguyen", "ung ho", "donate", "charity", "quy"],
-    "EDU":  ["hoc phi", "khoa hoc", "sach", "book", "education", "course", "udemy", "coursera"],
-    "LTSS": ["tiet kiem", "mua nha", "mua nha", "mua xe", "mua xe"],
-    "FFA":  ["chung khoan", "chungkhoan", "crypto", "investment", "vang", "stock", "securities"],
-}
+# Bảng keyword có version, sửa file json thay vì sửa code
+KEYWORDS_PATH = os.environ.get("KEYWORDS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "keywords.json"))
 
 TRANX_TYPE_VIETNAMESE = {
     "transfer_in": "Nhận chuyển khoản",
@@ -66,66 +70,294 @@ sagemaker_runtime = session.client("sagemaker-runtime")
 fs_runtime = session.client("sagemaker-featurestore-runtime")
 
 USER_EMBED_DIM = 64
+USER_FEATURE_GROUP = "user-embeddings"
+# Số text mỗi lần gọi sentence-embed endpoint / số user mỗi lần BatchGetRecord (giới hạn API: 100)
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+FS_BATCH_SIZE = 100
+# Số transaction tối đa mỗi request classify_batch
+CLASSIFY_BATCH_MAX = int(os.environ.get("CLASSIFY_BATCH_MAX", 500))
+# 'separate': sentence-embed endpoint rồi classifier endpoint (2 round trip)
+# 'combined': 1 endpoint embed + classify từ text (sagemaker_pipeline/jobs/deploy_combined.py)
+CLASSIFY_MODE = os.environ.get("CLASSIFY_MODE", "separate")
+COMBINED_ENDPOINT_NAME = os.environ.get("COMBINED_ENDPOINT_NAME", "transaction-classifier-combined-v1")
+# Cache sentence embedding: LRU trong container + DynamoDB (tuỳ chọn, dùng chung với data_preprocess.py)
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", 4096))
+EMBED_CACHE_TABLE = os.environ.get("EMBED_CACHE_TABLE", "")
+# Model sau sentence-embed-endpoint-v1 (tên endpoint cố định): đổi model / pooling -> đổi version -> không dùng vector cũ
+EMBED_MODEL_VERSION = os.environ.get("EMBED_MODEL_VERSION", "sentence-transformers/paraphrase-MiniLM-L6-v2")
+# Item DynamoDB có expires_at (TTL của table) -> vector của version cũ tự bị xoá
+EMBED_CACHE_TTL_DAYS = int(os.environ.get("EMBED_CACHE_TTL_DAYS", 30))
+dynamodb = session.client("dynamodb") if EMBED_CACHE_TABLE else None
+_embed_cache = OrderedDict()  # text_key -> float32 vector
+# Cache user embedding trong container: embedding chỉ đổi khi train_autoencoder + ingest chạy lại.
+# Entry hết hạn ở event_time + USER_EMBED_REFRESH_SECONDS (lần refresh kế tiếp), tối thiểu USER_EMBED_MIN_TTL.
+USER_EMBED_CACHE_SIZE = int(os.environ.get("USER_EMBED_CACHE_SIZE", 10000))
+USER_EMBED_REFRESH_SECONDS = int(os.environ.get("USER_EMBED_REFRESH_SECONDS", 24 * 3600))
+USER_EMBED_MIN_TTL = int(os.environ.get("USER_EMBED_MIN_TTL", 300))
+# SSM parameter ingest_embeddings.py ghi event_time sau mỗi lần ingest -> mọi container xoá cache
+USER_EMBED_REFRESH_PARAM = os.environ.get("USER_EMBED_REFRESH_PARAM", "/smart-jarvis/user-embeddings/event_time")
+USER_EMBED_REFRESH_CHECK = int(os.environ.get("USER_EMBED_REFRESH_CHECK", 60))
+ssm = session.client("ssm") if USER_EMBED_REFRESH_PARAM else None
+_user_cache = OrderedDict()  # user_id -> (float32 vector, expires_at)
+_user_cache_state = {"refresh": None, "checked_at": 0.0}
+
 # --- HELPER FUNCTIONS ---
-def _embed_sentence(text: str, endpoint_name="sentence-embed-endpoint-v1") -> list[float]:
-    print('-- Calling text-embedding model endpoint ')
-    payload = json.dumps({"inputs": [text]})
-    resp = sagemaker_runtime.invoke_endpoint(
-        EndpointName=endpoint_name,
-        ContentType="application/json",
-        Body=payload
-    )
-    raw = json.loads(resp["Body"].read())[0][0]
-    vec = np.mean(raw, axis=0).tolist()  # Mean-pooling over token embeddings
-    print(f"[DEBUG] vec shape: {np.shape(vec)}")
-    csv_vec = ",".join(f"{x:.6g}" for x in vec)
-    return csv_vec
+# Embedding gửi tới classifier dạng base64 của float32 little-endian (inference.py _decode_vector):
+# không mất precision như CSV "%.6g", payload nhỏ hơn ~2-3 lần
+EMBEDDING_ENCODING = "base64-float32"
 
-def _embed_user(user_id):
-    print('-- Getting user_embed from feature-store')
-    record_identifier_value = user_id
+def _to_b64(vec) -> str:
+    return base64.b64encode(np.asarray(vec, dtype="<f4").tobytes()).decode("ascii")
+
+def _normalize_spaces(text: str) -> str:
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def _text_key(text: str, endpoint_name: str) -> str:
+    # Cùng công thức với text_key trong sagemaker_pipeline/docker/modules/embedding_cache.py
+    return hashlib.sha256(f"{endpoint_name}\n{EMBED_MODEL_VERSION}\n{_normalize_spaces(text)}".encode("utf-8")).hexdigest()
+
+def _cache_get(keys: List[str]) -> Dict[str, np.ndarray]:
+    """Tra LRU, rồi DynamoDB cho các key còn thiếu (BatchGetItem tối đa 100 key). Lỗi store / item hết hạn -> miss."""
+    found = {}
+    for key in keys:
+        if key in _embed_cache:
+            _embed_cache.move_to_end(key)
+            found[key] = _embed_cache[key]
+    missing = [k for k in keys if k not in found]
+    if dynamodb and missing:
+        try:
+            for start in range(0, len(missing), 100):
+                request = {EMBED_CACHE_TABLE: {"Keys": [{"text_hash": {"S": k}} for k in missing[start:start + 100]]}}
+                for attempt in range(3):
+                    resp = dynamodb.batch_get_item(RequestItems=request)
+                    for item in resp.get("Responses", {}).get(EMBED_CACHE_TABLE, []):
+                        # TTL của DynamoDB xoá trễ -> tự bỏ qua item đã hết hạn
+                        if "expires_at" in item and int(item["expires_at"]["N"]) < time.time():
+                            continue
+                        vec = np.frombuffer(item["vector"]["B"], dtype=np.float32)
+                        found[item["text_hash"]["S"]] = _cache_put(item["text_hash"]["S"], vec)
+                    request = resp.get("UnprocessedKeys") or {}
+                    if not request:
+                        break
+                    time.sleep(0.05 * 2 ** attempt)
+        except Exception as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+    return found
+
+def _cache_put(key: str, vec: np.ndarray) -> np.ndarray:
+    _embed_cache[key] = vec
+    _embed_cache.move_to_end(key)
+    while len(_embed_cache) > EMBED_CACHE_SIZE:
+        _embed_cache.popitem(last=False)
+    return vec
+
+def _cache_store(vectors: Dict[str, np.ndarray]):
+    """Ghi vector mới vào DynamoDB (float32 bytes) để container khác / preprocessing dùng lại."""
+    if not dynamodb or not vectors:
+        return
+    items = list(vectors.items())
+    expires_at = {"N": str(int(time.time()) + EMBED_CACHE_TTL_DAYS * 24 * 3600)}
     try:
-        record = fs_runtime.get_record(
-            FeatureGroupName="user-embeddings",
-            RecordIdentifierValueAsString=record_identifier_value,
-            FeatureNames=["embedding"]
-        )
+        for start in range(0, len(items), 25):
+            dynamodb.batch_write_item(RequestItems={EMBED_CACHE_TABLE: [
+                {"PutRequest": {"Item": {"text_hash": {"S": k}, "vector": {"B": v.astype(np.float32).tobytes()},
+                                         "expires_at": expires_at}}}
+                for k, v in items[start:start + 25]
+            ]})
     except Exception as e:
-        print(f"Error when get record from feature-store {record_identifier_value}: {e}")
-
-    if record.get('Record'):
-        for item in record['Record']:
-            if item['FeatureName'] == 'embedding':
-                raw = item['ValueAsString']
-                raw = raw.strip("[]")
-                vec = np.fromstring(raw, sep=",", dtype=np.float32)
-                print(f"User embedding len: {vec.size}")
-                if vec.size != USER_EMBED_DIM:
-                    logger.warning(f"Bad length ({vec.size}) for user {uid}")
-                    vec = np.zeros(USER_EMBED_DIM, dtype=np.float32)
+        logger.warning(f"Embedding cache write failed: {e}")
+
+def _pooled(raw) -> np.ndarray:
+    """1 phần tử response của embedder: vector đã pool trên server, hoặc [1][n_tokens][dim] (endpoint cũ) -> mean."""
+    vec = np.asarray(raw, dtype=np.float32)
+    return vec if vec.ndim == 1 else vec[0].mean(axis=0)
+
+def _embed_sentences(texts: List[str], endpoint_name="sentence-embed-endpoint-v1") -> List[np.ndarray]:
+    """
+    Embed nhiều text, mỗi EMBED_BATCH_SIZE text 1 lần gọi endpoint. Trả về list vector float32 theo thứ tự input.
+    Text trùng / đã có trong cache (theo hash của text đã chuẩn hoá khoảng trắng) không gọi lại endpoint.
+    """
+    keys = [_text_key(t, endpoint_name) for t in texts]
+    vectors = _cache_get(list(dict.fromkeys(keys)))
+    missing = {k: _normalize_spaces(t) for k, t in zip(keys, texts) if k not in vectors}
+    print(f'-- Calling text-embedding model endpoint for {len(missing)}/{len(texts)} texts (cache hits: {len(texts) - len(missing)})')
+    missing_keys = list(missing)
+    computed = {}
+    for start in range(0, len(missing_keys), EMBED_BATCH_SIZE):
+        chunk = missing_keys[start:start + EMBED_BATCH_SIZE]
+        resp = sagemaker_runtime.invoke_endpoint(
+            EndpointName=endpoint_name,
+            ContentType="application/json",
+            # Mean pooling trên server (embedder_inference.py): response 1 vector / text thay vì cả ma trận token
+            Body=json.dumps({"inputs": [missing[k] for k in chunk], "pooling": "mean"})
+        )
+        for key, raw in zip(chunk, json.loads(resp["Body"].read())):
+            vec = _pooled(raw)
+            computed[key] = vec
+            vectors[key] = _cache_put(key, vec)
+    _cache_store(computed)
+    return [vectors[k] for k in keys]
+
+def _embed_sentence(text: str, endpoint_name="sentence-embed-endpoint-v1") -> np.ndarray:
+    return _embed_sentences([text], endpoint_name)[0]
+
+def _record_event_time(features) -> Optional[float]:
+    for item in features or []:
+        if item['FeatureName'] == 'event_time':
+            try:
+                # ingest_embeddings.py ghi event_time dạng UTC "%Y-%m-%dT%H:%M:%SZ"
+                return datetime.strptime(item['ValueAsString'], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+            except ValueError:
+                return None
+    return None
+
+def _parse_user_record(features, user_id) -> np.ndarray:
+    for item in features or []:
+        if item['FeatureName'] == 'embedding':
+            vec = np.fromstring(item['ValueAsString'].strip("[]"), sep=",", dtype=np.float32)
+            if vec.size == USER_EMBED_DIM:
+                return vec
+            logger.warning(f"Bad length ({vec.size}) for user {user_id}")
+            return np.zeros(USER_EMBED_DIM, dtype=np.float32)
+    logger.warning(f"No record found for user {user_id}")
+    return np.zeros(USER_EMBED_DIM, dtype=np.float32)
+
+def invalidate_user_embeddings(user_ids=None):
+    """Xoá cache user embedding của container này (toàn bộ, hoặc chỉ các user_ids)."""
+    if user_ids is None:
+        _user_cache.clear()
     else:
-        logger.warning(f"No record found for user {uid}")
-        vec = np.zeros(USER_EMBED_DIM, dtype=np.float32)
-    print(f"[DEBUG] vec shape: {np.shape(vec)}")
+        for uid in user_ids:
+            _user_cache.pop(uid, None)
+
+def _check_user_embed_refresh(now):
+    """Tối đa 1 lần / USER_EMBED_REFRESH_CHECK giây: event_time ingest mới -> xoá cache."""
+    if not ssm or now - _user_cache_state["checked_at"] < USER_EMBED_REFRESH_CHECK:
+        return
+    _user_cache_state["checked_at"] = now
+    try:
+        refresh = ssm.get_parameter(Name=USER_EMBED_REFRESH_PARAM)["Parameter"]["Value"]
+    except Exception as e:
+        logger.warning(f"Cannot read {USER_EMBED_REFRESH_PARAM}: {e}")
+        return
+    if refresh != _user_cache_state["refresh"]:
+        if _user_cache_state["refresh"] is not None:
+            logger.info(f"User embeddings refreshed at {refresh}, dropping {len(_user_cache)} cached users")
+            invalidate_user_embeddings()
+        _user_cache_state["refresh"] = refresh
+
+def _embed_users(user_ids: List[str]) -> Dict[str, np.ndarray]:
+    """
+    User embedding từ cache của container, user thiếu / hết hạn lấy từ feature-store qua BatchGetRecord.
+    User không có record -> vector 0 (chỉ cache USER_EMBED_MIN_TTL để user mới sớm có embedding).
+    """
+    now = time.time()
+    _check_user_embed_refresh(now)
+    unique_ids = list(dict.fromkeys(user_ids))
+    result = {}
+    for uid in unique_ids:
+        cached = _user_cache.get(uid)
+        if cached and cached[1] > now:
+            _user_cache.move_to_end(uid)
+            result[uid] = cached[0]
+    missing = [uid for uid in unique_ids if uid not in result]
+    print(f'-- Getting user_embed from feature-store for {len(missing)}/{len(unique_ids)} users')
+    records = {}
+    failed = set()
+    for start in range(0, len(missing), FS_BATCH_SIZE):
+        chunk = missing[start:start + FS_BATCH_SIZE]
+        try:
+            resp = fs_runtime.batch_get_record(Identifiers=[{
+                "FeatureGroupName": USER_FEATURE_GROUP,
+                "RecordIdentifiersValueAsString": chunk,
+                "FeatureNames": ["embedding", "event_time"]
+            }])
+        except Exception as e:
+            print(f"Error when batch get records from feature-store: {e}")
+            failed.update(chunk)
+            continue
+        for item in resp.get("Records", []):
+            records[item["RecordIdentifierValueAsString"]] = item["Record"]
+    for uid in missing:
+        record = records.get(uid)
+        result[uid] = _parse_user_record(record, uid)
+        if uid in failed:
+            # Lỗi tạm thời của feature-store: dùng vector 0 cho lần này, không cache
+            continue
+        if record is None:
+            expires_at = now + USER_EMBED_MIN_TTL
+        else:
+            event_time = _record_event_time(record)
+            expires_at = max((event_time or now) + USER_EMBED_REFRESH_SECONDS, now + USER_EMBED_MIN_TTL)
+        _user_cache[uid] = (result[uid], expires_at)
+        _user_cache.move_to_end(uid)
+    while len(_user_cache) > USER_EMBED_CACHE_SIZE:
+        _user_cache.popitem(last=False)
+    return {uid: result[uid] for uid in unique_ids}
 
-    csv_vec = ",".join(f"{x:.6g}" for x in vec)
-    return csv_vec
+def _embed_user(user_id):
+    return _embed_users([user_id])[user_id]
+
+# Giống FastTextEmbedder._normalise (sagemaker_pipeline/docker/modules/text_embedder.py)
+_NORMALISE_RE = re.compile(r"[^a-z0-9\s]")
+_SPACES_RE = re.compile(r"\s+")
 
 def _normalize(text: str) -> str:
     """Bỏ None, lower‑case & bỏ dấu để tiện match."""
-    #return unidecode(text or "").lower()
     if text is None:
         return ""
-    return text.lower()
+    text = _NORMALISE_RE.sub(" ", unidecode(text).lower())
+    return _SPACES_RE.sub(" ", text).strip()
+
+def _load_keywords(path: str):
+    """
+    Đọc bảng keyword và compile 1 regex alternation (có word boundary) cho toàn bộ keyword.
+    Trả về (version, regex, {keyword: (priority, label)}); keyword trùng giữa các nhóm thuộc nhóm ưu tiên cao hơn.
+    """
+    with open(path, encoding="utf-8") as f:
+        config = json.load(f)
+    keyword_labels = {}
+    for priority, group in enumerate(config["labels"]):
+        for kw in group["keywords"]:
+            kw = _normalize(kw)
+            if kw and kw not in keyword_labels:
+                keyword_labels[kw] = (priority, group["label"])
+    # Keyword dài trước để "di cho" thắng "cho" ở cùng vị trí
+    alternation = "|".join(re.escape(kw) for kw in sorted(keyword_labels, key=len, reverse=True))
+    return config.get("version"), re.compile(rf"\b(?:{alternation})\b"), keyword_labels
+
+# Compile 1 lần khi import: chi phí match không tăng theo số keyword
+KEYWORDS_VERSION, _KEYWORD_RE, _KEYWORD_LABELS = _load_keywords(KEYWORDS_PATH)
+logger.info(f"Loaded {len(_KEYWORD_LABELS)} keywords (version {KEYWORDS_VERSION})")
+
+def _detect_labels(text_joined: str) -> List[Dict]:
+    """Mọi keyword khớp trong text (đã normalize), sắp theo độ ưu tiên của nhóm."""
+    hits = {}
+    for match in _KEYWORD_RE.finditer(text_joined):
+        kw = match.group(0)
+        if kw not in hits:
+            priority, label = _KEYWORD_LABELS[kw]
+            hits[kw] = {"label": label, "keyword": kw, "priority": priority}
+    return sorted(hits.values(), key=lambda h: h["priority"])
 
 def _detect_label(text_joined: str) -> Optional[str]:
-    """Trả về label match đầu tiên (dựa theo thứ tự trong _KEYWORDS)."""
-    for label, kw_list in _KEYWORDS.items():
-        for kw in kw_list:
-            if kw in text_joined:
-                return label
-    return None
+    """Trả về label ưu tiên cao nhất trong các keyword khớp."""
+    hits = _detect_labels(text_joined)
+    return hits[0]["label"] if hits else None
+
+
+# Mapping chỉ mục → tên nhãn
+LABELS = ["NEC", "FFA", "PLAY", "EDU", "GIVE", "LTSS"]
 
+def _decode_predictions(predictions) -> List[Dict]:
+    results = []
+    for preds in predictions:
+        label_idx = int(np.argmax(preds))
+        results.append({
+            "predicted_label": LABELS[label_idx],
+            "probability": float(np.max(preds))
+        })
+    return results
 
 def _classify_using_ML(payload, endpoint_name="transaction-classifier-serverless-endpoint-v1"):
     print('--- Calling SageMaker endpoint')
@@ -136,19 +368,22 @@ def _classify_using_ML(payload, endpoint_name="transaction-classifier-serverless
             Body=json.dumps(payload)
     )
     body_str = resp["Body"].read().decode()
-    preds = json.loads(body_str)['predictions'][0]
-    label_idx = int(np.argmax(preds))
-    prob = float(np.max(preds))
+    result = _decode_predictions(json.loads(body_str)['predictions'][:1])[0]
+    print(f'Predicted result: {result["predicted_label"]} - {result["probability"]}')
+    return result
 
-    # Mapping chỉ mục → tên nhãn
-    LABELS = ["NEC", "FFA", "PLAY", "EDU", "GIVE", "LTSS"]
-    predicted_label = LABELS[label_idx]
-
-    print(f'Predicted result: {predicted_label} - {prob}')
-    return {
-        "predicted_label": predicted_label,
-        "probability": prob
-    }
+def _classify_many_using_ML(payloads, endpoint_name="transaction-classifier-serverless-endpoint-v1"):
+    """1 lần gọi endpoint cho cả batch: inference.py nhận {"instances": [payload, ...]}."""
+    print(f'--- Calling SageMaker endpoint for {len(payloads)} transactions')
+    resp = sagemaker_runtime.invoke_endpoint(
+            EndpointName=endpoint_name,
+            ContentType="application/json",
+            Body=json.dumps({"instances": payloads})
+    )
+    predictions = json.loads(resp["Body"].read().decode())['predictions']
+    if len(predictions) != len(payloads):
+        raise ValueError(f"Classifier returned {len(predictions)} predictions for {len(payloads)} transactions")
+    return _decode_predictions(predictions)
 
 # --- PROCESSING FUNCTIONS ---
 def response(status, body):
@@ -158,85 +393,175 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
+def _read_transaction(event) -> Dict:
+    return {
+        "transaction_id": event.get("transaction_id", ""),
+        "user_id": event.get("user_id", ""),
+        "amount": event.get("amount", 0),
+        "txn_time": event.get("txn_time"),
+        "msg_content": (event.get("msg_content") or "").lower(),
+        "merchant": (event.get("merchant") or "").lower(),
+        "to_account_name": (event.get("to_account_name") or "").lower(),
+        "location": event.get("location", "Hà Nội"),
+        "channel": event.get("channel", "MOBILE"),
+        "tranx_type": event.get("tranx_type", "transfer_out"),
+    }
+
+def _classify_by_rules(txn) -> Optional[Dict]:
+    """Bước 1-2: phân loại theo tranx_type rồi theo keyword. Trả về None nếu cần gọi ML."""
+    transaction_id = txn["transaction_id"]
+    tranx_type = txn["tranx_type"]
+
+    # 1. Classify by tranx_type
+    print('Checking tranx_type ...')
+    if tranx_type not in _SPECIAL_TYPES:
+        response_msg = (
+            f"Chúng tôi phân loại giao dịch dựa trên loại giao dịch: '{TRANX_TYPE_VIETNAMESE[tranx_type]}'. \n Nếu bạn muốn chỉnh sửa, hãy phản hồi nhé!"
+        )
+        return {
+            "transaction_id": transaction_id,
+            "jar": TRANX_TYPE_TO_LABEL[tranx_type],
+            "response_msg": response_msg,
+        }
+
+    # 2. Classify by keywords
+    print('Checking key words ...')
+    text_joined = " ".join(
+        filter(
+            None,
+            [
+                _normalize(txn["msg_content"]),
+                _normalize(txn["merchant"]),
+                _normalize(txn["to_account_name"]),
+            ],
+        )
+    )
+    hits = _detect_labels(text_joined)
+    if hits:
+        label = hits[0]["label"]
+        response_msg = (
+            f"Phát hiện keyword liên quan tới nhóm {label} ({LABEL_VIETNAMESE[label]}), \n bạn có muốn chỉnh sửa không?"
+        )
+        return {
+            "transaction_id": transaction_id,
+            "jar": label,
+            "response_msg": response_msg,
+            "keyword_hits": hits,
+            "keywords_version": KEYWORDS_VERSION,
+        }
+    return None
+
+def _ml_text(txn) -> str:
+    joined_text = " ".join([s or "" for s in (txn["msg_content"], txn["merchant"], txn["to_account_name"])])
+    return re.sub(r"\s+", " ", joined_text).strip()
+
+def _ml_payload(txn, sentence_embedding, user_embed) -> Dict:
+    payload = {k: v for k, v in txn.items() if k != "user_id"}
+    payload["user_embedding"] = _to_b64(user_embed)
+    payload["sentence_embedding"] = _to_b64(sentence_embedding)
+    payload["embedding_encoding"] = EMBEDDING_ENCODING
+    return payload
+
+def _combined_payload(txn, user_embed) -> Dict:
+    """Payload cho endpoint gộp: text thô thay cho sentence_embedding, endpoint tự embed."""
+    payload = {k: v for k, v in txn.items() if k != "user_id"}
+    payload["text"] = _ml_text(txn)
+    payload["user_embedding"] = _to_b64(user_embed)
+    payload["embedding_encoding"] = EMBEDDING_ENCODING
+    return payload
+
+def _classify_combined(txns) -> List[Dict]:
+    user_embeds = _embed_users([txn["user_id"] for txn in txns])
+    payloads = [_combined_payload(txn, user_embeds[txn["user_id"]]) for txn in txns]
+    return _classify_many_using_ML(payloads, COMBINED_ENDPOINT_NAME)
+
+def _ml_body(txn, jar) -> Dict:
+    return {
+        "transaction_id": txn["transaction_id"],
+        "jar": jar,
+        "response_msg": 'Hệ thống dùng AI để phân loại, bạn có muốn thay đổi?',
+    }
+
+def classify_batch(event):
+    """
+    Direct invoke {"action": "classify_batch", "transactions": [event, ...]} (backfill, SQS burst).
+    Rule/keyword như handler; phần còn lại gọi ML theo batch: 1 lần embed nhiều text,
+    1 lần BatchGetRecord cho user embedding, 1 ma trận instances cho classifier.
+    Trả về results theo đúng thứ tự input; transaction lỗi có "error" thay vì "jar".
+    """
+    transactions = event.get("transactions") or []
+    if not isinstance(transactions, list) or not transactions:
+        return response(400, {"error": "transactions must be a non-empty array"})
+    if len(transactions) > CLASSIFY_BATCH_MAX:
+        return response(400, {"error": f"At most {CLASSIFY_BATCH_MAX} transactions per batch"})
+
+    results = [None] * len(transactions)
+    pending = []  # [(index, txn)] cần gọi ML
+    for i, item in enumerate(transactions):
+        # Phần tử lỗi (không phải object, thiếu field) chỉ làm lỗi kết quả của chính nó, không làm hỏng cả batch
+        if not isinstance(item, dict):
+            results[i] = {"transaction_id": "", "error": "transaction must be an object"}
+            continue
+        try:
+            txn = _read_transaction(item)
+            body = _classify_by_rules(txn)
+        except Exception as e:
+            results[i] = {"transaction_id": item.get("transaction_id", ""), "error": str(e)}
+            continue
+        if body:
+            results[i] = body
+        else:
+            pending.append((i, txn))
+
+    if pending:
+        print(f'Call ML for {len(pending)}/{len(transactions)} transactions ...')
+        try:
+            txns = [txn for _, txn in pending]
+            if CLASSIFY_MODE == "combined":
+                ml_resps = _classify_combined(txns)
+            else:
+                sentence_embeddings = _embed_sentences([_ml_text(txn) for txn in txns])
+                user_embeds = _embed_users([txn["user_id"] for txn in txns])
+                payloads = [
+                    _ml_payload(txn, sentence_embedding, user_embeds[txn["user_id"]])
+                    for txn, sentence_embedding in zip(txns, sentence_embeddings)
+                ]
+                ml_resps = _classify_many_using_ML(payloads)
+            for (i, txn), ml_resp in zip(pending, ml_resps):
+                results[i] = _ml_body(txn, ml_resp['predicted_label'])
+        except Exception as e:
+            logger.error(f"Batch ML classify failed: {e}")
+            for i, txn in pending:
+                results[i] = {"transaction_id": txn["transaction_id"], "error": str(e)}
+
+    return response(200, {"results": results})
+
 def handler(event, context):
+    # Direct invoke theo batch
+    if event.get("action") == "classify_batch":
+        return classify_batch(event)
+    if event.get("action") == "invalidate_user_embeddings":
+        invalidate_user_embeddings(event.get("user_ids"))
+        return response(200, {"message": "User embedding cache cleared", "cached_users": len(_user_cache)})
     try:
         # Load data
-        transaction_id = event.get("transaction_id", "")
-        user_id = event.get("user_id", "")
-        amount = event.get("amount", 0)
-        txn_time = event.get("txn_time")
-        msg_content = event.get("msg_content", "").lower()
-        merchant = event.get("merchant", "").lower()
-        to_account_name = event.get("to_account_name", "").lower()
-        location = event.get("location", "Hà Nội")
-        channel = event.get("channel", "MOBILE")
-        tranx_type = event.get("tranx_type", "transfer_out")
-
-        # 1. Classify by tranx_type
-        print('Checking tranx_type ...')
-        if tranx_type not in _SPECIAL_TYPES:
-            response_msg = (
-                f"Chúng tôi phân loại giao dịch dựa trên loại giao dịch: '{TRANX_TYPE_VIETNAMESE[tranx_type]}'. \n Nếu bạn muốn chỉnh sửa, hãy phản hồi nhé!"
-            )
-            body = {
-                "transaction_id": transaction_id,
-                "jar": TRANX_TYPE_TO_LABEL[tranx_type],
-                "response_msg": response_msg,
-            }
-            return response(200, body)
+        txn = _read_transaction(event)
 
-        # 2. Classify by keywords
-        print('Checking key words ...')
-        text_joined = " ".join(
-            filter(
-                None,
-                [
-                    _normalize(msg_content),
-                    _normalize(merchant),
-                    _normalize(to_account_name),
-                ],
-            )
-        )
-        label = _detect_label(text_joined)
-        if label:
-            response_msg = (
-                f"Phát hiện keyword liên quan tới nhóm {label} ({LABEL_VIETNAMESE[label]}), \n bạn có muốn chỉnh sửa không?"
-            )
-            body = {
-                "transaction_id": transaction_id,
-                "jar": label,
-                "response_msg": response_msg,
-            }
+        # 1-2. Classify by tranx_type / keywords
+        body = _classify_by_rules(txn)
+        if body:
             return response(200, body)
 
         # 3. Keyword not found -> Call ML <dev...>
         print('Call ML ...')
-        joined_text = " ".join([s or "" for s in (msg_content, merchant, to_account_name)])
-        joined_text = re.sub(r"\s+", " ", joined_text).strip()
-        sentence_embedding = _embed_sentence(joined_text)
-        user_embed = _embed_user(user_id)
-        payload = {
-            "transaction_id": transaction_id,
-            "amount": amount,
-            "txn_time": txn_time,
-            "msg_content": msg_content,
-            "merchant": merchant,
-            "to_account_name": to_account_name,
-            "location": location,
-            "channel": channel,
-            "tranx_type": tranx_type,
-            "user_embedding": user_embed,
-            "sentence_embedding": sentence_embedding
-        }
-        ml_resp = _classify_using_ML(payload)
-        jar = ml_resp['predicted_label']
-
-        body = {
-            "transaction_id": transaction_id,
-            "jar": jar,
-            "response_msg": 'Hệ thống dùng AI để phân loại, bạn có muốn thay đổi?',
-        }
-        return response(200, body)
+        if CLASSIFY_MODE == "combined":
+            ml_resp = _classify_combined([txn])[0]
+        else:
+            sentence_embedding = _embed_sentence(_ml_text(txn))
+            user_embed = _embed_user(txn["user_id"])
+            payload = _ml_payload(txn, sentence_embedding, user_embed)
+            ml_resp = _classify_using_ML(payload)
+        return response(200, _ml_body(txn, ml_resp['predicted_label']))
 
     except Exception as e:
         return {
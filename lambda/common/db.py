@@ -0,0 +1,192 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+logger = logging.getLogger(__name__)
+
+# Số connection tối đa mỗi container giữ mở (giới hạn tổng max_connections khi burst)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+# Connection idle lâu hơn ngưỡng này sẽ được ping trước khi dùng lại
+DB_HEALTHCHECK_INTERVAL = float(os.environ.get('DB_HEALTHCHECK_INTERVAL', 30))
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+DB_CHECKOUT_TIMEOUT = float(os.environ.get('DB_CHECKOUT_TIMEOUT', 10))
+# TTL (giây) cache user_id đã xác nhận tồn tại; 0 = tắt cache
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 300))
+USER_CACHE_MAX_SIZE = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+
+# MySQL errno: Cannot add or update a child row: a foreign key constraint fails
+ER_NO_REFERENCED_ROW = 1452
+# MySQL errno: Duplicate entry '...' for key '...'
+ER_DUP_ENTRY = 1062
+
+# Lỗi này nghĩa là connection đã hỏng -> bỏ đi, không trả lại pool
+_BROKEN_CONNECTION_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+# Pool sống ở module level nên được giữ lại giữa các lần invoke của warm container
+_idle = []  # list[(connection, last_used_monotonic)]
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(DB_POOL_SIZE)
+_known_users = {}  # user_id -> expires_at (monotonic)
+
+
+def _connect():
+    logger.info("Opening new database connection")
+    return pymysql.connect(
+        host=os.environ['DB_HOST'].split(':')[0],
+        port=int(os.environ['DB_PORT']),
+        user=os.environ['DB_USER'],
+        password=os.environ['DB_PASSWORD'],
+        database=os.environ['DB_NAME'],
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_healthy(conn, last_used):
+    if not conn.open:
+        return False
+    if time.monotonic() - last_used < DB_HEALTHCHECK_INTERVAL:
+        return True
+    try:
+        conn.ping(reconnect=False)
+        return True
+    except Exception as e:
+        logger.warning(f"Stale database connection dropped: {e}")
+        return False
+
+
+def _checkout():
+    if not _slots.acquire(timeout=DB_CHECKOUT_TIMEOUT):
+        raise pymysql.err.OperationalError(2013, "Timed out waiting for a pooled database connection")
+    try:
+        while True:
+            with _lock:
+                if not _idle:
+                    break
+                conn, last_used = _idle.pop()
+            if _is_healthy(conn, last_used):
+                return conn
+            _close_quietly(conn)
+        return _connect()
+    except BaseException:
+        _slots.release()
+        raise
+
+
+def _checkin(conn):
+    try:
+        # Kết thúc transaction còn mở (kể cả SELECT) để request sau không đọc snapshot cũ
+        if conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            conn.rollback()
+    except Exception as e:
+        logger.warning(f"Rollback on release failed, dropping connection: {e}")
+        _close_quietly(conn)
+    else:
+        if conn.open:
+            with _lock:
+                _idle.append((conn, time.monotonic()))
+    finally:
+        _slots.release()
+
+
+def _discard(conn):
+    _close_quietly(conn)
+    _slots.release()
+
+
+@contextmanager
+def connection():
+    """
+    Checkout 1 connection từ pool cho 1 request.
+    Caller tự commit như cũ; transaction chưa commit sẽ bị rollback khi trả lại pool.
+    Connection lỗi (mất kết nối, timeout) sẽ bị bỏ và lần checkout sau tự kết nối lại.
+    """
+    conn = _checkout()
+    try:
+        yield conn
+    except _BROKEN_CONNECTION_ERRORS:
+        _discard(conn)
+        raise
+    except BaseException:
+        _checkin(conn)
+        raise
+    else:
+        _checkin(conn)
+
+
+def close_all():
+    """Đóng toàn bộ connection idle (dùng khi test hoặc đổi cấu hình DB)."""
+    with _lock:
+        idle = list(_idle)
+        _idle.clear()
+    for conn, _ in idle:
+        _close_quietly(conn)
+
+
+def remember_user(user_id):
+    """Đánh dấu user_id đã tồn tại (vd. sau khi INSERT có FK tới users thành công)."""
+    if USER_CACHE_TTL <= 0:
+        return
+    with _lock:
+        if len(_known_users) >= USER_CACHE_MAX_SIZE:
+            _known_users.clear()
+        _known_users[user_id] = time.monotonic() + USER_CACHE_TTL
+
+
+def _is_known_user(user_id):
+    with _lock:
+        expires_at = _known_users.get(user_id)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del _known_users[user_id]
+            return False
+        return True
+
+
+def user_exists(user_id, conn=None):
+    """
+    Kiểm tra user tồn tại. User đã biết trong TTL thì không query lại.
+    Truyền conn để chạy trên connection của request hiện tại thay vì checkout thêm.
+    Chỉ cache kết quả True: user mới tạo phải được thấy ngay.
+    """
+    if _is_known_user(user_id):
+        return True
+    if conn is None:
+        with connection() as conn:
+            return user_exists(user_id, conn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
+        exists = cursor.fetchone() is not None
+    if exists:
+        remember_user(user_id)
+    return exists
+
+
+def forget_user(user_id):
+    with _lock:
+        _known_users.pop(user_id, None)
+
+
+def is_missing_user_error(error):
+    """INSERT/UPDATE bị từ chối vì FK tới bảng cha (users) không tồn tại."""
+    return isinstance(error, pymysql.err.IntegrityError) and error.args and error.args[0] == ER_NO_REFERENCED_ROW
+
+
+def is_duplicate_key_error(error, key_name=None):
+    """INSERT bị từ chối vì trùng unique key (chỉ xét key_name nếu truyền vào)."""
+    if not (isinstance(error, pymysql.err.IntegrityError) and error.args and error.args[0] == ER_DUP_ENTRY):
+        return False
+    return key_name is None or key_name in str(error.args[1] if len(error.args) > 1 else error)
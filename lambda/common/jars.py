@@ -0,0 +1,80 @@
+"""
+Core cập nhật spent_amount của jar, dùng chung cho crud_jar (API) và sqs_processor (in-process pipeline).
+Hàm nhận cursor của caller -> có thể chạy chung DB transaction với INSERT transaction.
+"""
+from datetime import datetime
+
+from common import db
+
+JAR_CODES = ['NEC', 'FFA', 'LTSS', 'EDU', 'PLY', 'GIV']
+# Giao dịch tiền vào: không trừ vào jar nào
+NO_JAR_TRANX_TYPES = ['transfer_in', 'cashback', 'refund']
+
+
+def jar_code_for(category_label):
+    """Map category_label sang jar_code (label trùng jar_code, còn lại -> NEC)."""
+    return category_label.upper() if category_label.upper() in JAR_CODES else 'NEC'
+
+
+def apply_spending(cursor, user_id, amount, tranx_type, category_label, y_month=None, idempotency_key=None):
+    """
+    Cộng amount vào spent_amount của jar tương ứng.
+    Trả về dict: jar_code, y_month, skipped (loại giao dịch không tính jar),
+    duplicate (idempotency_key đã áp dụng), updated (số dòng jar được cập nhật).
+    User không tồn tại -> IntegrityError (FK) khi có idempotency_key, hoặc updated = 0.
+    """
+    jar_code = jar_code_for(category_label)
+    y_month = y_month or datetime.now().strftime('%Y-%m')
+    result = {"jar_code": jar_code, "y_month": y_month, "skipped": False, "duplicate": False, "updated": 0}
+    if tranx_type in NO_JAR_TRANX_TYPES:
+        result["skipped"] = True
+        return result
+    if idempotency_key:
+        # Ghi key trước, cùng transaction với UPDATE: key đã có -> lần này là retry, bỏ qua
+        try:
+            cursor.execute("""
+                INSERT INTO user_jar_spending_events (idempotency_key, user_id, y_month, jar_code, amount)
+                VALUES (%s, %s, %s, %s, %s)
+            """, (idempotency_key, user_id, y_month, jar_code, float(amount)))
+        except Exception as e:
+            if db.is_duplicate_key_error(e):
+                result["duplicate"] = True
+                return result
+            raise
+    cursor.execute("""
+        UPDATE user_jar_spending
+        SET spent_amount = spent_amount + %s, updated_at = NOW()
+        WHERE user_id = %s AND y_month = %s AND jar_code = %s
+    """, (float(amount), user_id, y_month, jar_code))
+    result["updated"] = cursor.rowcount
+    return result
+
+
+def apply_spending_bulk(cursor, items):
+    """
+    Cộng spent_amount cho nhiều transaction mới INSERT (bulk import).
+    items: list[(transaction_id, user_id, y_month, amount, tranx_type, category_label)].
+    Ghi key '<transaction_id>:apply' cho từng transaction (classify_transaction sau này không cộng lại),
+    rồi mỗi (user_id, y_month, jar_code) chỉ 1 lệnh UPDATE với tổng amount.
+    Trả về {(user_id, y_month, jar_code): tổng amount}.
+    """
+    events = []
+    totals = {}
+    for transaction_id, user_id, y_month, amount, tranx_type, category_label in items:
+        if tranx_type in NO_JAR_TRANX_TYPES or not category_label:
+            continue
+        jar_code = jar_code_for(category_label)
+        events.append((f"{transaction_id}:apply", user_id, y_month, jar_code, float(amount)))
+        key = (user_id, y_month, jar_code)
+        totals[key] = totals.get(key, 0.0) + float(amount)
+    if events:
+        cursor.executemany("""
+            INSERT INTO user_jar_spending_events (idempotency_key, user_id, y_month, jar_code, amount)
+            VALUES (%s, %s, %s, %s, %s)
+        """, events)
+        cursor.executemany("""
+            UPDATE user_jar_spending
+            SET spent_amount = spent_amount + %s, updated_at = NOW()
+            WHERE user_id = %s AND y_month = %s AND jar_code = %s
+        """, [(amount, user_id, y_month, jar_code) for (user_id, y_month, jar_code), amount in totals.items()])
+    return totals
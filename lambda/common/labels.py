@@ -0,0 +1,185 @@
+"""
+Label đã biết theo đối tác giao dịch (merchant / to_account_name + tranx_type).
+Bảng counterparty_label_stats đếm số lần mỗi label được gán (AI, import, người dùng sửa tay)
+-> giao dịch lặp lại với cùng đối tác lấy label từ lịch sử, không cần gọi embed + classifier.
+counterparty_label_totals cộng sẵn số đếm của mọi user theo đối tác -> lookup không quét dòng của từng user.
+Label lấy từ chính bảng này (source trong PRIOR_SOURCES, transactions.label_from_prior) không được đếm lại,
+nếu không label lịch sử tự tăng số đếm của nó và model không bao giờ được hỏi lại.
+"""
+import os
+
+from common.text import normalise
+
+# Ngưỡng tin cậy để dùng label lịch sử thay cho model
+PRIOR_MIN_HITS = int(os.environ.get('LABEL_PRIOR_MIN_HITS', 3))
+PRIOR_MIN_SHARE = float(os.environ.get('LABEL_PRIOR_MIN_SHARE', 0.9))
+# Lịch sử của toàn bộ user (không có override của chính user) cần nhiều mẫu hơn
+PRIOR_MIN_GLOBAL_HITS = int(os.environ.get('LABEL_PRIOR_MIN_GLOBAL_HITS', 20))
+
+COUNTERPARTY_KEY_MAX_LENGTH = 255
+# source do lookup_many trả về
+PRIOR_SOURCES = ('manual_override', 'user_history', 'global_history')
+
+STATS_TABLE = "counterparty_label_stats"
+# Backfill đếm lại vào bảng tạm, xong mới thay nội dung STATS_TABLE
+REBUILD_TABLE = "counterparty_label_stats_rebuild"
+STATS_COLUMNS = "user_id, counterparty_key, tranx_type, category_label, hits, manual_hits"
+TOTALS_TABLE = "counterparty_label_totals"
+
+_UPSERT_SQL = """
+    INSERT INTO {table} (user_id, counterparty_key, tranx_type, category_label, hits, manual_hits)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE hits = hits + VALUES(hits), manual_hits = manual_hits + VALUES(manual_hits)
+"""
+_TOTALS_UPSERT_SQL = f"""
+    INSERT INTO {TOTALS_TABLE} (counterparty_key, tranx_type, category_label, hits)
+    VALUES (%s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE hits = hits + VALUES(hits)
+"""
+
+
+def counterparty_key(merchant, to_account_name):
+    """Key đã normalise (lower-case, bỏ dấu); None nếu giao dịch không có đối tác."""
+    merchant = normalise(merchant)
+    to_account_name = normalise(to_account_name)
+    if not merchant and not to_account_name:
+        return None
+    return f"{merchant}|{to_account_name}"[:COUNTERPARTY_KEY_MAX_LENGTH]
+
+
+def record_label(cursor, user_id, merchant, to_account_name, tranx_type, category_label, manual=False,
+                 previous_label=None, previous_manual=False):
+    """
+    Ghi nhận 1 lần gán label; previous_label (khi đổi label) bị trừ 1 lần đếm.
+    previous_manual: previous_label cũng là label người dùng sửa tay -> trừ cả manual_hits,
+    override cũ không còn ngang hàng với override mới. Trừ đếm giữ nguyên updated_at (thời điểm gán gần nhất).
+    """
+    key = counterparty_key(merchant, to_account_name)
+    if not key or not category_label:
+        return
+    if previous_label and previous_label != category_label:
+        cursor.execute("""
+            UPDATE counterparty_label_stats
+            SET hits = GREATEST(hits - 1, 0), manual_hits = GREATEST(manual_hits - %s, 0), updated_at = updated_at
+            WHERE user_id = %s AND counterparty_key = %s AND tranx_type = %s AND category_label = %s
+        """, (1 if previous_manual else 0, user_id, key, tranx_type or '', previous_label))
+        cursor.execute(f"""
+            UPDATE {TOTALS_TABLE} SET hits = GREATEST(hits - 1, 0)
+            WHERE counterparty_key = %s AND tranx_type = %s AND category_label = %s
+        """, (key, tranx_type or '', previous_label))
+    cursor.execute(_UPSERT_SQL.format(table=STATS_TABLE), (user_id, key, tranx_type or '', category_label, 1, 1 if manual else 0))
+    cursor.execute(_TOTALS_UPSERT_SQL, (key, tranx_type or '', category_label, 1))
+
+
+def record_labels(cursor, items, table=STATS_TABLE):
+    """
+    Bản nhiều dòng của record_label (bulk import, backfill).
+    items: list[(user_id, merchant, to_account_name, tranx_type, category_label, manual)].
+    table: REBUILD_TABLE khi backfill (TOTALS_TABLE được swap_rebuild tính lại, không cộng ở đây).
+    """
+    counts = {}
+    for user_id, merchant, to_account_name, tranx_type, category_label, manual in items:
+        key = counterparty_key(merchant, to_account_name)
+        if not key or not category_label:
+            continue
+        hits, manual_hits = counts.get((user_id, key, tranx_type or '', category_label), (0, 0))
+        counts[(user_id, key, tranx_type or '', category_label)] = (hits + 1, manual_hits + (1 if manual else 0))
+    if not counts:
+        return
+    cursor.executemany(_UPSERT_SQL.format(table=table), [k + v for k, v in counts.items()])
+    if table == STATS_TABLE:
+        totals = {}
+        for (_, key, tranx_type, category_label), (hits, _) in counts.items():
+            totals[(key, tranx_type, category_label)] = totals.get((key, tranx_type, category_label), 0) + hits
+        cursor.executemany(_TOTALS_UPSERT_SQL, [k + (hits,) for k, hits in totals.items()])
+
+
+def start_rebuild(cursor):
+    """Tạo lại REBUILD_TABLE rỗng cùng cấu trúc STATS_TABLE (không có FK); bảng đang dùng không bị đụng tới."""
+    cursor.execute(f"DROP TABLE IF EXISTS {REBUILD_TABLE}")
+    cursor.execute(f"CREATE TABLE {REBUILD_TABLE} LIKE {STATS_TABLE}")
+
+
+def swap_rebuild(cursor):
+    """
+    Thay nội dung STATS_TABLE bằng REBUILD_TABLE và tính lại TOTALS_TABLE từ đó. Caller commit -> 1 DB transaction:
+    lookup không thấy bảng rỗng, record_label chạy song song chờ lock rồi cộng lên số liệu mới, không bị đếm trùng.
+    Không dùng RENAME TABLE vì bảng tạm không có FK tới users.
+    """
+    cursor.execute(f"DELETE FROM {STATS_TABLE}")
+    cursor.execute(f"INSERT INTO {STATS_TABLE} ({STATS_COLUMNS}) SELECT {STATS_COLUMNS} FROM {REBUILD_TABLE}")
+    cursor.execute(f"DELETE FROM {TOTALS_TABLE}")
+    cursor.execute(f"""
+        INSERT INTO {TOTALS_TABLE} (counterparty_key, tranx_type, category_label, hits)
+        SELECT counterparty_key, tranx_type, category_label, SUM(hits) FROM {REBUILD_TABLE}
+        GROUP BY counterparty_key, tranx_type, category_label
+    """)
+
+
+def drop_rebuild(cursor):
+    cursor.execute(f"DROP TABLE IF EXISTS {REBUILD_TABLE}")
+
+
+def _pick(rows, min_hits, use_manual):
+    if use_manual:
+        manual = [r for r in rows if r['manual_hits'] > 0]
+        if manual:
+            # Bằng số lần sửa -> lấy label được sửa gần nhất
+            best = max(manual, key=lambda r: (r['manual_hits'], r['updated_at']))
+            return best['category_label'], 'manual_override'
+    total = sum(r['hits'] for r in rows)
+    if not total:
+        return None
+    best = max(rows, key=lambda r: r['hits'])
+    if best['hits'] >= min_hits and best['hits'] / total >= PRIOR_MIN_SHARE:
+        return best['category_label'], None
+    return None
+
+
+def _in_clause(columns, keys):
+    """`(c1, c2) IN ((%s, %s), ...)` + params cho danh sách tuple keys."""
+    placeholders = ", ".join(["(" + ", ".join(["%s"] * len(columns)) + ")"] * len(keys))
+    return f"({', '.join(columns)}) IN ({placeholders})", [v for k in keys for v in k]
+
+
+def lookup_many(cursor, items):
+    """
+    Label tin cậy cho từng transaction, hoặc None nếu phải gọi model; 1-2 query cho cả batch.
+    items: list[(user_id, merchant, to_account_name, tranx_type)].
+    Trả về list (category_label, source) cùng thứ tự items, source: manual_override > user_history > global_history.
+    Lịch sử của user đọc theo primary key STATS_TABLE, lịch sử chung từ TOTALS_TABLE (vài dòng / đối tác)
+    -> chi phí không tăng theo số user đã giao dịch với đối tác.
+    """
+    keys = [(user_id, counterparty_key(merchant, to_account_name), tranx_type or '')
+            for user_id, merchant, to_account_name, tranx_type in items]
+    own_keys = sorted({k for k in keys if k[1]})
+    if not own_keys:
+        return [None] * len(items)
+    where, params = _in_clause(("user_id", "counterparty_key", "tranx_type"), own_keys)
+    cursor.execute(f"""
+        SELECT user_id, counterparty_key, tranx_type, category_label, hits, manual_hits, updated_at
+        FROM {STATS_TABLE} WHERE {where}
+    """, params)
+    own = {}
+    for r in cursor.fetchall():
+        own.setdefault((r['user_id'], r['counterparty_key'], r['tranx_type']), []).append(r)
+    picked = {}
+    for k in own_keys:
+        result = _pick(own.get(k, []), PRIOR_MIN_HITS, use_manual=True)
+        if result:
+            picked[k] = (result[0], result[1] or 'user_history')
+
+    # Global: gộp mọi user (kể cả user hiện tại), override của người khác chỉ tính như 1 lần gán
+    global_keys = sorted({k[1:] for k in own_keys if k not in picked})
+    if global_keys:
+        where, params = _in_clause(("counterparty_key", "tranx_type"), global_keys)
+        cursor.execute(f"SELECT counterparty_key, tranx_type, category_label, hits FROM {TOTALS_TABLE} WHERE {where}", params)
+        totals = {}
+        for r in cursor.fetchall():
+            totals.setdefault((r['counterparty_key'], r['tranx_type']), []).append(r)
+        for k in own_keys:
+            if k not in picked:
+                result = _pick(totals.get(k[1:], []), PRIOR_MIN_GLOBAL_HITS, use_manual=False)
+                if result:
+                    picked[k] = (result[0], 'global_history')
+    return [picked.get(k) for k in keys]
@@ -0,0 +1,32 @@
+import re
+
+from unidecode import unidecode
+
+# Giống FastTextEmbedder._normalise (sagemaker_pipeline/docker/modules/text_embedder.py)
+_NORMALISE_RE = re.compile(r"[^a-z0-9\s]")
+_SPACES_RE = re.compile(r"\s+")
+
+# Phải khớp ngram_token_size của MySQL (mặc định 2)
+NGRAM_TOKEN_SIZE = 2
+
+
+def normalise(*parts):
+    """Ghép các field text, lower-case, bỏ dấu tiếng Việt & ký tự đặc biệt."""
+    text = " ".join(p for p in parts if p)
+    text = unidecode(text.lower())
+    text = _NORMALISE_RE.sub(" ", text)
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def search_clause(search_text, column='search_norm'):
+    """
+    Trả về (sql, params) lọc theo full-text index ngram trên cột shadow đã normalise.
+    Từ ngắn hơn 1 ngram không tra được qua index -> fallback LIKE trên cùng cột.
+    Trả về (None, []) nếu search_text rỗng sau khi normalise.
+    """
+    norm = normalise(search_text)
+    if not norm:
+        return None, []
+    if min(len(word) for word in norm.split()) < NGRAM_TOKEN_SIZE:
+        return f"{column} LIKE %s", [f"%{norm}%"]
+    return f"MATCH({column}) AGAINST (%s IN BOOLEAN MODE)", [f'"{norm}"']
@@ -0,0 +1,172 @@
+"""
+Core ghi transaction, dùng chung cho crud_transaction (API) và sqs_processor (in-process pipeline).
+Các hàm nhận cursor của caller -> caller quyết định phạm vi DB transaction và commit.
+"""
+import math
+import uuid
+from datetime import datetime
+
+from common.text import normalise
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+# Giới hạn theo sql/transactions.sql: VARCHAR(n) tính theo ký tự, TEXT tối đa 65535 byte
+TEXT_MAX_LENGTHS = {
+    'user_id': 36, 'merchant': 255, 'to_account_name': 255, 'location': 255,
+    'channel': 20, 'tranx_type': 30, 'category_label': 10,
+    'idempotency_key': IDEMPOTENCY_KEY_MAX_LENGTH,
+}
+MSG_CONTENT_MAX_BYTES = 65535
+AMOUNT_MAX = 10 ** 13  # DECIMAL(15, 2)
+# txn_time: giờ địa phương, không timezone; phần lẻ giây bị bỏ khi ghi
+TXN_TIME_FORMATS = ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d')
+TXN_TIME_DB_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Trong khoảng của cột TIMESTAMP (1970-01-01 00:00:01 -> 2038-01-19 03:14:07 UTC), chừa 1 ngày cho timezone
+TXN_TIME_MIN = datetime(1970, 1, 2)
+TXN_TIME_MAX = datetime(2038, 1, 18)
+
+INSERT_COLUMNS = (
+    "transaction_id", "user_id", "amount", "txn_time", "msg_content",
+    "merchant", "to_account_name", "location", "channel",
+    "tranx_type", "category_label", "is_manual_override", "label_from_prior",
+    "search_norm", "idempotency_key",
+)
+
+INSERT_SQL = f"""
+    INSERT INTO transactions ({", ".join(INSERT_COLUMNS)}, created_at, updated_at)
+    VALUES ({", ".join(["%s"] * len(INSERT_COLUMNS))}, NOW(), NOW())
+"""
+# Chỉ có placeholder trong VALUES -> pymysql executemany gộp thành INSERT nhiều dòng
+# (created_at / updated_at lấy DEFAULT CURRENT_TIMESTAMP)
+BULK_INSERT_SQL = f"""
+    INSERT INTO transactions ({", ".join(INSERT_COLUMNS)})
+    VALUES ({", ".join(["%s"] * len(INSERT_COLUMNS))})
+"""
+
+
+def parse_txn_time(value):
+    """txn_time theo 1 trong TXN_TIME_FORMATS -> datetime đã bỏ phần lẻ giây (đúng giá trị được ghi vào DB)."""
+    if isinstance(value, str):
+        for fmt in TXN_TIME_FORMATS:
+            try:
+                parsed = datetime.strptime(value.strip(), fmt).replace(microsecond=0)
+            except ValueError:
+                continue
+            if TXN_TIME_MIN <= parsed < TXN_TIME_MAX:
+                return parsed
+            raise ValueError("txn_time is out of range")
+    raise ValueError("txn_time must be formatted as YYYY-MM-DD HH:MM:SS or YYYY-MM-DDTHH:MM:SS")
+
+
+def validate_transaction(body):
+    """
+    Trả về thông báo lỗi (400) nếu body không hợp lệ, None nếu hợp lệ.
+    Kiểm tra đủ các ràng buộc của bảng transactions -> body hợp lệ không làm INSERT (kể cả multi-row) bị lỗi.
+    """
+    for field in ('user_id', 'amount', 'txn_time'):
+        if not body.get(field):
+            return f"{field} is required"
+    try:
+        if isinstance(body['amount'], bool):
+            raise TypeError
+        amount = float(body['amount'])
+    except (TypeError, ValueError):
+        return "amount must be a number"
+    # float('nan') <= 0 là False -> phải check finite trước; DECIMAL(15, 2) làm tròn 0.001 thành 0
+    if not math.isfinite(amount):
+        return "amount must be a finite number"
+    if round(amount, 2) <= 0:
+        return "amount must be positive"
+    if amount >= AMOUNT_MAX:
+        return f"amount must be less than {AMOUNT_MAX}"
+    try:
+        parse_txn_time(body['txn_time'])
+    except ValueError as e:
+        return str(e)
+    # tranx_type NOT NULL trong schema
+    if not body.get('tranx_type'):
+        return "tranx_type is required"
+    for field, max_length in TEXT_MAX_LENGTHS.items():
+        value = body.get(field)
+        if value is not None and (not isinstance(value, str) or len(value) > max_length):
+            return f"{field} must be a string of at most {max_length} characters"
+    msg_content = body.get('msg_content')
+    if msg_content is not None and (not isinstance(msg_content, str) or len(msg_content.encode('utf-8')) > MSG_CONTENT_MAX_BYTES):
+        return f"msg_content must be a string of at most {MSG_CONTENT_MAX_BYTES} bytes"
+    if body.get('is_manual_override', False) not in (True, False):
+        return "is_manual_override must be a boolean"
+    return None
+
+
+def transaction_row(body, transaction_id=None, label_from_prior=False):
+    """
+    Tuple giá trị theo INSERT_COLUMNS cho 1 body đã validate.
+    label_from_prior chỉ do pipeline đặt (category_label lấy từ labels.lookup_many), không đọc từ body của client.
+    """
+    return (
+        transaction_id or str(uuid.uuid4()),
+        body['user_id'],
+        float(body['amount']),
+        parse_txn_time(body['txn_time']).strftime(TXN_TIME_DB_FORMAT),
+        body.get('msg_content'),
+        body.get('merchant'),
+        body.get('to_account_name'),
+        body.get('location'),
+        body.get('channel'),
+        body.get('tranx_type'),
+        body.get('category_label'),
+        body.get('is_manual_override', False),
+        label_from_prior,
+        normalise(body.get('msg_content'), body.get('merchant')),
+        body.get('idempotency_key'),
+    )
+
+
+def insert_transaction(cursor, body, label_from_prior=False):
+    """
+    INSERT 1 transaction, trả về transaction_id.
+    Lỗi FK (user không tồn tại) / trùng idempotency_key được raise nguyên dạng IntegrityError.
+    """
+    row = transaction_row(body, label_from_prior=label_from_prior)
+    cursor.execute(INSERT_SQL, row)
+    return row[0]
+
+
+def insert_transactions(cursor, rows):
+    """INSERT nhiều transaction (tuple theo INSERT_COLUMNS) bằng 1 lệnh multi-row."""
+    if rows:
+        cursor.executemany(BULK_INSERT_SQL, rows)
+
+
+def existing_idempotency_keys(cursor, pairs):
+    """Trong các cặp (user_id, idempotency_key), trả về set các cặp đã có trong DB."""
+    if not pairs:
+        return set()
+    placeholders = ", ".join(["(%s, %s)"] * len(pairs))
+    cursor.execute(
+        f"SELECT user_id, idempotency_key FROM transactions WHERE (user_id, idempotency_key) IN ({placeholders})",
+        [v for pair in pairs for v in pair]
+    )
+    return {(row['user_id'], row['idempotency_key']) for row in cursor.fetchall()}
+
+
+def row_y_month(row):
+    """y_month (YYYY-MM) của 1 tuple transaction_row, bằng DATE_FORMAT(txn_time, '%Y-%m') sau khi ghi, không cần query lại."""
+    return row[INSERT_COLUMNS.index('txn_time')][:7]
+
+
+def find_by_idempotency_key(cursor, user_id, idempotency_key):
+    cursor.execute(
+        "SELECT transaction_id, category_label FROM transactions WHERE user_id = %s AND idempotency_key = %s",
+        (user_id, idempotency_key)
+    )
+    return cursor.fetchone()
+
+
+def transaction_y_month(cursor, transaction_id):
+    """y_month (YYYY-MM) theo txn_time đã lưu -> khớp với y_month classify_transaction dùng cho jar."""
+    cursor.execute(
+        "SELECT DATE_FORMAT(txn_time, '%%Y-%%m') AS y_month FROM transactions WHERE transaction_id = %s",
+        (transaction_id,)
+    )
+    row = cursor.fetchone()
+    return row['y_month'] if row else None
@@ -1,6 +1,7 @@
 import json
 import os
-import pymysql
+from common import db
+from common.text import normalise, search_clause
 import logging
 from datetime import datetime, date
 import uuid
@@ -17,26 +18,13 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.environ['DB_HOST'],
-        port=int(os.environ['DB_PORT']),
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
-
-def user_exists(user_id):
-    conn = get_db_connection()
-    with conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone() is not None
-
 def handler(event, context):
     logger.info(f"Incoming event: {json.dumps(event)}")
 
+    # Direct invoke (không qua API Gateway) cho các tác vụ bảo trì
+    if event.get('action') == 'backfill_search_norm':
+        return backfill_search_norm(event)
+
     path = event.get('path', '')
     method = event.get('httpMethod', '').upper()
 
@@ -93,8 +81,6 @@ def search_goals(event):
     search_text = body.get('search_text', '')
     if not user_id:
         return response(400, {"error": "user_id is required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     page_size = pagination.get('page_size', 20)
     current = pagination.get('current', 1)
     offset = (current - 1) * page_size
@@ -128,18 +114,21 @@ def search_goals(event):
         params.append(filters['to_date'])
         count_query += " AND created_at <= %s"
         count_params.append(filters['to_date'])
-    if search_text:
-        query += " AND (goal_name LIKE %s OR description LIKE %s)"
-        params.extend([f"%{search_text}%", f"%{search_text}%"])
-        count_query += " AND (goal_name LIKE %s OR description LIKE %s)"
-        count_params.extend([f"%{search_text}%", f"%{search_text}%"])
+    # Full-text (ngram) trên search_norm = goal_name (+ description) đã bỏ dấu
+    search_sql, search_params = search_clause(search_text)
+    if search_sql:
+        query += f" AND {search_sql}"
+        params.extend(search_params)
+        count_query += f" AND {search_sql}"
+        count_params.extend(search_params)
     query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
     params.extend([page_size, offset])
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(query, tuple(params))
             rows = cursor.fetchall()
+            if not rows and not db.user_exists(user_id, conn):
+                return response(404, {"error": "User not found"})
             cursor.execute(count_query, tuple(count_params))
             total = cursor.fetchone()['total']
     return response(200, {"goals": rows, "total": total})
@@ -149,8 +138,7 @@ def get_goals(event):
     if not user_id:
         return response(400, {"error": "user_id is required"})
 
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 SELECT * FROM saving_goals
@@ -163,8 +151,7 @@ def get_goals(event):
 def get_goal_by_id(event):
     goal_id = event['pathParameters']['id']
 
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 SELECT * FROM saving_goals WHERE goal_id = %s
@@ -193,126 +180,125 @@ def set_goal(user_id, data):
     total_monthly_amount = Decimal(data.get("total_monthly_amount", 0))
     new_goals = data.get("goals", [])
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db.connection() as conn:
+        cur = conn.cursor()
 
-    try:
-        cur.execute("SELECT * FROM saving_goals WHERE user_id = %s AND status = 1", (user_id,))
-        existing_goals = cur.fetchall()
+        try:
+            cur.execute("SELECT * FROM saving_goals WHERE user_id = %s AND status = 1", (user_id,))
+            existing_goals = cur.fetchall()
 
-        if len(existing_goals) + len(new_goals) > 5:
-            return {"status": "error", "message": "Cannot have more than 5 active goals."}
+            if len(existing_goals) + len(new_goals) > 5:
+                return {"status": "error", "message": "Cannot have more than 5 active goals."}
 
-        now = datetime.now()
+            now = datetime.now()
 
-        locked, unlocked = [], []
-        for g in existing_goals:
-            if g['eta_lock']:
-                locked.append(g)
-            else:
-                unlocked.append(g)
-
-        locked_total = sum(Decimal(g['month_req']) for g in locked)
-        remaining = total_monthly_amount - locked_total
-
-        if remaining < 0:
-            return {"status": "error", "message": "Monthly amount too small to satisfy locked goals."}
-
-        all_unlocked = unlocked + new_goals
-
-        pri_map = {1: [], 2: [], 3: []}
-        for g in all_unlocked:
-            pri_map[int(g['priority_level'])].append(g)
-
-        tier_limits = {1: 1, 2: 2, 3: 2}
-        total_base = 0
-        for level in [1, 2, 3]:
-            actual = len(pri_map[level])
-            allowed = tier_limits[level]
-            total_base += Decimal(BASE_WEIGHT_POOL[level]) * Decimal(min(actual, allowed)) / Decimal(allowed)
-
-        present_weights = []
-        for level in [1, 2, 3]:
-            if pri_map[level]:
-                base_weight = Decimal(BASE_WEIGHT_POOL[level]) / tier_limits[level]
-                for g in pri_map[level]:
-                    present_weights.append((g, base_weight))
-
-        total_present_weight = sum(w for _, w in present_weights)
-
-        locked_weight = locked_total / total_monthly_amount if total_monthly_amount > 0 else Decimal(0)
-        unlocked_weight_budget = Decimal(1) - locked_weight
-
-        # Redistribute weights (do not normalize further)
-        redistributed = [(g, unlocked_weight_budget * (w / total_present_weight)) for g, w in present_weights]
-
-        # Build weight_map once
-        weight_map = {}
-        for g, w in redistributed:
-            key = g['goal_id'] if 'goal_id' in g else g['goal_name']
-            weight_map[key] = w
-
-        responses = []
-        for g in new_goals:
-            gid = str(datetime.timestamp(now)) + g['goal_name'][:5]
-            tgt_amt = Decimal(g['target_amount'])
-            key = g['goal_id'] if 'goal_id' in g else g['goal_name']
-            weight = weight_map[key]
-            month_req = round(remaining * weight, 2)
-            eta_months = calculate_eta(tgt_amt, 0, month_req)
-            target_date = (now + relativedelta(months=+eta_months)).replace(day=1) if eta_months else None
+            locked, unlocked = [], []
+            for g in existing_goals:
+                if g['eta_lock']:
+                    locked.append(g)
+                else:
+                    unlocked.append(g)
 
-            cur.execute("""
-                INSERT INTO saving_goals (
-                    goal_id, user_id, goal_name, target_amount, current_amount,
-                    target_date, goal_type, priority_level, weight, status,
-                    eta_lock, initial_target_date, sent_money, month_req,
-                    created_at, updated_at
-                ) VALUES (
-                    %s, %s, %s, %s, 0.00,
-                    %s, %s, %s, %s, 1,
-                    %s, %s, FALSE, %s,
-                    %s, %s
-                )
-            """, (
-                gid, user_id, g['goal_name'], tgt_amt,
-                target_date.date(), g['goal_type'], int(g['priority_level']),
-                round(weight, 5), bool(g['eta_lock']), target_date.date(), month_req,
-                now, now
-            ))
-            responses.append({
-                "goal_id": gid,
-                "goal_name": g['goal_name'],
-                "month_req": float(month_req),
-                "weight": float(weight)
-            })
-        start_date = datetime.today().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        for g in unlocked:
-            gid = g['goal_id']
-            tgt_amt = Decimal(g['target_amount'])
-            key = gid
-            weight = weight_map[key]
-            month_req = round(remaining * weight, 2)
-            eta_months = calculate_eta(tgt_amt, Decimal(g['current_amount']), month_req)
-            target_date = (start_date + relativedelta(months=+eta_months)).replace(day=1) if eta_months else None
+            locked_total = sum(Decimal(g['month_req']) for g in locked)
+            remaining = total_monthly_amount - locked_total
 
-            cur.execute("""
-                UPDATE saving_goals
-                   SET weight = %s, month_req = %s, target_date = %s, updated_at = %s
-                 WHERE goal_id = %s
-            """, (round(weight, 5), month_req, target_date.date(), now, gid))
+            if remaining < 0:
+                return {"status": "error", "message": "Monthly amount too small to satisfy locked goals."}
 
-        conn.commit()
-        return {"status": "success", "message": "Goals updated."}
+            all_unlocked = unlocked + new_goals
 
-    except Exception as e:
-        conn.rollback()
-        logger.exception("Unhandled exception in set_goal")
-        return {"status": "error", "message": str(e)}
+            pri_map = {1: [], 2: [], 3: []}
+            for g in all_unlocked:
+                pri_map[int(g['priority_level'])].append(g)
+
+            tier_limits = {1: 1, 2: 2, 3: 2}
+            total_base = 0
+            for level in [1, 2, 3]:
+                actual = len(pri_map[level])
+                allowed = tier_limits[level]
+                total_base += Decimal(BASE_WEIGHT_POOL[level]) * Decimal(min(actual, allowed)) / Decimal(allowed)
+
+            present_weights = []
+            for level in [1, 2, 3]:
+                if pri_map[level]:
+                    base_weight = Decimal(BASE_WEIGHT_POOL[level]) / tier_limits[level]
+                    for g in pri_map[level]:
+                        present_weights.append((g, base_weight))
+
+            total_present_weight = sum(w for _, w in present_weights)
+
+            locked_weight = locked_total / total_monthly_amount if total_monthly_amount > 0 else Decimal(0)
+            unlocked_weight_budget = Decimal(1) - locked_weight
+
+            # Redistribute weights (do not normalize further)
+            redistributed = [(g, unlocked_weight_budget * (w / total_present_weight)) for g, w in present_weights]
+
+            # Build weight_map once
+            weight_map = {}
+            for g, w in redistributed:
+                key = g['goal_id'] if 'goal_id' in g else g['goal_name']
+                weight_map[key] = w
+
+            responses = []
+            for g in new_goals:
+                gid = str(datetime.timestamp(now)) + g['goal_name'][:5]
+                tgt_amt = Decimal(g['target_amount'])
+                key = g['goal_id'] if 'goal_id' in g else g['goal_name']
+                weight = weight_map[key]
+                month_req = round(remaining * weight, 2)
+                eta_months = calculate_eta(tgt_amt, 0, month_req)
+                target_date = (now + relativedelta(months=+eta_months)).replace(day=1) if eta_months else None
+
+                cur.execute("""
+                    INSERT INTO saving_goals (
+                        goal_id, user_id, goal_name, target_amount, current_amount,
+                        target_date, goal_type, priority_level, weight, status,
+                        eta_lock, initial_target_date, sent_money, month_req,
+                        search_norm, created_at, updated_at
+                    ) VALUES (
+                        %s, %s, %s, %s, 0.00,
+                        %s, %s, %s, %s, 1,
+                        %s, %s, FALSE, %s,
+                        %s, %s, %s
+                    )
+                """, (
+                    gid, user_id, g['goal_name'], tgt_amt,
+                    target_date.date(), g['goal_type'], int(g['priority_level']),
+                    round(weight, 5), bool(g['eta_lock']), target_date.date(), month_req,
+                    normalise(g['goal_name'], g.get('description')), now, now
+                ))
+                responses.append({
+                    "goal_id": gid,
+                    "goal_name": g['goal_name'],
+                    "month_req": float(month_req),
+                    "weight": float(weight)
+                })
+            start_date = datetime.today().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            for g in unlocked:
+                gid = g['goal_id']
+                tgt_amt = Decimal(g['target_amount'])
+                key = gid
+                weight = weight_map[key]
+                month_req = round(remaining * weight, 2)
+                eta_months = calculate_eta(tgt_amt, Decimal(g['current_amount']), month_req)
+                target_date = (start_date + relativedelta(months=+eta_months)).replace(day=1) if eta_months else None
+
+                cur.execute("""
+                    UPDATE saving_goals
+                       SET weight = %s, month_req = %s, target_date = %s, updated_at = %s
+                     WHERE goal_id = %s
+                """, (round(weight, 5), month_req, target_date.date(), now, gid))
+
+            conn.commit()
+            return {"status": "success", "message": "Goals updated."}
 
-    finally:
-        cur.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Unhandled exception in set_goal")
+            return {"status": "error", "message": str(e)}
+
+        finally:
+            cur.close()
 
 
 
@@ -348,222 +334,239 @@ def calc_month_req(target, current, months, rate):
 def allocate_saving(user_id, sent_amount):
     rate = Decimal(str(1.02 ** (1 / 12) - 1))
     now = datetime.now()
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db.connection() as conn:
+        cur = conn.cursor()
 
-    try:
-        cur.execute("""
-            SELECT goal_id, target_amount, current_amount, target_date, initial_target_date,
-                   weight, month_req, eta_lock
-              FROM saving_goals
-             WHERE user_id = %s AND status = 1 AND sent_money = 0
-        """, (user_id,))
-        goals = cur.fetchall()
-
-        if not goals:
-            return {"status": "success", "message": "No active goals pending allocation."}
-
-        total_required = sum(Decimal(g["month_req"] or 0) for g in goals)
-        sent_amount = Decimal(sent_amount)
-        allocation = []
-
-        if sent_amount >= total_required:
-            # No deficit: pay all, distribute surplus
-            remaining = sent_amount
-            for g in goals:
-                amt = Decimal(g["month_req"] or 0)
-                g["current_amount"] += amt
-                remaining -= amt
-                allocation.append((g["goal_id"], amt))
+        try:
+            cur.execute("""
+                SELECT goal_id, target_amount, current_amount, target_date, initial_target_date,
+                       weight, month_req, eta_lock
+                  FROM saving_goals
+                 WHERE user_id = %s AND status = 1 AND sent_money = 0
+            """, (user_id,))
+            goals = cur.fetchall()
+
+            if not goals:
+                return {"status": "success", "message": "No active goals pending allocation."}
 
-            if remaining > 0:
+            total_required = sum(Decimal(g["month_req"] or 0) for g in goals)
+            sent_amount = Decimal(sent_amount)
+            allocation = []
+
+            if sent_amount >= total_required:
+                # No deficit: pay all, distribute surplus
+                remaining = sent_amount
+                for g in goals:
+                    amt = Decimal(g["month_req"] or 0)
+                    g["current_amount"] += amt
+                    remaining -= amt
+                    allocation.append((g["goal_id"], amt))
+
+                if remaining > 0:
+                    total_weight = sum(float(g["weight"] or 0) for g in goals)
+                    for g in goals:
+                        extra = remaining * Decimal(g["weight"] or 0) / Decimal(total_weight)
+                        g["current_amount"] += extra
+                        allocation.append((g["goal_id"], extra))
+
+            else:
+                # Deficit: distribute by weight
                 total_weight = sum(float(g["weight"] or 0) for g in goals)
                 for g in goals:
-                    extra = remaining * Decimal(g["weight"] or 0) / Decimal(total_weight)
-                    g["current_amount"] += extra
-                    allocation.append((g["goal_id"], extra))
+                    weight = Decimal(g["weight"] or 0)
+                    portion = sent_amount * weight / Decimal(total_weight)
+                    g["current_amount"] += portion
+                    allocation.append((g["goal_id"], portion))
 
-        else:
-            # Deficit: distribute by weight
-            total_weight = sum(float(g["weight"] or 0) for g in goals)
+            # Recalculate month_req or target_date based on updated current_amount
             for g in goals:
-                weight = Decimal(g["weight"] or 0)
-                portion = sent_amount * weight / Decimal(total_weight)
-                g["current_amount"] += portion
-                allocation.append((g["goal_id"], portion))
-
-        # Recalculate month_req or target_date based on updated current_amount
-        for g in goals:
-            target = Decimal(g["target_amount"])
-            current = Decimal(g["current_amount"])
-            if g["eta_lock"]:
-                months = (g["target_date"].replace(day=1) - date.today().replace(day=1)).days // 30
-                new_month_req = calc_month_req(target, current, months, rate)
-                g["month_req"] = new_month_req
-                cur.execute("""
-                    UPDATE saving_goals
-                       SET month_req = %s, updated_at = %s
-                     WHERE goal_id = %s
-                """, (new_month_req, now, g["goal_id"]))
-            else:
-                monthly = Decimal(g["month_req"] or 0)
-                eta = calc_eta(target, current, monthly, rate)
-                if eta:
-                    new_target = date.today() + relativedelta(months=eta)
-                    g["target_date"] = new_target
+                target = Decimal(g["target_amount"])
+                current = Decimal(g["current_amount"])
+                if g["eta_lock"]:
+                    months = (g["target_date"].replace(day=1) - date.today().replace(day=1)).days // 30
+                    new_month_req = calc_month_req(target, current, months, rate)
+                    g["month_req"] = new_month_req
                     cur.execute("""
                         UPDATE saving_goals
-                           SET target_date = %s, updated_at = %s
+                           SET month_req = %s, updated_at = %s
                          WHERE goal_id = %s
-                    """, (new_target, now, g["goal_id"]))
+                    """, (new_month_req, now, g["goal_id"]))
+                else:
+                    monthly = Decimal(g["month_req"] or 0)
+                    eta = calc_eta(target, current, monthly, rate)
+                    if eta:
+                        new_target = date.today() + relativedelta(months=eta)
+                        g["target_date"] = new_target
+                        cur.execute("""
+                            UPDATE saving_goals
+                               SET target_date = %s, updated_at = %s
+                             WHERE goal_id = %s
+                        """, (new_target, now, g["goal_id"]))
+
+            # Recalculate weights based on month_req
+            total_month_req = sum(Decimal(g["month_req"] or 0) for g in goals)
+            for g in goals:
+                new_weight = Decimal(g["month_req"] or 0) / total_month_req if total_month_req > 0 else 0
+                cur.execute("""
+                    UPDATE saving_goals
+                       SET weight = %s, updated_at = %s
+                     WHERE goal_id = %s
+                """, (new_weight, now, g["goal_id"]))
 
-        # Recalculate weights based on month_req
-        total_month_req = sum(Decimal(g["month_req"] or 0) for g in goals)
-        for g in goals:
-            new_weight = Decimal(g["month_req"] or 0) / total_month_req if total_month_req > 0 else 0
-            cur.execute("""
-                UPDATE saving_goals
-                   SET weight = %s, updated_at = %s
-                 WHERE goal_id = %s
-            """, (new_weight, now, g["goal_id"]))
+            # Final update: current_amount and sent_money
+            for gid, added in allocation:
+                cur.execute("""
+                    UPDATE saving_goals
+                       SET current_amount = current_amount + %s,
+                           sent_money = 1,
+                           updated_at = %s
+                     WHERE goal_id = %s
+                """, (added, now, gid))
 
-        # Final update: current_amount and sent_money
-        for gid, added in allocation:
-            cur.execute("""
-                UPDATE saving_goals
-                   SET current_amount = current_amount + %s,
-                       sent_money = 1,
-                       updated_at = %s
-                 WHERE goal_id = %s
-            """, (added, now, gid))
-
-        conn.commit()
-        return {
-            "status": "success",
-            "message": f"Allocated {float(sent_amount)} across {len(goals)} goals."
-        }
+            conn.commit()
+            return {
+                "status": "success",
+                "message": f"Allocated {float(sent_amount)} across {len(goals)} goals."
+            }
 
-    except Exception as e:
-        conn.rollback()
-        logger.exception("Error during allocation")
-        return {"status": "error", "message": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Error during allocation")
+            return {"status": "error", "message": str(e)}
+        finally:
+            cur.close()
 
 #delete_goal function
 def delete_goal(goal_id, user_id):
     rate = 1.02 ** (1 / 12) - 1
     now = datetime.now()
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with db.connection() as conn:
+        cur = conn.cursor()
 
-    try:
-        # 1. Delete goal
-        cur.execute("""
-            DELETE FROM saving_goals
-             WHERE goal_id = %s AND user_id = %s AND status = 1
-        """, (goal_id, user_id))
-        if cur.rowcount == 0:
-            return {"status": "error", "message": "Goal not found or already inactive."}
-
-        # 2. Fetch remaining active goals
-        cur.execute("""
-            SELECT goal_id, month_req
-              FROM saving_goals
-             WHERE user_id = %s AND status = 1
-        """, (user_id,))
-        updated_goals = cur.fetchall()
-
-        if not updated_goals:
+        try:
+            # 1. Delete goal
+            cur.execute("""
+                DELETE FROM saving_goals
+                 WHERE goal_id = %s AND user_id = %s AND status = 1
+            """, (goal_id, user_id))
+            if cur.rowcount == 0:
+                return {"status": "error", "message": "Goal not found or already inactive."}
+
+            # 2. Fetch remaining active goals
+            cur.execute("""
+                SELECT goal_id, month_req
+                  FROM saving_goals
+                 WHERE user_id = %s AND status = 1
+            """, (user_id,))
+            updated_goals = cur.fetchall()
+
+            if not updated_goals:
+                return {
+                    "status": "success",
+                    "message": f"Goal {goal_id} deleted. No remaining active goals.",
+                }
+
+            # 3. Recalculate weights based on existing month_req values
+            total_req = sum(float(g["month_req"]) for g in updated_goals if g["month_req"] and g["month_req"] > 0)
+
+            for g in updated_goals:
+                gid = g["goal_id"]
+                req = float(g["month_req"]) if g["month_req"] else 0
+                weight = round(req / total_req, 5) if total_req > 0 else round(1 / len(updated_goals), 5)
+                cur.execute("""
+                    UPDATE saving_goals
+                       SET weight = %s, updated_at = %s
+                     WHERE goal_id = %s
+                """, (weight, now, gid))
+
+            conn.commit()
             return {
                 "status": "success",
-                "message": f"Goal {goal_id} deleted. No remaining active goals.",
+                "message": f"Goal {goal_id} deleted. Weights updated .",
             }
 
-        # 3. Recalculate weights based on existing month_req values
-        total_req = sum(float(g["month_req"]) for g in updated_goals if g["month_req"] and g["month_req"] > 0)
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Error in delete_goal for user_id %s and goal_id %s", user_id, goal_id)
+            return {"status": "error", "message": str(e)}
+        finally:
+            cur.close()
+
+#pause_goal function
+def pause_goal(goal_id, user_id):
+    rate = 1.02 ** (1 / 12) - 1
+    now = datetime.now()
+
+    with db.connection() as conn:
+        cur = conn.cursor()
 
-        for g in updated_goals:
-            gid = g["goal_id"]
-            req = float(g["month_req"]) if g["month_req"] else 0
-            weight = round(req / total_req, 5) if total_req > 0 else round(1 / len(updated_goals), 5)
+        try:
+            # 1. Pause the goal (set status = 0)
             cur.execute("""
                 UPDATE saving_goals
-                   SET weight = %s, updated_at = %s
-                 WHERE goal_id = %s
-            """, (weight, now, gid))
+                   SET status = 0, updated_at = %s
+                 WHERE goal_id = %s AND user_id = %s AND status = 1
+            """, (now, goal_id, user_id))
+            if cur.rowcount == 0:
+                return {"status": "error", "message": "Goal not found or already inactive."}
 
-        conn.commit()
-        return {
-            "status": "success",
-            "message": f"Goal {goal_id} deleted. Weights updated .",
-        }
+            # 2. Fetch remaining active goals
+            cur.execute("""
+                SELECT goal_id, month_req
+                  FROM saving_goals
+                 WHERE user_id = %s AND status = 1
+            """, (user_id,))
+            updated_goals = cur.fetchall()
 
-    except Exception as e:
-        conn.rollback()
-        logger.exception("Error in delete_goal for user_id %s and goal_id %s", user_id, goal_id)
-        return {"status": "error", "message": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+            if not updated_goals:
+                return {
+                    "status": "success",
+                    "message": f"Goal {goal_id} paused. No remaining active goals.",
+                }
 
-#pause_goal function
-def pause_goal(goal_id, user_id):
-    rate = 1.02 ** (1 / 12) - 1
-    now = datetime.now()
+            # 3. Recalculate weights based on existing month_req values
+            total_req = sum(float(g["month_req"]) for g in updated_goals if g["month_req"] and g["month_req"] > 0)
 
-    conn = get_db_connection()
-    cur = conn.cursor()
+            for g in updated_goals:
+                gid = g["goal_id"]
+                req = float(g["month_req"]) if g["month_req"] else 0
+                weight = round(req / total_req, 5) if total_req > 0 else round(1 / len(updated_goals), 5)
+                cur.execute("""
+                    UPDATE saving_goals
+                       SET weight = %s, updated_at = %s
+                     WHERE goal_id = %s
+                """, (weight, now, gid))
 
-    try:
-        # 1. Pause the goal (set status = 0)
-        cur.execute("""
-            UPDATE saving_goals
-               SET status = 0, updated_at = %s
-             WHERE goal_id = %s AND user_id = %s AND status = 1
-        """, (now, goal_id, user_id))
-        if cur.rowcount == 0:
-            return {"status": "error", "message": "Goal not found or already inactive."}
-
-        # 2. Fetch remaining active goals
-        cur.execute("""
-            SELECT goal_id, month_req
-              FROM saving_goals
-             WHERE user_id = %s AND status = 1
-        """, (user_id,))
-        updated_goals = cur.fetchall()
-
-        if not updated_goals:
+            conn.commit()
             return {
                 "status": "success",
-                "message": f"Goal {goal_id} paused. No remaining active goals.",
+                "message": f"Goal {goal_id} paused. Weights updated.",
             }
 
-        # 3. Recalculate weights based on existing month_req values
-        total_req = sum(float(g["month_req"]) for g in updated_goals if g["month_req"] and g["month_req"] > 0)
-
-        for g in updated_goals:
-            gid = g["goal_id"]
-            req = float(g["month_req"]) if g["month_req"] else 0
-            weight = round(req / total_req, 5) if total_req > 0 else round(1 / len(updated_goals), 5)
-            cur.execute("""
-                UPDATE saving_goals
-                   SET weight = %s, updated_at = %s
-                 WHERE goal_id = %s
-            """, (weight, now, gid))
-
-        conn.commit()
-        return {
-            "status": "success",
-            "message": f"Goal {goal_id} paused. Weights updated.",
-        }
-
-    except Exception as e:
-        conn.rollback()
-        logger.exception("Error in pause_goal for user_id %s and goal_id %s", user_id, goal_id)
-        return {"status": "error", "message": str(e)}
-    finally:
-        cur.close()
-        conn.close()
+        except Exception as e:
+            conn.rollback()
+            logger.exception("Error in pause_goal for user_id %s and goal_id %s", user_id, goal_id)
+            return {"status": "error", "message": str(e)}
+        finally:
+            cur.close()
+
+def backfill_search_norm(event):
+    """Điền search_norm cho các goal cũ (trước khi có cột shadow)."""
+    batch_size = int(event.get('batch_size', 1000))
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT goal_id, goal_name FROM saving_goals
+                WHERE search_norm IS NULL LIMIT %s
+            """, (batch_size,))
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany(
+                    "UPDATE saving_goals SET search_norm = %s WHERE goal_id = %s",
+                    [(normalise(r['goal_name']), r['goal_id']) for r in rows]
+                )
+            conn.commit()
+            cursor.execute("SELECT COUNT(*) as remaining FROM saving_goals WHERE search_norm IS NULL")
+            remaining = cursor.fetchone()['remaining']
+    return response(200, {"updated": len(rows), "remaining": remaining})
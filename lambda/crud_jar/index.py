@@ -1,6 +1,7 @@
 import json
 import os
-import pymysql
+from common import db
+from common.jars import apply_spending, jar_code_for, NO_JAR_TRANX_TYPES
 import logging
 from datetime import datetime
 import re
@@ -15,23 +16,6 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.environ['DB_HOST'],
-        port=int(os.environ['DB_PORT']),
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
-
-def user_exists(user_id):
-    conn = get_db_connection()
-    with conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone() is not None
-
 def handler(event, context):
     # Support both HTTP and direct Lambda invoke (for SQS processor)
     if 'action' in event:
@@ -64,11 +48,8 @@ def get_jar_list(event):
     
     if not user_id:
         return response(400, {"error": "user_id is required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             if y_month:
                 cursor.execute("""
@@ -84,6 +65,9 @@ def get_jar_list(event):
                 """, (user_id,))
             
             jars = cursor.fetchall()
+            # User chưa có jar nào mới cần phân biệt với user không tồn tại
+            if not jars and not db.user_exists(user_id, conn):
+                return response(404, {"error": "User not found"})
     
     return response(200, {"jars": jars, "count": len(jars)})
 
@@ -95,8 +79,6 @@ def initialize_jars(event):
         if not body.get(field):
             return response(400, {"error": f"{field} is required"})
     user_id = body['user_id']
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     y_month = body.get('y_month')
     if y_month:
         # Validate format YYYY-MM
@@ -116,8 +98,9 @@ def initialize_jars(event):
     jar_codes = ['NEC', 'FFA', 'LTSS', 'EDU', 'PLY', 'GIV']
     jar_percents = []
     percent_map = {}
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
+        if not db.user_exists(user_id, conn):
+            return response(404, {"error": "User not found"})
         with conn.cursor() as cursor:
             income_type = body.get('income_type')
             if income_type is None:
@@ -240,9 +223,8 @@ def update_jar_percent(event):
         total_percent += percent
     if abs(total_percent - 100) > 1e-6:
         return response(400, {"error": "Total percent must be exactly 100"})
-    conn = get_db_connection()
     try:
-        with conn:
+        with db.connection() as conn:
             with conn.cursor() as cursor:
                 updated_jars = []
                 for jar_data in jars:
@@ -292,6 +274,7 @@ def update_jar_amount(event):
     """
     Update spent_amount for the correct jar after transaction classification.
     Expects: user_id, amount, tranx_type, category_label (all required)
+    Optional: idempotency_key - cùng key chỉ được cộng/trừ 1 lần (retry từ SQS / async invoke)
     """
     body = json.loads(event.get('body', '{}'))
     missing_fields = []
@@ -309,27 +292,31 @@ def update_jar_amount(event):
         missing_fields.append('category_label')
     from datetime import datetime
     y_month = body.get('y_month') or datetime.now().strftime('%Y-%m')
+    idempotency_key = body.get('idempotency_key')
     if missing_fields:
         logger.error(f"Missing required fields in update_jar_amount: {missing_fields}. Body: {body}")
         return response(400, {"error": f"Missing required fields: {', '.join(missing_fields)}", "body": body})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found", "user_id": user_id})
     # Map category_label to jar_code (default: category_label == jar_code, else NEC)
-    jar_code = category_label.upper() if category_label.upper() in ['NEC','FFA','LTSS','EDU','PLY','GIV'] else 'NEC'
+    jar_code = jar_code_for(category_label)
     # Only skip update for transfer_in, cashback, refund
-    if tranx_type in ['transfer_in', 'cashback', 'refund']:
+    if tranx_type in NO_JAR_TRANX_TYPES:
         return response(200, {"message": "No update needed for this transaction type", "jar_code": jar_code})
     # All other types: update spent_amount
-    conn = get_db_connection()
     try:
-        with conn:
+        with db.connection() as conn:
             with conn.cursor() as cursor:
-                # Update spent_amount for the correct jar
-                cursor.execute("""
-                    UPDATE user_jar_spending
-                    SET spent_amount = spent_amount + %s, updated_at = NOW()
-                    WHERE user_id = %s AND y_month = %s AND jar_code = %s
-                """, (float(amount), user_id, y_month, jar_code))
+                try:
+                    result = apply_spending(cursor, user_id, amount, tranx_type, category_label, y_month, idempotency_key)
+                except Exception as e:
+                    if db.is_missing_user_error(e):
+                        return response(404, {"error": "User not found", "user_id": user_id})
+                    raise
+                if result["duplicate"]:
+                    logger.info(f"Jar update already applied for idempotency_key {idempotency_key}")
+                    return response(200, {"message": "Jar spent_amount already updated", "user_id": user_id, "y_month": y_month, "jar_code": jar_code, "amount": amount, "duplicate": True})
+                # Không có dòng nào được update thì mới cần check user (trường hợp hiếm)
+                if result["updated"] == 0 and not db.user_exists(user_id, conn):
+                    return response(404, {"error": "User not found", "user_id": user_id})
             conn.commit()
     except Exception as e:
         logger.error(f"DB error: {str(e)}")
@@ -1,6 +1,6 @@
 import json
 import os
-import pymysql
+from common import db
 import logging
 from datetime import datetime
 
@@ -14,23 +14,6 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.environ['DB_HOST'],
-        port=int(os.environ['DB_PORT']),
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
-
-def user_exists(user_id):
-    conn = get_db_connection()
-    with conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone() is not None
-
 def handler(event, context):
     path = event.get('path')
     method = event.get('httpMethod')
@@ -55,8 +38,6 @@ def search_notifications(event):
     filters = body.get('filters', {})
     if not user_id:
         return response(400, {"error": "user_id is required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     page_size = pagination.get('page_size', 20)
     current = pagination.get('current', 1)
     offset = (current - 1) * page_size
@@ -88,11 +69,12 @@ def search_notifications(event):
         count_params.append(filters['to_date'])
     query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
     params.extend([page_size, offset])
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(query, tuple(params))
             rows = cursor.fetchall()
+            if not rows and not db.user_exists(user_id, conn):
+                return response(404, {"error": "User not found"})
             cursor.execute(count_query, tuple(count_params))
             total = cursor.fetchone()['total']
     return response(200, {"notifications": rows, "total": total})
@@ -104,29 +86,33 @@ def create_notification(event):
         if not body.get(field):
             return response(400, {"error": f"{field} is required"})
     user_id = body['user_id']
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     import uuid
     notification_id = str(uuid.uuid4())
-    conn = get_db_connection()
-    with conn:
-        with conn.cursor() as cursor:
-            cursor.execute("""
-                INSERT INTO notifications (
-                    notification_id, user_id, title, message, notification_type, severity, object_code, object_id, status, created_at
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
-            """, (
-                notification_id,
-                user_id,
-                body['title'],
-                body['message'],
-                body['notification_type'],
-                body['severity'],
-                body['object_code'],
-                body['object_id'],
-                body.get('status', 'unread')
-            ))
-        conn.commit()
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO notifications (
+                        notification_id, user_id, title, message, notification_type, severity, object_code, object_id, status, created_at
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, NOW())
+                """, (
+                    notification_id,
+                    user_id,
+                    body['title'],
+                    body['message'],
+                    body['notification_type'],
+                    body['severity'],
+                    body['object_code'],
+                    body['object_id'],
+                    body.get('status', 'unread')
+                ))
+            conn.commit()
+    except Exception as e:
+        # FK fk_notifications_user thay cho query check user trước khi INSERT
+        if db.is_missing_user_error(e):
+            return response(404, {"error": "User not found"})
+        raise
+    db.remember_user(user_id)
     return response(201, {"message": "Notification created", "notification_id": notification_id})
 
 def mark_notification_status(event):
@@ -138,14 +124,13 @@ def mark_notification_status(event):
     status = body.get('status')
     if not notification_id or not user_id or not status:
         return response(400, {"error": "notification_id, user_id, and status are required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 UPDATE notifications SET status = %s
                 WHERE notification_id = %s AND user_id = %s
             """, (status, notification_id, user_id))
+            if cursor.rowcount == 0 and not db.user_exists(user_id, conn):
+                return response(404, {"error": "User not found"})
         conn.commit()
     return response(200, {"message": "Notification status updated"})
@@ -1,12 +1,19 @@
 import json
 import os
-import pymysql
+import base64
+from common import db, transactions, labels
+from common.text import normalise, search_clause
 import logging
 import boto3
+from common.jars import apply_spending_bulk
 LAMBDA_CLIENT = boto3.client('lambda')
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# /transaction/bulk: số dòng tối đa mỗi request và số dòng mỗi lệnh INSERT nhiều dòng
+BULK_MAX_ROWS = int(os.environ.get('BULK_MAX_ROWS', 10000))
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', 500))
+
 def response(status, body):
     return {
         'statusCode': status,
@@ -14,24 +21,12 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.environ['DB_HOST'],
-        port=int(os.environ['DB_PORT']),
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
-
-def user_exists(user_id):
-    conn = get_db_connection()
-    with conn:
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
-            return cursor.fetchone() is not None
-
 def handler(event, context):
+    # Direct invoke (không qua API Gateway) cho các tác vụ bảo trì
+    if event.get('action') == 'backfill_search_norm':
+        return backfill_search_norm(event)
+    if event.get('action') == 'backfill_counterparty_labels':
+        return backfill_counterparty_labels(event)
     path = event.get('path')
     method = event.get('httpMethod')
 
@@ -41,6 +36,8 @@ def handler(event, context):
             return search_transactions(event)
         elif path == "/transaction/create" and method == "POST":
             return create_transaction(event, enhanced=True)
+        elif path == "/transaction/bulk" and method == "POST":
+            return bulk_create_transactions(event)
         elif path and path.startswith("/transaction/") and path.endswith("/classify") and method == "PATCH":
             return classify_transaction(event)
         else:
@@ -49,59 +46,180 @@ def handler(event, context):
         logger.error(f"Error: {str(e)}")
         return response(500, {"error": str(e)})
 
+# ---------------------- Cursor helpers ----------------------
+def encode_cursor(row):
+    """Cursor opaque cho keyset pagination: base64 của (txn_time, transaction_id) của row cuối trang."""
+    raw = json.dumps([str(row['txn_time']), row['transaction_id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    txn_time, transaction_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    return txn_time, transaction_id
+
 # ---------------------- API Handlers ----------------------
 
 def create_transaction(event, enhanced=False):
     body = json.loads(event.get('body', '{}'))
-    required_fields = ['user_id', 'amount', 'txn_time']
-    for field in required_fields:
-        if not body.get(field):
-            return response(400, {"error": f"{field} is required"})
+    # Validate required fields, amount, txn_time format, text lengths, idempotency_key
+    error = transactions.validate_transaction(body)
+    if error:
+        return response(400, {"error": error})
     user_id = body['user_id']
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
-    # Validate amount
+    # Idempotency key (client gửi hoặc SQS messageId): gửi lại cùng key trả về giao dịch đã tạo
+    idempotency_key = body.get('idempotency_key')
     try:
-        amount = float(body['amount'])
-        if amount <= 0:
-            return response(400, {"error": "amount must be positive"})
-    except Exception:
-        return response(400, {"error": "amount must be a number"})
-    # Validate txn_time (optional: check format)
-    import uuid
-    transaction_id = str(uuid.uuid4())
-    conn = get_db_connection()
-    try:
-        with conn:
+        with db.connection() as conn:
             with conn.cursor() as cursor:
-                cursor.execute("""
-                    INSERT INTO transactions (
-                        transaction_id, user_id, amount, txn_time, msg_content,
-                        merchant, to_account_name, location, channel,
-                        tranx_type, category_label, is_manual_override,
-                        created_at, updated_at
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """, (
-                    transaction_id,
-                    body['user_id'],
-                    amount,
-                    body['txn_time'],
-                    body.get('msg_content'),
-                    body.get('merchant'),
-                    body.get('to_account_name'),
-                    body.get('location'),
-                    body.get('channel'),
-                    body.get('tranx_type'),
-                    body.get('category_label'),
-                    body.get('is_manual_override', False)
-                ))
+                transaction_id = transactions.insert_transaction(cursor, body)
+                labels.record_label(
+                    cursor, user_id, body.get('merchant'), body.get('to_account_name'), body.get('tranx_type'),
+                    body.get('category_label'), manual=bool(body.get('is_manual_override'))
+                )
             conn.commit()
     except Exception as e:
+        # User không tồn tại -> FK fk_transactions_user từ chối INSERT, không cần query check trước
+        if db.is_missing_user_error(e):
+            return response(404, {"error": "User not found"})
+        if idempotency_key and db.is_duplicate_key_error(e, 'uq_transactions_idempotency'):
+            return get_transaction_by_idempotency_key(user_id, idempotency_key)
         logger.error(f"DB error: {str(e)}")
         return response(500, {"error": f"DB error: {str(e)}"})
+    db.remember_user(user_id)
     # No orchestration here: SQS processor will handle AI classify and jar update
     return response(201, {"message": "Transaction created", "transaction_id": transaction_id})
 
+def get_transaction_by_idempotency_key(user_id, idempotency_key):
+    """Request lặp lại (retry) -> trả lại kết quả của lần tạo đầu, đánh dấu duplicate."""
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                tx = transactions.find_by_idempotency_key(cursor, user_id, idempotency_key)
+    except Exception as e:
+        logger.error(f"DB error: {str(e)}")
+        return response(500, {"error": f"DB error: {str(e)}"})
+    if not tx:
+        # Bản ghi gốc vừa bị xóa giữa INSERT và SELECT
+        return response(409, {"error": "Duplicate idempotency_key"})
+    logger.info(f"Duplicate create for idempotency_key {idempotency_key} -> {tx['transaction_id']}")
+    return response(201, {
+        "message": "Transaction already created",
+        "transaction_id": tx['transaction_id'],
+        "category_label": tx['category_label'],
+        "duplicate": True
+    })
+
+def parse_bulk_body(event):
+    """
+    Body của /transaction/bulk: JSON array, {"user_id": ..., "transactions": [...]} hoặc NDJSON (mỗi dòng 1 object).
+    user_id ở ngoài dùng làm mặc định cho các dòng không có user_id.
+    """
+    raw = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        raw = base64.b64decode(raw).decode('utf-8')
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    is_ndjson = 'ndjson' in (headers.get('content-type') or '')
+    if not is_ndjson:
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError:
+            is_ndjson = True
+    if is_ndjson:
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+    if isinstance(data, dict):
+        default_user_id = data.get('user_id')
+        items = data.get('transactions') or []
+        if default_user_id:
+            items = [item if not isinstance(item, dict) or item.get('user_id') else {**item, 'user_id': default_user_id} for item in items]
+        return items
+    return data
+
+def bulk_create_transactions(event):
+    """
+    POST /transaction/bulk - import nhiều transaction (vd. lịch sử ngân hàng khi onboarding).
+    Mọi dòng được validate (txn_time, amount, tranx_type, độ dài text...) trước khi chạy SQL;
+    dòng không hợp lệ được trả về trong errors, các dòng còn lại được ghi trong 1 DB transaction:
+    INSERT nhiều dòng theo chunk, jar được cộng 1 lệnh UPDATE cho mỗi (user_id, y_month, jar_code).
+    Dòng có idempotency_key đã tồn tại được bỏ qua (duplicates) -> gửi lại cả file vẫn an toàn.
+    """
+    try:
+        items = parse_bulk_body(event)
+    except Exception as e:
+        return response(400, {"error": f"Invalid JSON / NDJSON body: {str(e)}"})
+    if not isinstance(items, list) or not items:
+        return response(400, {"error": "transactions must be a non-empty array"})
+    if len(items) > BULK_MAX_ROWS:
+        return response(400, {"error": f"At most {BULK_MAX_ROWS} transactions per request"})
+
+    errors = []
+    valid = []  # [(index, body)]
+    seen_keys = set()
+    duplicates = 0
+    for index, body in enumerate(items):
+        if not isinstance(body, dict):
+            errors.append({"index": index, "error": "transaction must be an object"})
+            continue
+        error = transactions.validate_transaction(body)
+        if error:
+            errors.append({"index": index, "error": error})
+            continue
+        key = body.get('idempotency_key')
+        if key:
+            # Trùng key ngay trong request: chỉ giữ dòng đầu
+            if (body['user_id'], key) in seen_keys:
+                duplicates += 1
+                continue
+            seen_keys.add((body['user_id'], key))
+        valid.append((index, body))
+
+    inserted = 0
+    jar_updates = 0
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                # Check user 1 lần cho mỗi user_id thay vì để FK làm fail cả chunk
+                missing_users = {uid for uid in {b['user_id'] for _, b in valid} if not db.user_exists(uid, conn)}
+                if missing_users:
+                    errors.extend({"index": i, "error": "User not found"} for i, b in valid if b['user_id'] in missing_users)
+                    valid = [(i, b) for i, b in valid if b['user_id'] not in missing_users]
+                jar_items = []
+                for start in range(0, len(valid), BULK_CHUNK_SIZE):
+                    chunk = valid[start:start + BULK_CHUNK_SIZE]
+                    existing = transactions.existing_idempotency_keys(
+                        cursor, [(b['user_id'], b['idempotency_key']) for _, b in chunk if b.get('idempotency_key')]
+                    )
+                    new_bodies = [b for _, b in chunk if (b['user_id'], b.get('idempotency_key')) not in existing]
+                    duplicates += len(chunk) - len(new_bodies)
+                    rows = [transactions.transaction_row(b) for b in new_bodies]
+                    transactions.insert_transactions(cursor, rows)
+                    inserted += len(rows)
+                    # Jar chỉ cộng cho dòng đã có category_label (dòng chưa phân loại sẽ cộng khi classify)
+                    labelled = [(row, b) for row, b in zip(rows, new_bodies) if b.get('category_label')]
+                    jar_items.extend(
+                        (row[0], b['user_id'], transactions.row_y_month(row), b['amount'], b.get('tranx_type'), b['category_label'])
+                        for row, b in labelled
+                    )
+                    labels.record_labels(cursor, [
+                        (b['user_id'], b.get('merchant'), b.get('to_account_name'), b.get('tranx_type'),
+                         b['category_label'], bool(b.get('is_manual_override')))
+                        for _, b in labelled
+                    ])
+                # Gộp cả request: mỗi (user_id, y_month, jar_code) 1 lệnh UPDATE
+                jar_updates = len(apply_spending_bulk(cursor, jar_items))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"DB error: {str(e)}")
+        return response(500, {"error": f"DB error: {str(e)}"})
+    logger.info(f"Bulk import: {inserted} inserted, {duplicates} duplicates, {len(errors)} errors, {jar_updates} jar updates")
+    errors.sort(key=lambda e: e['index'])
+    return response(201 if inserted else 200, {
+        "message": "Transactions imported",
+        "inserted": inserted,
+        "duplicates": duplicates,
+        "failed": len(errors),
+        "errors": errors
+    })
+
 def search_transactions(event):
     body = json.loads(event.get('body', '{}'))
     user_id = body.get('user_id')
@@ -110,10 +228,14 @@ def search_transactions(event):
     search_text = body.get('search_text', '')
     if not user_id:
         return response(400, {"error": "user_id is required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
     page_size = pagination.get('page_size', 20)
     current = pagination.get('current', 1)
+    # Có key "cursor" (kể cả null cho trang đầu) -> keyset pagination, không dùng OFFSET
+    use_cursor = 'cursor' in pagination
+    # COUNT(*) quét toàn bộ row khớp filter: mặc định bỏ ở cursor mode
+    include_total = pagination.get('include_total', not use_cursor)
+    if not isinstance(include_total, bool):
+        return response(400, {"error": "include_total must be a boolean"})
     try:
         page_size = int(page_size)
         current = int(current)
@@ -123,6 +245,12 @@ def search_transactions(event):
             return response(400, {"error": "current must be positive"})
     except Exception:
         return response(400, {"error": "page_size and current must be integers"})
+    after = None
+    if use_cursor and pagination.get('cursor'):
+        try:
+            after = decode_cursor(pagination['cursor'])
+        except Exception:
+            return response(400, {"error": "cursor is invalid"})
     offset = (current - 1) * page_size
     query = "SELECT * FROM transactions WHERE user_id = %s"
     params = [user_id]
@@ -148,25 +276,49 @@ def search_transactions(event):
         params.append(filters['to_date'])
         count_query += " AND txn_time <= %s"
         count_params.append(filters['to_date'])
-    if search_text:
-        query += " AND (msg_content LIKE %s OR merchant LIKE %s)"
-        params.extend([f"%{search_text}%", f"%{search_text}%"])
-        count_query += " AND (msg_content LIKE %s OR merchant LIKE %s)"
-        count_params.extend([f"%{search_text}%", f"%{search_text}%"])
-    query += " ORDER BY txn_time DESC LIMIT %s OFFSET %s"
-    params.extend([page_size, offset])
-    conn = get_db_connection()
+    # Full-text (ngram) trên search_norm = msg_content + merchant đã bỏ dấu
+    search_sql, search_params = search_clause(search_text)
+    if search_sql:
+        query += f" AND {search_sql}"
+        params.extend(search_params)
+        count_query += f" AND {search_sql}"
+        count_params.extend(search_params)
+    if use_cursor:
+        if after:
+            query += " AND (txn_time < %s OR (txn_time = %s AND transaction_id < %s))"
+            params.extend([after[0], after[0], after[1]])
+        # Lấy dư 1 row để biết còn trang sau hay không
+        query += " ORDER BY txn_time DESC, transaction_id DESC LIMIT %s"
+        params.append(page_size + 1)
+    else:
+        query += " ORDER BY txn_time DESC, transaction_id DESC LIMIT %s OFFSET %s"
+        params.extend([page_size, offset])
     try:
-        with conn:
+        with db.connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute(query, tuple(params))
                 rows = cursor.fetchall()
-                cursor.execute(count_query, tuple(count_params))
-                total = cursor.fetchone()['total']
+                # Chỉ cần check user khi không có kết quả (có row thì user chắc chắn tồn tại)
+                if not rows and not db.user_exists(user_id, conn):
+                    return response(404, {"error": "User not found"})
+                if include_total:
+                    cursor.execute(count_query, tuple(count_params))
+                    total = cursor.fetchone()['total']
     except Exception as e:
         logger.error(f"DB error: {str(e)}")
         return response(500, {"error": f"DB error: {str(e)}"})
-    return response(200, {"transactions": rows, "total": total})
+    result = {"transactions": rows}
+    if use_cursor:
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        result = {
+            "transactions": rows,
+            "has_more": has_more,
+            "next_cursor": encode_cursor(rows[-1]) if has_more else None
+        }
+    if include_total:
+        result["total"] = total
+    return response(200, result)
 
 def classify_transaction(event):
     # PATCH /:id/classify
@@ -176,22 +328,34 @@ def classify_transaction(event):
     category_label = body.get('category_label')
     if not user_id or not category_label:
         return response(400, {"error": "user_id and category_label are required"})
-    if not user_exists(user_id):
-        return response(404, {"error": "User not found"})
-    conn = get_db_connection()
+    # sqs_processor gửi source = 'ai' (model) hoặc 'prior' (label lịch sử theo đối tác);
+    # mọi nguồn khác (app) là người dùng tự phân loại
+    source = body.get('source')
+    is_manual = source not in ('ai', 'prior')
+    from_prior = source == 'prior'
     y_month = None
     tranx_type = None
     try:
-        with conn:
+        with db.connection() as conn:
             with conn.cursor() as cursor:
                 cursor.execute("SELECT * FROM transactions WHERE transaction_id = %s AND user_id = %s", (transaction_id, user_id))
                 tx = cursor.fetchone()
                 if not tx:
+                    if not db.user_exists(user_id, conn):
+                        return response(404, {"error": "User not found"})
                     return response(404, {"error": "Transaction not found"})
                 old_label = tx.get('category_label')
                 amount = tx['amount']
                 tranx_type = tx['tranx_type']
                 y_month = tx['txn_time'].strftime('%Y-%m') if tx and 'txn_time' in tx and tx['txn_time'] else None
+                # Idempotency key cho jar update: lần áp dụng đầu dùng key cố định theo transaction
+                # (trùng key của sqs_processor -> chỉ cộng 1 lần); đổi label dùng key riêng của lần classify này
+                import uuid
+                reclassify_key = f"{transaction_id}:{uuid.uuid4()}"
+                if old_label and old_label != category_label:
+                    new_key = f"{reclassify_key}:new"
+                else:
+                    new_key = f"{transaction_id}:apply"
                 # Nếu label cũ khác label mới, update cả 2 jar
                 if old_label and old_label != category_label:
                     # Trừ spent jar cũ
@@ -201,7 +365,8 @@ def classify_transaction(event):
                             "amount": -float(amount),
                             "tranx_type": tranx_type,
                             "category_label": old_label,
-                            "y_month": y_month
+                            "y_month": y_month,
+                            "idempotency_key": f"{reclassify_key}:old"
                         }
                         LAMBDA_CLIENT.invoke(
                             FunctionName=os.environ.get('JAR_UPDATE_LAMBDA', 'smart-jarvis-crud-jar'),
@@ -221,7 +386,8 @@ def classify_transaction(event):
                         "amount": float(amount),
                         "tranx_type": tranx_type,
                         "category_label": category_label,
-                        "y_month": y_month
+                        "y_month": y_month,
+                        "idempotency_key": new_key
                     }
                     LAMBDA_CLIENT.invoke(
                         FunctionName=os.environ.get('JAR_UPDATE_LAMBDA', 'smart-jarvis-crud-jar'),
@@ -236,11 +402,83 @@ def classify_transaction(event):
                     logger.error(f"Error calling jar update lambda (new): {str(e)}")
                 # Update transaction
                 cursor.execute("""
-                    UPDATE transactions SET category_label = %s, updated_at = NOW()
+                    UPDATE transactions
+                    SET category_label = %s, is_manual_override = is_manual_override OR %s, label_from_prior = %s, updated_at = NOW()
                     WHERE transaction_id = %s AND user_id = %s
-                """, (category_label, transaction_id, user_id))
+                """, (category_label, is_manual, from_prior, transaction_id, user_id))
+                # Label lịch sử theo đối tác: lần sau cùng merchant / người nhận không cần gọi AI.
+                # Label lấy từ chính lịch sử không được đếm (kể cả khi bị sửa: không trừ label cũ chưa từng đếm)
+                if old_label != category_label and not from_prior:
+                    labels.record_label(
+                        cursor, user_id, tx.get('merchant'), tx.get('to_account_name'), tranx_type,
+                        category_label, manual=is_manual,
+                        previous_label=None if tx.get('label_from_prior') else old_label,
+                        previous_manual=bool(tx.get('is_manual_override'))
+                    )
             conn.commit()
     except Exception as e:
         logger.error(f"DB error: {str(e)}")
         return response(500, {"error": f"DB error: {str(e)}"})
     return response(200, {"message": "Transaction classified", "y_month": y_month, "tranx_type": tranx_type})
+
+def backfill_search_norm(event):
+    """
+    Điền search_norm cho các transaction cũ (trước khi có cột shadow).
+    Chạy theo batch, gọi lại đến khi remaining = 0.
+    """
+    batch_size = int(event.get('batch_size', 1000))
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT transaction_id, msg_content, merchant FROM transactions
+                WHERE search_norm IS NULL LIMIT %s
+            """, (batch_size,))
+            rows = cursor.fetchall()
+            if rows:
+                cursor.executemany(
+                    "UPDATE transactions SET search_norm = %s WHERE transaction_id = %s",
+                    [(normalise(r['msg_content'], r['merchant']), r['transaction_id']) for r in rows]
+                )
+            conn.commit()
+            cursor.execute("SELECT COUNT(*) as remaining FROM transactions WHERE search_norm IS NULL")
+            remaining = cursor.fetchone()['remaining']
+    return response(200, {"updated": len(rows), "remaining": remaining})
+
+def backfill_counterparty_labels(event):
+    """
+    Dựng lại counterparty_label_stats từ các transaction đã phân loại (trừ label_from_prior).
+    Keyset theo transaction_id: gọi lại với after = giá trị trả về đến khi done = true.
+    Lần gọi đầu (không có after) tạo bảng tạm rỗng; mọi batch đếm vào bảng tạm, lần cuối thay
+    nội dung bảng thật trong 1 DB transaction -> record_label chạy song song không bị đếm trùng,
+    chạy lại nhiều lần cũng vậy. Label gán trong lúc backfill cho transaction_id đã quét qua
+    không được đếm -> chạy lúc ít traffic.
+    """
+    batch_size = int(event.get('batch_size', 5000))
+    after = event.get('after')
+    with db.connection() as conn:
+        with conn.cursor() as cursor:
+            if after is None:
+                labels.start_rebuild(cursor)
+                after = ''
+            cursor.execute("""
+                SELECT transaction_id, user_id, merchant, to_account_name, tranx_type, category_label, is_manual_override
+                FROM transactions
+                WHERE transaction_id > %s AND category_label IS NOT NULL AND NOT label_from_prior
+                ORDER BY transaction_id LIMIT %s
+            """, (after, batch_size))
+            rows = cursor.fetchall()
+            labels.record_labels(cursor, [
+                (r['user_id'], r['merchant'], r['to_account_name'], r['tranx_type'], r['category_label'], bool(r['is_manual_override']))
+                for r in rows
+            ], table=labels.REBUILD_TABLE)
+            done = len(rows) < batch_size
+            if done:
+                labels.swap_rebuild(cursor)
+            conn.commit()
+            if done:
+                labels.drop_rebuild(cursor)
+    return response(200, {
+        "processed": len(rows),
+        "after": rows[-1]['transaction_id'] if rows else after,
+        "done": done
+    })
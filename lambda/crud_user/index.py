@@ -1,6 +1,6 @@
 import json
 import os
-import pymysql
+from common import db
 import logging
 from datetime import datetime
 import uuid
@@ -16,16 +16,6 @@ def response(status, body):
         'headers': {'Content-Type': 'application/json'}
     }
 
-def get_db_connection():
-    return pymysql.connect(
-        host=os.environ['DB_HOST'],
-        port=int(os.environ['DB_PORT']),
-        user=os.environ['DB_USER'],
-        password=os.environ['DB_PASSWORD'],
-        database=os.environ['DB_NAME'],
-        cursorclass=pymysql.cursors.DictCursor
-    )
-
 def handler(event, context):
     path = event.get('path')
     method = event.get('httpMethod')
@@ -50,8 +40,7 @@ def handler(event, context):
         return response(500, {"error": str(e)})
 
 def get_users(event):
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("SELECT user_id, username, email, created_at, updated_at FROM users")
             rows = cursor.fetchall()
@@ -60,8 +49,7 @@ def get_users(event):
 def get_user_by_id(event):
     user_id = event['pathParameters']['id']
     
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 SELECT user_id, username, email, created_at, updated_at 
@@ -83,8 +71,7 @@ def create_user(event):
     user_id = str(uuid.uuid4())
     hashed_password = bcrypt.hashpw(body['password'].encode('utf-8'), bcrypt.gensalt())
 
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("""
                 INSERT INTO users (user_id, username, email, password_hash, created_at, updated_at)
@@ -118,8 +105,7 @@ def update_user(event):
 
     values.append(user_id)
 
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute(f"""
                 UPDATE users
@@ -133,11 +119,11 @@ def update_user(event):
 def delete_user(event):
     user_id = event['pathParameters']['id']
 
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
         conn.commit()
+    db.forget_user(user_id)
 
     return response(200, {"message": "User deleted"})
 
@@ -146,8 +132,7 @@ def check_user_exists(event):
     user_id = body.get('user_id')
     if not user_id:
         return response(400, {"error": "user_id is required"})
-    conn = get_db_connection()
-    with conn:
+    with db.connection() as conn:
         with conn.cursor() as cursor:
             cursor.execute("SELECT 1 FROM users WHERE user_id = %s", (user_id,))
             exists = cursor.fetchone() is not None
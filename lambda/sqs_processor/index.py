@@ -2,7 +2,11 @@ import json
 import logging
 import os
 import boto3
-from typing import Dict, Any
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List
+from common import db, transactions, labels
+from common.jars import apply_spending, NO_JAR_TRANX_TYPES
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -12,8 +16,86 @@ CRUD_TRANSACTION_LAMBDA = os.environ.get('CRUD_TRANSACTION_LAMBDA', 'smart-jarvi
 AI_CLASSIFY_LAMBDA = os.environ.get('AI_CLASSIFY_LAMBDA', 'smart-jarvis-phuong-test')
 CRUD_NOTIFICATION_LAMBDA = os.environ.get('CRUD_NOTIFICATION_LAMBDA', 'smart-jarvis-crud-notification')
 CRUD_JAR_LAMBDA = os.environ.get('CRUD_JAR_LAMBDA', 'smart-jarvis-crud-jar')
+# Số record xử lý song song trong 1 batch (mỗi record tốn ~4 lần invoke đồng bộ)
+SQS_MAX_WORKERS = int(os.environ.get('SQS_MAX_WORKERS', 10))
+# 'lambda': gọi crud_transaction / crud_jar qua Lambda invoke
+# 'inprocess': ghi transaction + label + jar trực tiếp vào DB trong 1 DB transaction
+PIPELINE_MODE = os.environ.get('PIPELINE_MODE', 'lambda')
 
-lambda_client = boto3.client('lambda')
+# boto3 client thread-safe; mở rộng connection pool để các worker không phải chờ nhau
+lambda_client = boto3.client('lambda', config=Config(max_pool_connections=max(SQS_MAX_WORKERS * 2, 10)))
+
+# --- AI classify helper ---
+def _ai_payload(transaction_data, transaction_id=None):
+    return {
+        'transaction_id': transaction_id,
+        'user_id': transaction_data.get('user_id'),
+        'msg_content': transaction_data.get('msg_content'),
+        'amount': transaction_data.get('amount'),
+        'txn_time': transaction_data.get('txn_time'),
+        'merchant': transaction_data.get('merchant'),
+        'to_account_name': transaction_data.get('to_account_name'),
+        'location': transaction_data.get('location'),
+        'channel': transaction_data.get('channel'),
+        'tranx_type': transaction_data.get('tranx_type')
+    }
+
+def ai_classify(transaction_data, transaction_id=None):
+    """Gọi ai_transaction_classify (đồng bộ), trả về (statusCode, body)."""
+    ai_resp = lambda_client.invoke(
+        FunctionName=AI_CLASSIFY_LAMBDA,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(_ai_payload(transaction_data, transaction_id))
+    )
+    ai_resp_body = json.loads(ai_resp['Payload'].read())
+    ai_body = json.loads(ai_resp_body.get('body', '{}')) if 'body' in ai_resp_body else ai_resp_body
+    return ai_resp_body.get('statusCode'), ai_body
+
+def ai_classify_batch(items):
+    """
+    1 lần invoke classify_batch cho nhiều transaction (embed / feature-store / classifier gọi theo batch).
+    Trả về list (statusCode, body) cùng thứ tự items, giống ai_classify: kết quả có "error" -> 500 (retry),
+    còn lại -> 200 kể cả khi không có jar (giao dịch được ghi chưa phân loại như luồng từng record).
+    """
+    ai_resp = lambda_client.invoke(
+        FunctionName=AI_CLASSIFY_LAMBDA,
+        InvocationType='RequestResponse',
+        Payload=json.dumps({'action': 'classify_batch', 'transactions': [_ai_payload(t) for t in items]})
+    )
+    ai_resp_body = json.loads(ai_resp['Payload'].read())
+    if ai_resp_body.get('statusCode') != 200:
+        raise RuntimeError(f"classify_batch failed: {ai_resp_body}")
+    results = json.loads(ai_resp_body['body'])['results']
+    return [(500, r) if 'error' in r else (200, r) for r in results]
+
+# --- Counterparty label helper ---
+def _prior_result(prior):
+    category_label, source = prior
+    return 200, {
+        'jar': category_label,
+        'source': source,
+        'response_msg': 'Phân loại theo các giao dịch trước với cùng đối tác, bạn có muốn thay đổi?'
+    }
+
+def known_labels(items):
+    """
+    Label lịch sử đủ tin cậy theo đối tác (counterparty_label_stats) cho nhiều transaction -> bỏ qua AI.
+    Trả về list (statusCode, body) hoặc None cùng thứ tự items. Lỗi DB -> toàn None (vẫn gọi AI như cũ).
+    """
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                # Cả batch tra trong 1-2 query thay vì 1 query / record
+                priors = labels.lookup_many(cursor, [
+                    (t.get('user_id'), t.get('merchant'), t.get('to_account_name'), t.get('tranx_type')) for t in items
+                ])
+    except Exception as e:
+        logger.warning(f"Counterparty label lookup failed: {e}")
+        return [None] * len(items)
+    return [_prior_result(prior) if prior else None for prior in priors]
+
+def known_label(transaction_data):
+    return known_labels([transaction_data])[0]
 
 # --- Notification helper ---
 def notify_transaction_event(user_id, title, message, notification_type, severity, transaction_id):
@@ -39,180 +121,373 @@ def notify_transaction_event(user_id, title, message, notification_type, severit
     except Exception as e:
         logger.error(f"Send notification failed: {e}")
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    results = []
-    for record in event['Records']:
-        message_id = record['messageId']
-        body = record['body']
-        step_result = {'messageId': message_id, 'steps': []}
+def process_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Chạy pipeline create -> classify -> update jar cho 1 SQS record."""
+    message_id = record['messageId']
+    body = record['body']
+    step_result = {'messageId': message_id, 'steps': []}
+
+    try:
+        transaction_data = json.loads(body)
+    except Exception as e:
+        logger.error(f"Invalid JSON: {e}")
+        step_result['steps'].append({'step': 'parse_message', 'status': 'failed', 'error': str(e)})
+        return step_result
+
+    user_id = transaction_data.get('user_id')
+    transaction_id = None
+    category_label = None
+    # SQS giữ nguyên messageId khi giao lại -> retry không tạo giao dịch trùng
+    if not transaction_data.get('idempotency_key'):
+        transaction_data['idempotency_key'] = message_id
+
+    # 1. Create Transaction
+    try:
+        crud_payload = {
+            'body': json.dumps(transaction_data),
+            'httpMethod': 'POST',
+            'path': '/transaction/create'
+        }
+        crud_resp = lambda_client.invoke(
+            FunctionName=CRUD_TRANSACTION_LAMBDA,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(crud_payload)
+        )
+        crud_resp_body = json.loads(crud_resp['Payload'].read())
+        crud_status = crud_resp_body.get('statusCode')
+        crud_body = json.loads(crud_resp_body.get('body', '{}'))
 
+        if crud_status == 201:
+            transaction_id = crud_body.get('transaction_id')
+            step_result['steps'].append({
+                'step': 'create_transaction',
+                'status': 'success',
+                'transaction_id': transaction_id,
+                'response': crud_body
+            })
+            if not crud_body.get('duplicate'):
+                notify_transaction_event(user_id, "Giao dịch thành công", "Giao dịch của bạn đã được ghi nhận thành công.", "transaction", "info", transaction_id)
+        else:
+            step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'status_code': crud_status, 'response': crud_body})
+            notify_transaction_event(user_id, "Giao dịch thất bại", "Giao dịch của bạn không thành công. Vui lòng thử lại.", "transaction", "error", crud_body.get('transaction_id', ''))
+            return step_result
+    except Exception as e:
+        logger.error(f"Create transaction failed: {e}")
+        step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'error': str(e)})
+        notify_transaction_event(user_id, "Giao dịch thất bại", "Giao dịch của bạn không thành công. Vui lòng thử lại.", "transaction", "error", '')
+        return step_result
+
+    # 2. AI Classify
+    if transaction_data.get('tranx_type') not in NO_JAR_TRANX_TYPES:
         try:
-            transaction_data = json.loads(body)
-        except Exception as e:
-            logger.error(f"Invalid JSON: {e}")
-            step_result['steps'].append({'step': 'parse_message', 'status': 'failed', 'error': str(e)})
-            results.append(step_result)
-            continue
+            ai_status, ai_body = known_label(transaction_data) or ai_classify(transaction_data, transaction_id)
+            category_label = ai_body.get('jar')
 
-        user_id = transaction_data.get('user_id')
-        transaction_id = None
-        category_label = None
+            if ai_status == 200 and category_label:
+                step_result['steps'].append({
+                    'step': 'ai_classify',
+                    'status': 'success',
+                    'category_label': category_label,
+                    'response': ai_body
+                })
+            else:
+                step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'status_code': ai_status, 'response': ai_body})
+                notify_transaction_event(user_id, "Phân loại thất bại", "Không thể phân loại giao dịch. Bạn có thể phân loại thủ công.", "classify", "warning", transaction_id)
+                return step_result
+        except Exception as e:
+            logger.error(f"AI classify failed: {e}")
+            step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'error': str(e)})
+            notify_transaction_event(user_id, "Phân loại thất bại", "Hệ thống gặp lỗi khi phân loại giao dịch.", "classify", "error", transaction_id)
+            return step_result
 
-        # 1. Create Transaction
+        # 3. Classify Transaction
         try:
-            crud_payload = {
-                'body': json.dumps(transaction_data),
-                'httpMethod': 'POST',
-                'path': '/transaction/create'
+            classify_payload = {
+                'pathParameters': {'id': transaction_id},
+                # Label lịch sử theo đối tác: 'prior' -> classify_transaction không đếm lại vào counterparty_label_stats
+                'body': json.dumps({
+                    'user_id': user_id, 'category_label': category_label,
+                    'source': 'prior' if ai_body.get('source') in labels.PRIOR_SOURCES else 'ai'
+                }),
+                'httpMethod': 'PATCH',
+                'path': f'/transaction/{transaction_id}/classify'
             }
-            crud_resp = lambda_client.invoke(
+            classify_resp = lambda_client.invoke(
                 FunctionName=CRUD_TRANSACTION_LAMBDA,
                 InvocationType='RequestResponse',
-                Payload=json.dumps(crud_payload)
+                Payload=json.dumps(classify_payload)
             )
-            crud_resp_body = json.loads(crud_resp['Payload'].read())
-            crud_status = crud_resp_body.get('statusCode')
-            crud_body = json.loads(crud_resp_body.get('body', '{}'))
+            classify_resp_body = json.loads(classify_resp['Payload'].read())
+            classify_status = classify_resp_body.get('statusCode')
+            classify_body = json.loads(classify_resp_body.get('body', '{}'))
 
-            if crud_status == 201:
-                transaction_id = crud_body.get('transaction_id')
+            if classify_status == 200:
                 step_result['steps'].append({
-                    'step': 'create_transaction',
+                    'step': 'classify_transaction',
                     'status': 'success',
-                    'transaction_id': transaction_id,
-                    'response': crud_body
+                    'response': classify_body
                 })
-                notify_transaction_event(user_id, "Giao dịch thành công", "Giao dịch của bạn đã được ghi nhận thành công.", "transaction", "info", transaction_id)
+                notify_transaction_event(user_id, "Phân loại giao dịch", f"Giao dịch đã được phân loại là {category_label}. Bạn có muốn thay đổi không?", "classify", "info", transaction_id)
             else:
-                step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'response': crud_body})
-                notify_transaction_event(user_id, "Giao dịch thất bại", "Giao dịch của bạn không thành công. Vui lòng thử lại.", "transaction", "error", crud_body.get('transaction_id', ''))
-                results.append(step_result)
-                continue
+                step_result['steps'].append({'step': 'classify_transaction', 'status': 'failed', 'status_code': classify_status, 'response': classify_body})
+                notify_transaction_event(user_id, "Phân loại thất bại", "Không thể ghi nhận phân loại giao dịch.", "classify", "error", transaction_id)
+                return step_result
         except Exception as e:
-            logger.error(f"Create transaction failed: {e}")
-            step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'error': str(e)})
+            logger.error(f"Classify transaction failed: {e}")
+            step_result['steps'].append({'step': 'classify_transaction', 'status': 'failed', 'error': str(e)})
+            notify_transaction_event(user_id, "Phân loại thất bại", "Không thể phân loại giao dịch. Vui lòng thử lại.", "classify", "error", transaction_id)
+            return step_result
+
+        # 4. Update Jar
+        try:
+            update_jar_payload = {
+                "body": json.dumps({
+                    "action": "update_jar_amount",
+                    "user_id": user_id,
+                    "amount": transaction_data.get('amount'),
+                    "tranx_type": transaction_data.get('tranx_type'),
+                    "category_label": category_label,
+                    "y_month": classify_body.get('y_month'),
+                    # Cùng key với jar update do classify_transaction gửi -> spent_amount chỉ cộng 1 lần
+                    "idempotency_key": f"{transaction_id}:apply"
+                }),
+                "httpMethod": "POST",
+                "path": "/jar/update_budget"
+            }
+            jar_resp = lambda_client.invoke(
+                FunctionName=CRUD_JAR_LAMBDA,
+                InvocationType='RequestResponse',
+                Payload=json.dumps(update_jar_payload)
+            )
+
+            jar_resp_body = json.loads(jar_resp['Payload'].read())
+            update_status = jar_resp_body.get('statusCode', 500)
+
+            step_result['steps'].append({
+                'step': 'update_jar_amount',
+                'status': 'success' if update_status == 200 else 'failed',
+                'status_code': update_status,
+                'response': jar_resp_body.get('body')
+            })
+
+            if update_status != 200:
+                notify_transaction_event(user_id, "Cập nhật hũ thất bại", "Không thể cập nhật số tiền vào hũ. Vui lòng kiểm tra lại.", "jar", "warning", transaction_id)
+        except Exception as e:
+            logger.error(f"Update jar after classify failed: {e}")
+            step_result['steps'].append({'step': 'update_jar_amount', 'status': 'failed', 'error': str(e)})
+            notify_transaction_event(user_id, "Cập nhật hũ thất bại", "Hệ thống gặp lỗi khi cập nhật hũ.", "jar", "error", transaction_id)
+
+    return step_result
+
+
+def process_record_inprocess(record: Dict[str, Any], classified=None) -> Dict[str, Any]:
+    """
+    Pipeline không qua crud_* Lambda: AI classify trước (vẫn qua Lambda vì cần SageMaker / numpy),
+    sau đó INSERT transaction đã có label + cộng jar trong cùng 1 DB transaction.
+    Lỗi ở bất kỳ bước ghi nào -> rollback toàn bộ, retry message không để lại dữ liệu dở dang.
+    classified: (statusCode, body) đã phân loại sẵn theo batch cho cả SQS batch, None -> gọi riêng.
+    """
+    message_id = record['messageId']
+    step_result = {'messageId': message_id, 'steps': []}
+
+    try:
+        transaction_data = json.loads(record['body'])
+    except Exception as e:
+        logger.error(f"Invalid JSON: {e}")
+        step_result['steps'].append({'step': 'parse_message', 'status': 'failed', 'error': str(e)})
+        return step_result
+
+    user_id = transaction_data.get('user_id')
+    tranx_type = transaction_data.get('tranx_type')
+    # SQS giữ nguyên messageId khi giao lại -> retry không tạo giao dịch trùng
+    if not transaction_data.get('idempotency_key'):
+        transaction_data['idempotency_key'] = message_id
+    idempotency_key = transaction_data['idempotency_key']
+
+    error = transactions.validate_transaction(transaction_data)
+    if error:
+        step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'status_code': 400, 'response': {'error': error}})
+        notify_transaction_event(user_id, "Giao dịch thất bại", "Giao dịch của bạn không thành công. Vui lòng thử lại.", "transaction", "error", '')
+        return step_result
+
+    # 1. AI Classify: chạy trước khi mở DB transaction để không giữ lock trong lúc chờ model
+    category_label = None
+    from_prior = False
+    if tranx_type not in NO_JAR_TRANX_TYPES:
+        try:
+            ai_status, ai_body = classified or known_label(transaction_data) or ai_classify(transaction_data)
+        except Exception as e:
+            # Chưa ghi gì vào DB -> trả message về queue để thử lại cả pipeline
+            logger.error(f"AI classify failed: {e}")
+            step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'error': str(e)})
+            return step_result
+        if ai_status == 200 and ai_body.get('jar'):
+            category_label = ai_body['jar']
+            transaction_data['category_label'] = category_label
+            from_prior = ai_body.get('source') in labels.PRIOR_SOURCES
+            step_result['steps'].append({'step': 'ai_classify', 'status': 'success', 'category_label': category_label, 'response': ai_body})
+        else:
+            step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'status_code': ai_status, 'response': ai_body})
+            if (ai_status or 500) >= 500:
+                return step_result
+            # Model không trả label: vẫn ghi giao dịch (chưa phân loại) như luồng qua Lambda
+
+    # 2. Transaction + jar trong 1 DB transaction
+    duplicate = False
+    jar_result = None
+    try:
+        with db.connection() as conn:
+            with conn.cursor() as cursor:
+                try:
+                    transaction_id = transactions.insert_transaction(cursor, transaction_data, label_from_prior=from_prior)
+                except Exception as e:
+                    if not db.is_duplicate_key_error(e, 'uq_transactions_idempotency'):
+                        raise
+                    # Message giao lại sau khi đã commit: dùng lại giao dịch cũ, jar update bên dưới idempotent
+                    existing = transactions.find_by_idempotency_key(cursor, user_id, idempotency_key)
+                    if not existing:
+                        raise
+                    transaction_id = existing['transaction_id']
+                    duplicate = True
+                # Label lấy từ counterparty_label_stats không đếm lại -> lịch sử chỉ gồm label của model / import / người dùng
+                if not duplicate and not from_prior:
+                    labels.record_label(
+                        cursor, user_id, transaction_data.get('merchant'), transaction_data.get('to_account_name'),
+                        tranx_type, category_label, manual=bool(transaction_data.get('is_manual_override'))
+                    )
+                if category_label:
+                    # Cùng key với classify_transaction / luồng Lambda -> spent_amount chỉ cộng 1 lần
+                    jar_result = apply_spending(
+                        cursor, user_id, transaction_data['amount'], tranx_type, category_label,
+                        transactions.transaction_y_month(cursor, transaction_id), f"{transaction_id}:apply"
+                    )
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Create transaction failed: {e}")
+        if db.is_missing_user_error(e):
+            step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'status_code': 404, 'response': {'error': 'User not found'}})
             notify_transaction_event(user_id, "Giao dịch thất bại", "Giao dịch của bạn không thành công. Vui lòng thử lại.", "transaction", "error", '')
-            results.append(step_result)
+        else:
+            # Lỗi DB tạm thời: đã rollback, retry cả message
+            step_result['steps'].append({'step': 'create_transaction', 'status': 'failed', 'error': str(e)})
+        return step_result
+    db.remember_user(user_id)
+
+    step_result['steps'].append({'step': 'create_transaction', 'status': 'success', 'transaction_id': transaction_id, 'duplicate': duplicate})
+    if not duplicate:
+        notify_transaction_event(user_id, "Giao dịch thành công", "Giao dịch của bạn đã được ghi nhận thành công.", "transaction", "info", transaction_id)
+    if category_label:
+        step_result['steps'].append({'step': 'update_jar_amount', 'status': 'success', 'response': jar_result})
+        if not duplicate:
+            notify_transaction_event(user_id, "Phân loại giao dịch", f"Giao dịch đã được phân loại là {category_label}. Bạn có muốn thay đổi không?", "classify", "info", transaction_id)
+    elif tranx_type not in NO_JAR_TRANX_TYPES:
+        notify_transaction_event(user_id, "Phân loại thất bại", "Không thể phân loại giao dịch. Bạn có thể phân loại thủ công.", "classify", "warning", transaction_id)
+
+    return step_result
+
+
+def _message_group(record: Dict[str, Any]) -> str:
+    # Queue FIFO: record cùng MessageGroupId phải xử lý tuần tự để giữ thứ tự
+    return record.get('attributes', {}).get('MessageGroupId') or record['messageId']
+
+
+def _should_retry(step_result: Dict[str, Any]) -> bool:
+    """
+    Trả record về queue khi 1 bước lỗi có thể tạm thời (exception / 5xx).
+    Lỗi dữ liệu (JSON sai, 4xx) retry cũng không qua.
+    Retry an toàn ở mọi bước: create và jar update idempotent theo messageId / transaction_id.
+    """
+    if step_result.get('retry'):
+        return True
+    for step in step_result['steps']:
+        if step['status'] == 'failed' and step['step'] != 'parse_message':
+            return 'error' in step or (step.get('status_code') or 500) >= 500
+    return False
+
+
+def _classify_records(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    In-process mode: phân loại trước mọi record cần AI của SQS batch.
+    Record có label lịch sử theo đối tác lấy luôn từ DB, phần còn lại gom vào 1 lần classify_batch.
+    Trả về {messageId: (statusCode, body)}; record thiếu -> tự gọi classify riêng.
+    """
+    pending = []
+    for record in records:
+        try:
+            transaction_data = json.loads(record['body'])
+        except Exception:
+            continue
+        if not isinstance(transaction_data, dict) or transaction_data.get('tranx_type') in NO_JAR_TRANX_TYPES:
+            continue
+        if transactions.validate_transaction(transaction_data):
             continue
+        pending.append((record['messageId'], transaction_data))
+    if not pending:
+        return {}
+    results = {}
+    priors = known_labels([t for _, t in pending])
+    for (message_id, _), prior in zip(pending, priors):
+        if prior:
+            results[message_id] = prior
+    pending = [(message_id, t) for message_id, t in pending if message_id not in results]
+    if len(pending) < 2:
+        return results
+    try:
+        classified = ai_classify_batch([t for _, t in pending])
+    except Exception as e:
+        logger.error(f"Batch AI classify failed, falling back to per-record classify: {e}")
+        return results
+    results.update({message_id: result for (message_id, _), result in zip(pending, classified)})
+    return results
 
-        # 2. AI Classify
-        if transaction_data.get('tranx_type') not in ['transfer_in', 'cashback', 'refund']:
-            try:
-                ai_payload = {
-                    'transaction_id': transaction_id,
-                    'user_id': user_id,
-                    'msg_content': transaction_data.get('msg_content'),
-                    'amount': transaction_data.get('amount'),
-                    'txn_time': transaction_data.get('txn_time'),
-                    'merchant': transaction_data.get('merchant'),
-                    'to_account_name': transaction_data.get('to_account_name'),
-                    'location': transaction_data.get('location'),
-                    'channel': transaction_data.get('channel'),
-                    'tranx_type': transaction_data.get('tranx_type')
-                }
-                ai_resp = lambda_client.invoke(
-                    FunctionName=AI_CLASSIFY_LAMBDA,
-                    InvocationType='RequestResponse',
-                    Payload=json.dumps(ai_payload)
-                )
-                ai_resp_body = json.loads(ai_resp['Payload'].read())
-                ai_status = ai_resp_body.get('statusCode')
-                ai_body = json.loads(ai_resp_body.get('body', '{}')) if 'body' in ai_resp_body else ai_resp_body
-                category_label = ai_body.get('jar')
-
-                if ai_status == 200 and category_label:
-                    step_result['steps'].append({
-                        'step': 'ai_classify',
-                        'status': 'success',
-                        'category_label': category_label,
-                        'response': ai_body
-                    })
-                else:
-                    step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'response': ai_body})
-                    notify_transaction_event(user_id, "Phân loại thất bại", "Không thể phân loại giao dịch. Bạn có thể phân loại thủ công.", "classify", "warning", transaction_id)
-                    results.append(step_result)
-                    continue
-            except Exception as e:
-                logger.error(f"AI classify failed: {e}")
-                step_result['steps'].append({'step': 'ai_classify', 'status': 'failed', 'error': str(e)})
-                notify_transaction_event(user_id, "Phân loại thất bại", "Hệ thống gặp lỗi khi phân loại giao dịch.", "classify", "error", transaction_id)
-                results.append(step_result)
-                continue
-
-            # 3. Classify Transaction
-            try:
-                classify_payload = {
-                    'pathParameters': {'id': transaction_id},
-                    'body': json.dumps({'user_id': user_id, 'category_label': category_label}),
-                    'httpMethod': 'PATCH',
-                    'path': f'/transaction/{transaction_id}/classify'
-                }
-                classify_resp = lambda_client.invoke(
-                    FunctionName=CRUD_TRANSACTION_LAMBDA,
-                    InvocationType='RequestResponse',
-                    Payload=json.dumps(classify_payload)
-                )
-                classify_resp_body = json.loads(classify_resp['Payload'].read())
-                classify_status = classify_resp_body.get('statusCode')
-                classify_body = json.loads(classify_resp_body.get('body', '{}'))
-
-                if classify_status == 200:
-                    step_result['steps'].append({
-                        'step': 'classify_transaction',
-                        'status': 'success',
-                        'response': classify_body
-                    })
-                    notify_transaction_event(user_id, "Phân loại giao dịch", f"Giao dịch đã được phân loại là {category_label}. Bạn có muốn thay đổi không?", "classify", "info", transaction_id)
-                else:
-                    step_result['steps'].append({'step': 'classify_transaction', 'status': 'failed', 'response': classify_body})
-                    notify_transaction_event(user_id, "Phân loại thất bại", "Không thể ghi nhận phân loại giao dịch.", "classify", "error", transaction_id)
-                    results.append(step_result)
-                    continue
-            except Exception as e:
-                logger.error(f"Classify transaction failed: {e}")
-                step_result['steps'].append({'step': 'classify_transaction', 'status': 'failed', 'error': str(e)})
-                notify_transaction_event(user_id, "Phân loại thất bại", "Không thể phân loại giao dịch. Vui lòng thử lại.", "classify", "error", transaction_id)
-                results.append(step_result)
-                continue
-
-            # 4. Update Jar
-            try:
-                update_jar_payload = {
-                    "body": json.dumps({
-                        "action": "update_jar_amount",
-                        "user_id": user_id,
-                        "amount": transaction_data.get('amount'),
-                        "tranx_type": transaction_data.get('tranx_type'),
-                        "category_label": category_label
-                    }),
-                    "httpMethod": "POST",
-                    "path": "/jar/update_budget"
-                }
-                jar_resp = lambda_client.invoke(
-                    FunctionName=CRUD_JAR_LAMBDA,
-                    InvocationType='RequestResponse',
-                    Payload=json.dumps(update_jar_payload)
-                )
-
-                jar_resp_body = json.loads(jar_resp['Payload'].read())
-                update_status = jar_resp_body.get('statusCode', 500)
 
-                step_result['steps'].append({
-                    'step': 'update_jar_amount',
-                    'status': 'success' if update_status == 200 else 'failed',
-                    'response': jar_resp_body.get('body')
-                })
+def _process_group(records: List[Dict[str, Any]], classified: Dict[str, Any]) -> List[Dict[str, Any]]:
+    results = []
+    for i, record in enumerate(records):
+        try:
+            if PIPELINE_MODE == 'inprocess':
+                step_result = process_record_inprocess(record, classified.get(record['messageId']))
+            else:
+                step_result = process_record(record)
+        except Exception as e:
+            logger.exception(f"Unexpected error processing message {record.get('messageId')}: {e}")
+            step_result = {'messageId': record['messageId'], 'steps': [], 'error': str(e), 'retry': True}
+        results.append(step_result)
+        if _should_retry(step_result):
+            # FIFO: record sau trong cùng group không được xử lý trước record lỗi -> trả về queue cùng lúc
+            for skipped in records[i + 1:]:
+                results.append({'messageId': skipped['messageId'], 'steps': [], 'status': 'skipped', 'retry': True})
+            break
+    return results
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    groups = {}
+    for record in event['Records']:
+        groups.setdefault(_message_group(record), []).append(record)
+
+    # In-process: 1 lần classify_batch cho cả batch thay vì mỗi record 1 lần invoke
+    classified = _classify_records(event['Records']) if PIPELINE_MODE == 'inprocess' else {}
 
-                if update_status != 200:
-                    notify_transaction_event(user_id, "Cập nhật hũ thất bại", "Không thể cập nhật số tiền vào hũ. Vui lòng kiểm tra lại.", "jar", "warning", transaction_id)
-            except Exception as e:
-                logger.error(f"Update jar after classify failed: {e}")
-                step_result['steps'].append({'step': 'update_jar_amount', 'status': 'failed', 'error': str(e)})
-                notify_transaction_event(user_id, "Cập nhật hũ thất bại", "Hệ thống gặp lỗi khi cập nhật hũ.", "jar", "error", transaction_id)
+    workers = max(1, min(SQS_MAX_WORKERS, len(groups)))
+    logger.info(f"Processing {len(event['Records'])} records in {len(groups)} message groups with {workers} workers")
+    if workers == 1:
+        group_results = [_process_group(records, classified) for records in groups.values()]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            group_results = list(executor.map(lambda records: _process_group(records, classified), groups.values()))
 
-            results.append(step_result)
+    # Trả kết quả theo đúng thứ tự record trong batch
+    by_id = {r['messageId']: r for results in group_results for r in results}
+    results = [by_id[record['messageId']] for record in event['Records']]
+
+    # Partial batch response (ReportBatchItemFailures): SQS chỉ giao lại các message được liệt kê
+    failures = [{'itemIdentifier': r['messageId']} for r in results if _should_retry(r)]
+    if failures:
+        logger.warning(f"{len(failures)}/{len(results)} messages returned to the queue for retry")
 
     return {
         'statusCode': 200,
-        'body': json.dumps({'results': results}, ensure_ascii=False)
-    }
+        'body': json.dumps({'results': results}, ensure_ascii=False),
+        'batchItemFailures': failures
+    }
\ No newline at end of file
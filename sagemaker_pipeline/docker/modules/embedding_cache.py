@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+"""embedding_cache.py
+
+Content-addressed cache for sentence embeddings returned by the
+``sentence-embed-endpoint``: in-memory LRU in front of an optional
+DynamoDB table shared by the preprocessing job and the
+``ai_transaction_classify`` Lambda.
+
+Key = sha256(endpoint name + model version + normalised text). The
+endpoint name is fixed (``sentence-embed-endpoint-v1``), so the model
+version (``EMBED_MODEL_VERSION``) must change whenever a different model
+or pooling is deployed behind it; vectors of the old model are then never
+reused. Vectors are stored as raw float32 bytes with an ``expires_at``
+attribute (DynamoDB TTL), so entries of retired versions eventually go away.
+
+Example
+-------
+>>> cache = EmbeddingCache("sentence-embed-endpoint-v1", model_version="sentence-transformers/paraphrase-MiniLM-L6-v2",
+...                        table_name="sentence-embedding-cache")
+>>> vectors = cache.get_or_compute(texts, lambda missing: embed_batch(missing, endpoint))
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import re
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+import boto3
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+__all__ = ["EmbeddingCache", "normalise_text", "text_key", "DEFAULT_MODEL_VERSION"]
+
+_SPACES_RE = re.compile(r"\s+")
+
+# Model deploy_embedder.py đang dùng; đổi model / pooling sau cùng endpoint -> đổi EMBED_MODEL_VERSION
+DEFAULT_MODEL_VERSION = "sentence-transformers/paraphrase-MiniLM-L6-v2"
+DEFAULT_TTL_DAYS = 30
+
+# Giới hạn API DynamoDB
+_GET_BATCH = 100
+_WRITE_BATCH = 25
+
+
+def normalise_text(text: str | None) -> str:
+    """Gộp khoảng trắng + strip: đúng text gửi tới endpoint (xem get_text_embedding / _ml_text)."""
+    return _SPACES_RE.sub(" ", text or "").strip()
+
+
+def text_key(text: str | None, endpoint_name: str, model_version: str = DEFAULT_MODEL_VERSION) -> str:
+    """Key của 1 text; ai_transaction_classify/index.py dùng cùng công thức."""
+    raw = f"{endpoint_name}\n{model_version}\n{normalise_text(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class EmbeddingCache:
+    """LRU in-memory + DynamoDB (tuỳ chọn) cho sentence embedding."""
+
+    def __init__(self, endpoint_name: str, max_size: int = 100_000, table_name: Optional[str] = None,
+                 region_name: str = "ap-southeast-2", model_version: Optional[str] = None,
+                 ttl_days: int = DEFAULT_TTL_DAYS) -> None:
+        self.endpoint_name = endpoint_name
+        self.model_version = model_version or DEFAULT_MODEL_VERSION
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self.max_size = max_size
+        self.table_name = table_name or None
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._dynamodb = boto3.client("dynamodb", region_name=region_name) if self.table_name else None
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    # ---------------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------------
+    def get_or_compute(self, texts: Sequence[str], compute: Callable[[List[str]], List[Sequence[float]]]) -> List[np.ndarray]:
+        """Vector (float32) cho mỗi text theo thứ tự input.
+
+        Text trùng nhau chỉ tính 1 lần; *compute* chỉ được gọi với các text
+        chưa có trong LRU lẫn DynamoDB, và kết quả được ghi lại vào cả hai.
+        """
+        keys = [text_key(t, self.endpoint_name, self.model_version) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        for key in dict.fromkeys(keys):
+            vec = self._lru_get(key)
+            if vec is not None:
+                found[key] = vec
+        self.hits += sum(1 for k in keys if k in found)
+
+        missing = [k for k in dict.fromkeys(keys) if k not in found]
+        if missing and self._dynamodb:
+            stored = self._store_get(missing)
+            self.store_hits += len(stored)
+            for key, vec in stored.items():
+                self._lru_put(key, vec)
+            found.update(stored)
+            missing = [k for k in missing if k not in found]
+
+        if missing:
+            texts_by_key = {k: normalise_text(t) for k, t in zip(keys, texts)}
+            computed = compute([texts_by_key[k] for k in missing])
+            if len(computed) != len(missing):
+                raise ValueError(f"Embedder returned {len(computed)} vectors for {len(missing)} texts")
+            new = {k: np.asarray(v, dtype=np.float32) for k, v in zip(missing, computed)}
+            self.misses += len(new)
+            for key, vec in new.items():
+                self._lru_put(key, vec)
+            found.update(new)
+            if self._dynamodb:
+                self._store_put(new)
+
+        return [found[k] for k in keys]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "store_hits": self.store_hits, "misses": self.misses, "size": len(self._lru)}
+
+    # ------------------------------------------------------------------
+    # Private helpers
+    # ------------------------------------------------------------------
+    def _lru_get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._lru.move_to_end(key)
+        return vec
+
+    def _lru_put(self, key: str, vec: np.ndarray) -> None:
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _store_get(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """BatchGetItem theo lô 100 key; lỗi store / item đã hết hạn (TTL xoá trễ) -> coi như miss, không làm fail job."""
+        result: Dict[str, np.ndarray] = {}
+        now = int(time.time())
+        for start in range(0, len(keys), _GET_BATCH):
+            request = {self.table_name: {"Keys": [{"text_hash": {"S": k}} for k in keys[start:start + _GET_BATCH]]}}
+            try:
+                for attempt in range(5):
+                    resp = self._dynamodb.batch_get_item(RequestItems=request)
+                    for item in resp.get("Responses", {}).get(self.table_name, []):
+                        if "expires_at" in item and int(item["expires_at"]["N"]) < now:
+                            continue
+                        result[item["text_hash"]["S"]] = np.frombuffer(item["vector"]["B"], dtype=np.float32)
+                    request = resp.get("UnprocessedKeys") or {}
+                    if not request:
+                        break
+                    time.sleep(0.05 * 2 ** attempt)
+            except Exception as e:
+                logger.warning(f"Embedding cache read failed: {e}")
+        return result
+
+    def _store_put(self, vectors: Dict[str, np.ndarray]) -> None:
+        items = list(vectors.items())
+        expires_at = {"N": str(int(time.time()) + self.ttl_seconds)}
+        for start in range(0, len(items), _WRITE_BATCH):
+            request = {self.table_name: [
+                {"PutRequest": {"Item": {"text_hash": {"S": k}, "vector": {"B": v.astype(np.float32).tobytes()},
+                                         "expires_at": expires_at}}}
+                for k, v in items[start:start + _WRITE_BATCH]
+            ]}
+            try:
+                for attempt in range(5):
+                    resp = self._dynamodb.batch_write_item(RequestItems=request)
+                    request = resp.get("UnprocessedItems") or {}
+                    if not request:
+                        break
+                    time.sleep(0.05 * 2 ** attempt)
+            except Exception as e:
+                logger.warning(f"Embedding cache write failed: {e}")
@@ -0,0 +1,71 @@
+# deploy_combined.py
+"""
+Tạo endpoint gộp sentence embedder + transaction classifier (scripts/combined_inference.py).
+Lambda ai_transaction_classify dùng với CLASSIFY_MODE=combined: 1 request / batch thay vì 2 endpoint nối tiếp.
+
+model_data = model.tar.gz của train_classifier.py (S3_MODEL_PATH, giống deploy_model.py): mlp_weights.npz
+và feature_transform.json của cùng lần train được load từ model dir, không cần copy tay.
+"""
+import os
+import sagemaker
+import boto3
+import logging
+from sagemaker.huggingface import HuggingFaceModel
+from sagemaker.serverless import ServerlessInferenceConfig
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+
+# --------- THAM SỐ CẦN SỬA -------------
+ROLE_ARN = os.getenv("SAGEMAKER_ROLE")
+REGION   = os.getenv("AWS_REGION")
+ENDPOINT_NAME = os.getenv("COMBINED_ENDPOINT_NAME", "transaction-classifier-combined-v1")
+S3_MODEL_PATH = os.getenv("S3_MODEL_PATH")  # model.tar.gz của classifier
+USE_SERVERLESS = True                    # True = serverless, False = realtime
+
+# ---------------------------------------
+def main():
+    boto_session = boto3.Session(
+        profile_name=os.getenv("AWS_PROFILE"),
+        region_name=os.getenv("AWS_REGION")
+    )
+    sagemaker_session = sagemaker.Session(boto_session=boto_session)
+    logger.info('Created SageMaker Session')
+
+    # Cùng model với deploy_embedder.py -> vector giống hệt endpoint embedder riêng
+    hf_model = HuggingFaceModel(
+        model_data=S3_MODEL_PATH,
+        env={
+            "HF_MODEL_ID":    "sentence-transformers/paraphrase-MiniLM-L6-v2",
+            "HF_TASK":        "feature-extraction"
+        },
+        role=ROLE_ARN,
+        sagemaker_session=sagemaker_session,
+        entry_point="combined_inference.py",
+        source_dir="scripts",
+        transformers_version="4.26",
+        pytorch_version="1.13",
+        py_version="py39"
+    )
+
+    if USE_SERVERLESS:
+        serverless_cfg = ServerlessInferenceConfig(
+            memory_size_in_mb=3072,
+            max_concurrency=5
+        )
+        hf_model.deploy(
+            serverless_inference_config=serverless_cfg,
+            endpoint_name=ENDPOINT_NAME
+        )
+    else:
+        hf_model.deploy(
+            initial_instance_count=1,
+            instance_type="ml.m5.large",
+            endpoint_name=ENDPOINT_NAME
+        )
+    logger.info(f"✅ Combined endpoint deployed: {ENDPOINT_NAME}")
+
+
+if __name__ == '__main__':
+    main()
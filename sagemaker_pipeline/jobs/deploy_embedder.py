@@ -2,6 +2,7 @@
 """
 Tạo endpoint sentence‑transformers/paraphrase‑MiniLM‑L6‑v2
 Chọn kiểu realtime (ml.m5.large) hoặc serverless.
+scripts/embedder_inference.py: request có "pooling": "mean" -> trả về 1 vector 384 chiều / text.
 """
 import os
 import sagemaker
@@ -27,6 +28,7 @@ boto_session = boto3.Session(
 )
 sagemaker_session = sagemaker.Session(boto_session=boto_session)
 logger.info('Created SageMaker Session')
+# Đổi model / pooling sau ENDPOINT_NAME -> đổi EMBED_MODEL_VERSION (thuộc key cache embedding)
 hf_model = HuggingFaceModel(
     env={
         "HF_MODEL_ID":    "sentence-transformers/paraphrase-MiniLM-L6-v2",
@@ -34,6 +36,8 @@ hf_model = HuggingFaceModel(
     },
     role=ROLE_ARN,
     sagemaker_session=sagemaker_session,
+    entry_point="embedder_inference.py",
+    source_dir="scripts",
     transformers_version="4.26",
     pytorch_version="1.13",
     py_version="py39"
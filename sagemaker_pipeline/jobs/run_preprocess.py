@@ -4,6 +4,7 @@ import logging
 from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
 from sagemaker import get_execution_role, Session
 import boto3
+from datetime import datetime, timezone
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -21,6 +22,25 @@ S3_BUCKET = os.getenv("S3_BUCKET")
 INPUT_S3_URI = f"s3://{S3_BUCKET}/{os.getenv('S3_RAW_KEY')}"
 OUTPUT_S3_URI = f"s3://{S3_BUCKET}/{os.getenv('S3_FEATURES_KEY')}"
 
+# full: fit lại preprocessors + xử lý toàn bộ; incremental: chỉ dòng mới hơn watermark.json của lần trước
+PREPROCESS_MODE = os.getenv("PREPROCESS_MODE", "full")
+STATE_LOCAL_DIR = "/opt/ml/processing/input/state/"
+FEATURES_PREFIX = f"{os.getenv('S3_FEATURES_KEY', '').strip('/')}/preprocessed_features.parquet/"
+
+
+def remove_old_runs(s3, run_id):
+    """Sau full run thành công: xoá các partition run=<...> cũ, chỉ giữ dataset vừa build."""
+    keep = f"{FEATURES_PREFIX}run={run_id}/"
+    paginator = s3.get_paginator("list_objects_v2")
+    stale = [obj["Key"]
+             for page in paginator.paginate(Bucket=S3_BUCKET, Prefix=FEATURES_PREFIX)
+             for obj in page.get("Contents", [])
+             if not obj["Key"].startswith(keep)]
+    for start in range(0, len(stale), 1000):
+        s3.delete_objects(Bucket=S3_BUCKET,
+                          Delete={"Objects": [{"Key": k} for k in stale[start:start + 1000]]})
+    logger.info(f"Removed {len(stale)} objects of previous runs under s3://{S3_BUCKET}/{FEATURES_PREFIX}")
+
 def main():
     # Create session
     boto_session = boto3.Session(
@@ -40,16 +60,33 @@ def main():
         sagemaker_session=sagemaker_session
     )
 
+    # Incremental: đọc watermark + preprocessors đã fit từ output của lần chạy trước
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    inputs = [
+        ProcessingInput(
+            source=INPUT_S3_URI,
+            destination=INPUT_LOCAL_DIR,
+            input_name="raw-data"
+        )
+    ]
+    if PREPROCESS_MODE == "incremental":
+        inputs += [
+            ProcessingInput(
+                source=f"{OUTPUT_S3_URI.rstrip('/')}/watermark.json",
+                destination=STATE_LOCAL_DIR,
+                input_name="watermark"
+            ),
+            ProcessingInput(
+                source=f"{OUTPUT_S3_URI.rstrip('/')}/preprocessors/",
+                destination=os.path.join(STATE_LOCAL_DIR, "preprocessors"),
+                input_name="preprocessors"
+            )
+        ]
+
     # Submit job
     processor.run(
         code='scripts/data_preprocess.py',
-        inputs=[
-            ProcessingInput(
-                source=INPUT_S3_URI,
-                destination=INPUT_LOCAL_DIR,
-                input_name="raw-data"
-            )
-        ],
+        inputs=inputs,
         outputs=[
             ProcessingOutput(
                 source=OUTPUT_LOCAL_DIR,
@@ -59,9 +96,17 @@ def main():
         ],
         arguments=[
             "--trans_file", "synthetic_transactions.csv",
-            "--embed_endpoint_name", os.getenv("EMBEDDER_ENDPOINT_NAME")
+            "--embed_endpoint_name", os.getenv("EMBEDDER_ENDPOINT_NAME"),
+            "--embed_cache_table", os.getenv("EMBED_CACHE_TABLE", ""),
+            "--embed_model_version", os.getenv("EMBED_MODEL_VERSION", ""),
+            "--chunk_size", os.getenv("PREPROCESS_CHUNK_SIZE", "0"),
+            "--mode", PREPROCESS_MODE,
+            "--state_dir", STATE_LOCAL_DIR,
+            "--run_id", run_id
         ]
     )
+    if PREPROCESS_MODE == "full":
+        remove_old_runs(boto_session.client("s3"), run_id)
 
     logger.info("Job submitted ✔  Theo dõi CloudWatch Logs để xem tiến trình.")
 
@@ -5,6 +5,7 @@ import sagemaker, boto3
 from sagemaker import get_execution_role, Session
 from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
 from sagemaker.tensorflow import TensorFlow
+from training_source import training_source_dir
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -37,7 +38,7 @@ def main():
     # Create Estimator
     keras_estimator = TensorFlow(
         entry_point       = "train_autoencoder.py",
-        source_dir        = "scripts",
+        source_dir        = training_source_dir(),
         output_path       = S3_OUTPUT_URI,
         role              = SAGEMAKER_ROLE,
         instance_count    = 1,
@@ -52,6 +53,7 @@ def main():
             "latent-dim":  64,
             "gru-units":   128,
             "epochs":      60,
+            "stream-batch-rows": int(os.getenv("TRAIN_STREAM_BATCH_ROWS", "0")),
             "bucket": BUCKET
         },
     )
@@ -60,7 +62,7 @@ def main():
     # Run training job
     keras_estimator.fit(
         inputs={"train": sagemaker.inputs.TrainingInput(
-            s3_data=S3_INPUT_URI, content_type="text/csv")}
+            s3_data=S3_INPUT_URI, content_type="application/x-parquet")}
     )
     logger.info('Trained Keras Estimator')
     """
@@ -5,6 +5,7 @@ import sagemaker, boto3
 from sagemaker import get_execution_role, Session
 from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
 from sagemaker.tensorflow import TensorFlow
+from training_source import training_source_dir
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -34,7 +35,7 @@ def main():
     # Create Estimator
     keras_estimator = TensorFlow(
         entry_point       = "train_classifier.py",
-        source_dir        = "scripts",
+        source_dir        = training_source_dir(),
         output_path       = S3_OUTPUT_URI,
         role              = SAGEMAKER_ROLE,
         instance_count    = 1,
@@ -50,6 +51,7 @@ def main():
             "training-batch-size": 512,
             "hidden-units"       : 128,
             "feature-group-name" : "user-embeddings",
+            "stream-batch-rows"  : int(os.getenv("TRAIN_STREAM_BATCH_ROWS", "0")),
             "bucket"             : S3_BUCKET
         },
     )
@@ -59,7 +61,7 @@ def main():
     try:
         keras_estimator.fit(
             inputs={"train": sagemaker.inputs.TrainingInput(
-                s3_data=S3_INPUT_URI, content_type="text/csv")}
+                s3_data=S3_INPUT_URI, content_type="application/x-parquet")}
         )
         logger.info('Trained Keras Estimator')
     except Exception as e:
@@ -0,0 +1,24 @@
+# training_source.py
+"""
+source_dir cho các TensorFlow estimator (run_train_classifier.py, run_train_autoencoder.py).
+
+scripts/requirements.txt thuộc về serving: deploy_model / deploy_embedder / deploy_combined cũng dùng
+source_dir='scripts' và container TFS / HF pip install file đó ở mỗi lần cold start -> giữ tối thiểu.
+Training cần pandas / scikit-learn / pyarrow (scripts/requirements-train.txt): copy các file .py của
+scripts/ ra thư mục tạm với requirements-train.txt làm requirements.txt của estimator.
+"""
+import os
+import shutil
+import tempfile
+
+SCRIPTS_DIR = "scripts"
+TRAIN_REQUIREMENTS = os.path.join(SCRIPTS_DIR, "requirements-train.txt")
+
+
+def training_source_dir() -> str:
+    staging = tempfile.mkdtemp(prefix="train-source-")
+    for name in os.listdir(SCRIPTS_DIR):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(SCRIPTS_DIR, name), staging)
+    shutil.copy2(TRAIN_REQUIREMENTS, os.path.join(staging, "requirements.txt"))
+    return staging
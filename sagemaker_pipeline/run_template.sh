@@ -14,6 +14,15 @@ export IMAGE_URI=${AWS_ACCOUNT_ID}.dkr.ecr.${AWS_REGION}.amazonaws.com/${IMAGE_N
 
 # SageMaker
 export SAGEMAKER_ROLE=
+# DynamoDB table (partition key text_hash: S, TTL attribute expires_at) cache sentence embedding, để trống = không dùng
+export EMBED_CACHE_TABLE=
+# Model sau sentence-embed-endpoint-v1, thuộc key cache: đổi khi deploy model / pooling khác
+export EMBED_MODEL_VERSION=sentence-transformers/paraphrase-MiniLM-L6-v2
+# full: fit lại preprocessors + xử lý toàn bộ; incremental: chỉ giao dịch mới hơn watermark lần trước (chạy hằng đêm)
+export PREPROCESS_MODE=full
+# Số dòng / chunk khi preprocess và số dòng / batch khi train (0 = đọc cả dataset vào memory)
+export PREPROCESS_CHUNK_SIZE=0
+export TRAIN_STREAM_BATCH_ROWS=0
 
 # Login AWS SSO
 aws sso login --profile $AWS_PROFILE
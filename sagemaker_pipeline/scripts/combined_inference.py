@@ -0,0 +1,84 @@
+# src/combined_inference.py
+"""
+Endpoint gộp embedder + classifier (jobs/deploy_combined.py): 1 request từ Lambda cho cả
+tokenize -> sentence embedding (mean pooling) -> ghép feature -> MLP, không còn 1 vòng gọi
+sentence-embed-endpoint + serialize 384 số qua JSON.
+
+Chạy trong container HuggingFace (PyTorch): model MiniLM tải theo HF_MODEL_ID vào model_dir,
+feature assembly dùng lại inference.py (chỉ numpy), MLP chạy bằng numpy từ mlp_weights.npz.
+model.tar.gz là model output của train_classifier.py (jobs/deploy_combined.py truyền model_data):
+mlp_weights.npz + feature_transform.json nằm cùng model dir, version transform được kiểm tra lúc load.
+
+Input:  {"instances": [{<field như inference.input_handler, "text" thay cho "sentence_embedding">}, ...]}
+Output: {"predictions": [[p_0, ..., p_5], ...]} giống TF Serving
+"""
+import os
+import json
+import logging
+import numpy as np
+from transformers import AutoTokenizer, AutoModel
+
+from inference import MODEL_DIR, build_features, _load_transform
+from embedder_inference import embed_texts
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Mặc định cạnh feature_transform.json trong model dir; env chỉ để override tường minh
+MLP_WEIGHTS_PATH = os.environ.get("MLP_WEIGHTS_PATH", os.path.join(MODEL_DIR, "mlp_weights.npz"))
+
+
+# ---------- HELPER FUNCTIONS -----------------
+def mlp_predict(weights, X):
+    """Dense(relu) -> BatchNormalization (inference) -> Dense(softmax), cùng kiến trúc build_mlp."""
+    h = np.maximum(X @ weights["w1"] + weights["b1"], 0)
+    h = (h - weights["moving_mean"]) / np.sqrt(weights["moving_variance"] + weights["epsilon"]) * weights["gamma"] + weights["beta"]
+    logits = h @ weights["w2"] + weights["b2"]
+    logits -= logits.max(axis=1, keepdims=True)
+    probs = np.exp(logits)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+
+# -------- INFERENCE FUNCTIONS ----------------
+def load_mlp(path):
+    """Trọng số MLP (float32) + version feature transform lúc train (None với file export trước khi có version)."""
+    with np.load(path) as npz:
+        weights = {k: npz[k].astype(np.float32) for k in npz.files if k != "feature_transform_version"}
+        version = str(npz["feature_transform_version"]) if "feature_transform_version" in npz.files else None
+    return weights, version
+
+
+def model_fn(model_dir):
+    logger.info(f">>> Loading encoder from {model_dir} and MLP from {MLP_WEIGHTS_PATH}")
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    encoder = AutoModel.from_pretrained(model_dir).eval()
+    weights, trained_version = load_mlp(MLP_WEIGHTS_PATH)
+    transform = _load_transform()
+    if trained_version is not None and trained_version != transform.version:
+        raise ValueError(f"MLP was trained with feature transform {trained_version}, "
+                         f"but feature transform {transform.version} is deployed")
+    return {"tokenizer": tokenizer, "encoder": encoder, "mlp": weights}
+
+
+def input_fn(request_body, content_type):
+    if content_type != "application/json":
+        raise ValueError(f"Unsupported content type {content_type}")
+    data = json.loads(request_body)
+    records = data["instances"] if "instances" in data else [data]
+    if not records:
+        raise ValueError("Empty instances")
+    return records
+
+
+def predict_fn(records, model):
+    texts = [" ".join((r.get("text") or "").split()) for r in records]
+    sentence_vectors = embed_texts(model["tokenizer"], model["encoder"], texts)
+    records = [dict(r, sentence_embedding=vec) for r, vec in zip(records, sentence_vectors)]
+    X = build_features(records)
+    logger.info(f"Final X shape: {X.shape} - {X.dtype}")
+    return mlp_predict(model["mlp"], X)
+
+
+def output_fn(predictions, accept):
+    return json.dumps({"predictions": predictions.tolist()}), "application/json"
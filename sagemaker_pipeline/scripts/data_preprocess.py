@@ -7,9 +7,19 @@ import numpy as np
 import logging
 import re
 import json
-import joblib
+import time
+import random
+import threading
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
 from modules.text_embedder import FastTextEmbedder
+from modules.embedding_cache import EmbeddingCache
+from modules.feature_transform import FeatureTransform, OH_COLS, build_params, save_artifact, load_artifact
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -25,86 +35,300 @@ ID_COLS = ['transaction_id', 'user_id']
 STRUCTURED_COLS = ['amount', 'txn_time', 'tranx_type', 'channel', 'location']
 TEXT_COLS = ['msg_content', 'merchant', 'to_account_name']
 LABEL = 'category_label'
+# Output Parquet: embedding là cột fixed_size_list<float32> (giữ đồng bộ với features_io.py)
+EMBEDDING_COL = 'sentence_embedding'
+FEATURES_DIR = 'preprocessed_features.parquet'  # thư mục run=<run_id>/part-xxxxx.parquet, mỗi chunk 1 file
+# Row group nhỏ -> train_classifier streaming xáo được thứ tự đọc kể cả khi cả run chỉ có 1 file
+ROW_GROUP_ROWS = 65536
+# Ép kiểu khi đọc CSV -> mọi chunk cùng schema (chunk toàn NaN không bị đọc thành float)
+CSV_DTYPES = {'transaction_id': str, 'user_id': str, 'amount': 'float64', 'msg_content': str,
+              'merchant': str, 'to_account_name': str, 'tranx_type': str, 'category_label': str,
+              'channel': str, 'location': str}
+FIT_COLS = ['amount'] + OH_COLS + ['location']
+# Incremental: high-water mark theo created_at (thời điểm ghi vào DB) + các transaction_id đã xử lý ở đúng thời điểm đó.
+# Không dùng txn_time: import lịch sử / message SQS đến muộn có txn_time cũ hơn watermark nhưng vẫn là dòng mới.
+WATERMARK_FILE = 'watermark.json'
+WATERMARK_TIME_COL = 'created_at'
+
+# Embedding song song: số request đồng thời tới endpoint, số lần retry khi bị throttle / lỗi tạm thời
+EMBED_MAX_WORKERS = 8
+EMBED_MAX_RETRIES = 6
+EMBED_TARGET_LATENCY = 2.0  # giây / request; nhanh hơn -> tăng batch, chậm hơn nhiều -> giảm
+RETRYABLE_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailable",
+                         "InternalFailure", "ModelError", "ModelNotReadyException"}
 
 # ---------- HELPER FUNCTIONS --------
+# Connection pool đủ cho các worker embedding; retry do embed_with_retry tự xử lý (có backoff + giảm batch)
 sagemaker_client = boto3.client("sagemaker-runtime",
-                                region_name="ap-southeast-2")
+                                region_name="ap-southeast-2",
+                                config=Config(max_pool_connections=32, retries={"max_attempts": 1}))
+
+def _pooled(item) -> np.ndarray:
+    """Vector đã pool trên server, hoặc [1][n_tokens][dim] của endpoint chưa có pooling -> average token."""
+    vec = np.asarray(item, dtype=np.float32)
+    return vec if vec.ndim == 1 else vec[0].mean(axis=0)
+
 
-def embed_batch(texts: list[str], endpoint_name: str) -> list[list[float]]:
+def embed_batch(texts: list[str], endpoint_name: str) -> list[np.ndarray]:
     """
-    Nhận list câu, trả về list sentence‑vector (list[float]).
-    Ở đây mình average token‑embedding luôn cho gọn.
+    Nhận list câu, trả về list sentence‑vector (float32).
+    Endpoint (embedder_inference.py) average token‑embedding luôn trên server -> response nhỏ hơn nhiều.
     """
-    payload = json.dumps({"inputs": texts})
+    payload = json.dumps({"inputs": texts, "pooling": "mean"})
     resp = sagemaker_client.invoke_endpoint(
         EndpointName=endpoint_name,
         ContentType="application/json",
         Body=payload
     )
     raw = json.loads(resp["Body"].read())
-    vectors = [np.mean(item[0], axis=0).tolist() for item in raw]
+    vectors = [_pooled(item) for item in raw]
     return vectors
 
 
-def write_basic_metadata(df: pd.DataFrame, json_path: str):
+class AdaptiveBatchSize:
+    """
+    Batch size dùng chung giữa các worker (AIMD): request nhanh -> tăng 25%,
+    bị throttle / quá tải -> giảm một nửa, luôn trong [minimum, maximum].
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency: float = EMBED_TARGET_LATENCY):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._lock = threading.Lock()
+
+    def current(self) -> int:
+        with self._lock:
+            return self.size
+
+    def on_success(self, latency: float):
+        with self._lock:
+            if latency < self.target_latency:
+                self.size = min(self.maximum, self.size + max(1, self.size // 4))
+            elif latency > 2 * self.target_latency:
+                self.size = max(self.minimum, self.size * 3 // 4)
+
+    def on_overload(self):
+        with self._lock:
+            self.size = max(self.minimum, self.size // 2)
+
+
+def _error_code(e: Exception) -> str:
+    return e.response.get("Error", {}).get("Code", "") if isinstance(e, ClientError) else ""
+
+
+def _is_payload_too_large(e: Exception) -> bool:
+    return _error_code(e) == "ValidationError" and ("413" in str(e) or "too large" in str(e).lower())
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, ClientError):
+        return _error_code(e) in RETRYABLE_ERROR_CODES or "throttl" in str(e).lower()
+    return isinstance(e, BotoCoreError)  # timeout, mất kết nối
+
+
+def embed_with_retry(texts: list[str], endpoint_name: str, sizer: AdaptiveBatchSize,
+                     max_retries: int = EMBED_MAX_RETRIES) -> list[np.ndarray]:
+    """embed_batch với exponential backoff (có jitter); payload quá lớn -> chia đôi batch."""
+    for attempt in range(max_retries + 1):
+        started = time.monotonic()
+        try:
+            vectors = embed_batch(texts, endpoint_name)
+            sizer.on_success(time.monotonic() - started)
+            return vectors
+        except Exception as e:
+            if _is_payload_too_large(e) and len(texts) > 1:
+                sizer.on_overload()
+                mid = len(texts) // 2
+                return (embed_with_retry(texts[:mid], endpoint_name, sizer, max_retries)
+                        + embed_with_retry(texts[mid:], endpoint_name, sizer, max_retries))
+            if attempt == max_retries or not _is_retryable(e):
+                raise
+            sizer.on_overload()
+            delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning(f"Embedding {len(texts)} texts failed ({e}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def embed_concurrently(texts: list[str], endpoint_name: str, batch_size: int = 64,
+                       max_workers: int = EMBED_MAX_WORKERS) -> list[np.ndarray]:
+    """
+    Embed texts bằng tối đa max_workers request đồng thời.
+    Batch được cắt dần theo AdaptiveBatchSize; kết quả ghi vào đúng vị trí -> giữ thứ tự input.
+    Batch nào hết retry vẫn lỗi -> huỷ các batch chưa chạy và raise.
+    """
+    n = len(texts)
+    results: list = [None] * n
+    sizer = AdaptiveBatchSize(batch_size, minimum=max(1, batch_size // 8), maximum=batch_size * 4)
+    pending = {}
+    start = done = 0
+    last_logged = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while start < n or pending:
+                # Giữ tối đa 2 batch / worker trong hàng đợi để batch size mới được áp dụng sớm
+                while start < n and len(pending) < max_workers * 2:
+                    end = min(start + sizer.current(), n)
+                    pending[executor.submit(embed_with_retry, texts[start:end], endpoint_name, sizer)] = (start, end)
+                    start = end
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    s, e = pending.pop(future)
+                    results[s:e] = future.result()
+                    done += e - s
+                if time.monotonic() - last_logged > 30 or done == n:
+                    logger.info(f"🟢 Embedded {done}/{n} texts (batch size {sizer.current()})")
+                    last_logged = time.monotonic()
+        except Exception:
+            for future in pending:
+                future.cancel()
+            raise
+    return results
+
+
+def write_features_parquet(df: pd.DataFrame, embeddings: np.ndarray, path: str, schema: pa.Schema = None) -> pa.Schema:
+    """
+    Ghi df + ma trận embedding (n, dim) ra 1 file Parquet. Embedding là fixed_size_list<float32>[dim]
+    -> trainer đọc thẳng thành ma trận numpy thay vì json.loads 384 số mỗi dòng.
+    schema: schema của part đầu tiên -> các part sau được cast theo (dataset đọc được như 1 bảng).
+    Trả về schema đã ghi.
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    values = pa.array(np.ascontiguousarray(embeddings, dtype=np.float32).reshape(-1), type=pa.float32())
+    table = table.append_column(EMBEDDING_COL, pa.FixedSizeListArray.from_arrays(values, embeddings.shape[1]))
+    if schema is None:
+        # Cột toàn null ở part đầu -> string, để part sau có dữ liệu vẫn cast được
+        schema = pa.schema([f.with_type(pa.string()) if pa.types.is_null(f.type) else f for f in table.schema],
+                           metadata=table.schema.metadata)
+    pq.write_table(table.cast(schema), path, compression="zstd", row_group_size=ROW_GROUP_ROWS)
+    return schema
+
+def write_basic_metadata(schema: pa.Schema, num_rows: int, json_path: str, run_id: str = None, run_rows: int = None):
+    """num_rows: tổng số dòng của mọi partition run=*; run_id / run_rows: partition vừa ghi."""
     metadata = {
-        "num_rows": df.shape[0],
-        "num_columns": df.shape[1],
+        "num_rows": num_rows,
+        "run_id": run_id,
+        "run_rows": run_rows,
+        "num_columns": len(schema),
         "columns": [
-            {"name": col, "dtype": str(df[col].dtype)}
-            for col in df.columns
+            {"name": field.name, "dtype": str(field.type)}
+            for field in schema
         ]
     }
     with open(json_path, "w", encoding="utf-8") as f:
         json.dump(metadata, f, indent=2, ensure_ascii=False)
 
 # ----- PROCESSING DATA FUNCTIONS -----
-def get_structured_features(features, args):
-    # Handle amount
-    features['amount_log'] = np.log1p(features['amount'])
+def read_transactions(src_path: str, chunk_size: int = 0, usecols=None):
+    """Iterator các DataFrame: cả file (chunk_size = 0) hoặc từng chunk chunk_size dòng."""
+    if chunk_size > 0:
+        yield from pd.read_csv(src_path, dtype=CSV_DTYPES, usecols=usecols, chunksize=chunk_size)
+    else:
+        yield pd.read_csv(src_path, dtype=CSV_DTYPES, usecols=usecols)
+
+def fit_feature_transform(chunks, version: str) -> FeatureTransform:
+    """
+    Pass 1: fit scaler / one-hot / label encoder qua từng chunk, chỉ giữ thống kê + tập giá trị unique.
+    Kết quả giống fit trên toàn bộ dữ liệu một lần; tham số đã fit -> FeatureTransform (feature_transform.py).
+    """
     scaler = StandardScaler()
-    features['amount_scaled'] = scaler.fit_transform(features[['amount_log']])
+    uniques = {col: [] for col in OH_COLS + ['location']}
+    n_rows = 0
+    for chunk in chunks:
+        scaler.partial_fit(pd.DataFrame({'amount_log': np.log1p(chunk['amount'])}))
+        for col in uniques:
+            uniques[col].append(pd.Series(chunk[col].unique()))
+        n_rows += len(chunk)
+    uniques = {col: pd.concat(vals, ignore_index=True).drop_duplicates().tolist() for col, vals in uniques.items()}
 
-    # Handle txn_time
-    features['txn_time'] = pd.to_datetime(features['txn_time'])
-    features['hour'] = features['txn_time'].dt.hour
-    features['day_of_month'] = features['txn_time'].dt.day
-    features['dayofweek'] = features['txn_time'].dt.dayofweek
-    features['is_weekend'] = features['dayofweek'].isin([5, 6]).astype(int)
-    features['hour_sin'] = np.sin(2 * np.pi * features['hour'] / 24)
-    features['hour_cos'] = np.cos(2 * np.pi * features['hour'] / 24)
-    features['dow_sin'] = np.sin(2 * np.pi * features['dayofweek'] / 7)
-    features['dow_cos'] = np.cos(2 * np.pi * features['dayofweek'] / 7)
-
-    # Handle categorical features: tranx_type, channel, location
+    # OneHotEncoder.fit trên bảng các giá trị unique (cột ngắn hơn được pad bằng giá trị đầu) -> categories_ như fit toàn bộ
+    n = max(len(uniques[col]) for col in OH_COLS)
     ohe = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-    oh_cols = ['tranx_type', 'channel']
-    X_cat = ohe.fit_transform(features[oh_cols])
-    ohe_feature_names = ohe.get_feature_names_out(oh_cols)
-    df_cat_encoded = pd.DataFrame(X_cat, columns=ohe_feature_names, index=features.index)
-    features = pd.concat([features, df_cat_encoded], axis=1)
+    ohe.fit(pd.DataFrame({col: uniques[col] + uniques[col][:1] * (n - len(uniques[col])) for col in OH_COLS}))
 
     le = LabelEncoder()
-    features['location_idx'] = le.fit_transform(features['location'])
-
-    # Save preprocessors
-    preprocessors_dir = os.path.join(args.output_dir, "preprocessors")
-    os.makedirs(preprocessors_dir, exist_ok=True)
-    if scaler:
-        joblib.dump(scaler, os.path.join(preprocessors_dir, "scaler.pkl"))
-    if ohe:
-        joblib.dump(ohe, os.path.join(preprocessors_dir, "ohe.pkl"))
-    if le:
-        joblib.dump(le, os.path.join(preprocessors_dir, "le.pkl"))
+    le.fit(uniques['location'])
+    logger.info(f' ✔ Fitted preprocessors on {n_rows} rows')
+    categories = dict(zip(OH_COLS, ohe.categories_))
+    return FeatureTransform(build_params(scaler.mean_[0], scaler.scale_[0], categories, le.classes_, version))
+
+def get_structured_features(features, transform: FeatureTransform):
+    """Pass 2: transform 1 chunk bằng FeatureTransform đã fit (cùng code với train_classifier / inference.py)."""
+    # Handle amount
+    features['amount_log'], features['amount_scaled'] = transform.amount_features(features['amount'])
+
+    # Handle txn_time (day_of_month đã chia 31 như lúc serving)
+    features['txn_time'] = pd.to_datetime(features['txn_time'])
+    calendar = transform.calendar_features(features['txn_time'].dt.hour, features['txn_time'].dt.day,
+                                           features['txn_time'].dt.dayofweek)
+    for name, values in calendar.items():
+        features[name] = values
+
+    # Handle categorical features: tranx_type, channel, location (location chưa gặp lúc fit -> -1)
+    encoded = {}
+    for col in OH_COLS:
+        encoded.update(transform.onehot(col, features[col].fillna('nan').astype(str)))
+    features = pd.concat([features, pd.DataFrame(encoded, index=features.index)], axis=1)
+    features['location_idx'] = transform.location_index(features['location'])
 
     # Get final features dataframe
     logger.info(f' ✔ Feature engineering: structured features - {features.shape}')
     return features
 
-def get_text_embedding(df, embed_endpoint_name, batch_size: int = 64):
+# ----- WATERMARK FUNCTIONS -----
+def load_watermark(state_dir: str):
+    path = os.path.join(state_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def save_watermark(watermark: dict, output_dir: str):
+    with open(os.path.join(output_dir, WATERMARK_FILE), "w", encoding="utf-8") as f:
+        json.dump(watermark, f, indent=2, ensure_ascii=False)
+
+def require_watermark_column(columns):
+    if WATERMARK_TIME_COL not in columns:
+        raise ValueError(f"Input has no {WATERMARK_TIME_COL} column, incremental mode needs the ingestion time")
+
+def watermark_keys(chunk: pd.DataFrame):
+    return pd.to_datetime(chunk[WATERMARK_TIME_COL]), chunk['transaction_id'].astype(str)
+
+def after_watermark(chunk: pd.DataFrame, watermark: dict) -> np.ndarray:
+    """
+    Mask các dòng chưa xử lý: created_at sau watermark, hoặc bằng nhưng transaction_id chưa có trong
+    watermark['transaction_ids'] (dòng commit cùng giây nhưng export ở lần sau; UUID không có thứ tự).
+    """
+    times, ids = watermark_keys(chunk)
+    wm_time = pd.Timestamp(watermark['time'])
+    seen = ids.isin(watermark['transaction_ids'])
+    return ((times > wm_time) | ((times == wm_time) & ~seen)).to_numpy(dtype=bool)
+
+def advance_watermark(watermark, chunk: pd.DataFrame):
+    """Watermark sau khi xử lý chunk (dòng thiếu created_at không tính)."""
+    times, ids = watermark_keys(chunk)
+    valid = times.notna()
+    if not valid.any():
+        return watermark
+    latest_time = times[valid].max()
+    latest_ids = ids[valid & (times == latest_time)].tolist()
+    if watermark and 'time' in watermark:
+        wm_time = pd.Timestamp(watermark['time'])
+        if wm_time > latest_time:
+            return watermark
+        if wm_time == latest_time:
+            latest_ids = watermark['transaction_ids'] + latest_ids
+    return {"column": WATERMARK_TIME_COL, "time": latest_time.isoformat(),
+            "transaction_ids": sorted(set(latest_ids))}
+
+def get_text_embedding(df, embed_endpoint_name, batch_size: int = 64, cache: EmbeddingCache = None,
+                       max_workers: int = EMBED_MAX_WORKERS):
     """
     :param df:
-    :return:
+    :param cache: text trùng (trong file hoặc đã embed ở lần chạy trước / bởi Lambda) không gọi lại endpoint
+    :param max_workers: số request embed đồng thời
+    :return: df (thêm text_joined), ma trận embedding (n, dim) float32 cùng thứ tự dòng
     """
     df["text_joined"] = (
         df[TEXT_COLS]
@@ -113,19 +337,18 @@ def get_text_embedding(df, embed_endpoint_name, batch_size: int = 64):
         .str.replace(r"\s+", " ", regex=True)
         .str.strip()
     )
-    all_embeddings: list[list[float]] = []
-    n = len(df)
-    for batch_idx, start in enumerate(range(0, n, batch_size), 1):
-        end = min(start + batch_size, n)
-        logger.info("🟢 Batch %d– embedding rows [%d:%d)", batch_idx, start, end)
-        chunk = df["text_joined"].iloc[start:end].tolist()
-        embeddings = embed_batch(chunk, embed_endpoint_name)
-        all_embeddings.extend(embeddings)
+    cache = cache or EmbeddingCache(embed_endpoint_name)
+
+    def embed_missing(texts: list[str]) -> list[np.ndarray]:
+        return embed_concurrently(texts, embed_endpoint_name, batch_size=batch_size, max_workers=max_workers)
 
-    df["sentence_embedding"] = [json.dumps(vec) for vec in all_embeddings]
+    all_embeddings = cache.get_or_compute(df["text_joined"].tolist(), embed_missing)
+    logger.info(f' ✔ Embedding cache: {cache.stats()}')
 
-    logger.info(f' ✔ Feature engineering: text embedding features - {df.shape}')
-    return df
+    embeddings = np.vstack(all_embeddings).astype(np.float32) if all_embeddings else np.zeros((0, 384), dtype=np.float32)
+
+    logger.info(f' ✔ Feature engineering: text embedding features - {embeddings.shape}')
+    return df, embeddings
 
 # ------ MAIN ---------
 def main():
@@ -135,22 +358,75 @@ def main():
     parser.add_argument("--output_dir", default="/opt/ml/processing/output/")
     parser.add_argument("--trans_file", default="synthetic_transactions.csv")
     parser.add_argument("--embed_endpoint_name", default="sentence-embed-endpoint-v1")
+    parser.add_argument("--embed_cache_table", default="", help="DynamoDB table cache embedding (rỗng = chỉ cache in-memory)")
+    parser.add_argument("--embed_model_version", default="", help="model sau embed endpoint, thuộc key cache (rỗng = DEFAULT_MODEL_VERSION)")
+    parser.add_argument("--embed_batch_size", type=int, default=64, help="batch size ban đầu, tự điều chỉnh theo latency / throttle")
+    parser.add_argument("--embed_workers", type=int, default=EMBED_MAX_WORKERS)
+    parser.add_argument("--chunk_size", type=int, default=0, help="số dòng / chunk khi đọc input (0 = đọc cả file 1 lần)")
+    parser.add_argument("--mode", choices=["full", "incremental"], default="full",
+                        help="incremental: chỉ xử lý dòng mới hơn watermark, dùng lại preprocessors đã fit")
+    parser.add_argument("--state_dir", default="/opt/ml/processing/input/state/",
+                        help="watermark.json + preprocessors/ của lần chạy trước (incremental mode)")
+    parser.add_argument("--run_id", default="", help="tên partition run=<run_id> (mặc định: thời điểm UTC)")
     args = parser.parse_args()
 
     src_path = os.path.join(args.input_dir, args.trans_file)
-    trans_df = pd.read_csv(src_path)
-    logger.info(f' ✔ Loaded transactions - {trans_df.shape}')
-
+    run_id = args.run_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
 
-    # Get structured_df and save to file
-    df = get_structured_features(trans_df, args)
-    df = get_text_embedding(df, args.embed_endpoint_name)
+    if args.mode == "incremental":
+        # Dùng lại feature transform (đã kiểm tra checksum) + watermark của lần chạy trước, chỉ xử lý dòng mới
+        watermark = load_watermark(args.state_dir)
+        if watermark is None:
+            raise ValueError(f"No {WATERMARK_FILE} in {args.state_dir}, run a full preprocessing first")
+        if watermark.get('column') != WATERMARK_TIME_COL or 'transaction_ids' not in watermark:
+            raise ValueError(f"{WATERMARK_FILE} in {args.state_dir} has no {WATERMARK_TIME_COL} watermark, "
+                             f"run a full preprocessing on input with {WATERMARK_TIME_COL} first")
+        transform = load_artifact(os.path.join(args.state_dir, "preprocessors"))
+        logger.info(f' ✔ Incremental run after {watermark}, feature transform {transform.version}')
+    else:
+        # Pass 1: fit feature transform (chỉ đọc các cột cần fit), version = run_id
+        watermark = None
+        transform = fit_feature_transform(read_transactions(src_path, args.chunk_size, usecols=FIT_COLS), run_id)
+        manifest = save_artifact(transform.params, os.path.join(args.output_dir, "preprocessors"))
+        logger.info(f' ✔ Saved feature transform {manifest}')
 
-    dst_path = os.path.join(args.output_dir, "preprocessed_features.csv")
-    df.to_csv(dst_path, index=False)
+    # Pass 2: transform + embed từng chunk, mỗi chunk ghi 1 file part -> memory không phụ thuộc kích thước input
+    features_dir = os.path.join(args.output_dir, FEATURES_DIR, f"run={run_id}")
+    os.makedirs(features_dir, exist_ok=True)
+    cache = EmbeddingCache(args.embed_endpoint_name, table_name=args.embed_cache_table,
+                           model_version=args.embed_model_version)
+    schema, num_rows, new_watermark = None, 0, watermark
+    for chunk_idx, trans_df in enumerate(read_transactions(src_path, args.chunk_size)):
+        if watermark:
+            require_watermark_column(trans_df.columns)
+            missing_time = int(pd.to_datetime(trans_df[WATERMARK_TIME_COL]).isna().sum())
+            if missing_time:
+                logger.warning(f"Skipped {missing_time} rows without {WATERMARK_TIME_COL} in chunk {chunk_idx}")
+            trans_df = trans_df[after_watermark(trans_df, watermark)]
+            if trans_df.empty:
+                continue
+        logger.info(f' ✔ Loaded transactions chunk {chunk_idx} - {trans_df.shape}')
+        if WATERMARK_TIME_COL in trans_df.columns:
+            new_watermark = advance_watermark(new_watermark, trans_df)
+        elif chunk_idx == 0:
+            # Full run vẫn chạy được nhưng không có watermark -> incremental sau đó báo lỗi thay vì bỏ sót dòng
+            logger.warning(f"Input has no {WATERMARK_TIME_COL} column, no watermark for incremental runs")
+        df = get_structured_features(trans_df, transform)
+        df, embeddings = get_text_embedding(df, args.embed_endpoint_name, batch_size=args.embed_batch_size, cache=cache,
+                                            max_workers=args.embed_workers)
+        part = os.path.join(features_dir, f"part-{chunk_idx:05d}.parquet")
+        schema = write_features_parquet(df, embeddings, part, schema)
+        num_rows += len(df)
 
-    dst_path = os.path.join(args.output_dir, "features_metadata.json")
-    write_basic_metadata(df, dst_path)
+    # Training đọc mọi partition run=*, metadata mô tả cả dataset (total_rows), không chỉ lần chạy này
+    total_rows = (watermark or {}).get("total_rows", 0) + num_rows
+    if schema is None:
+        logger.info(' ✔ No new transactions')
+    else:
+        dst_path = os.path.join(args.output_dir, "features_metadata.json")
+        write_basic_metadata(schema, total_rows, dst_path, run_id=run_id, run_rows=num_rows)
+    save_watermark(dict(new_watermark or {}, run_id=run_id, run_rows=num_rows, total_rows=total_rows,
+                        feature_transform_version=transform.version), args.output_dir)
 
     logger.info(' ✔ Data processing is DONE')
 
@@ -0,0 +1,81 @@
+# src/embedder_inference.py
+"""
+Inference script cho sentence-embed endpoint (jobs/deploy_embedder.py).
+
+Input:  {"inputs": [text, ...], "pooling": "mean"}
+Output: [[f_0, ..., f_383], ...] - 1 vector / text, mean pooling trên server
+
+Không có "pooling" -> giữ format của task feature-extraction mặc định
+([n_texts][1][n_tokens][dim]) cho client cũ.
+"""
+import os
+import json
+import logging
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+logging.basicConfig(level=logging.INFO,
+                    format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 64))
+POOLING_MODES = {"mean"}
+
+
+# ---------- HELPER FUNCTIONS -----------------
+def embed_texts(tokenizer, encoder, texts):
+    """
+    Mean pooling theo attention_mask -> bằng trung bình token của feature-extraction
+    (pipeline HF embed từng câu, không có padding) mà client đang tính.
+    """
+    vectors = []
+    with torch.no_grad():
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = tokenizer(texts[start:start + EMBED_BATCH_SIZE], padding=True, truncation=True, return_tensors="pt")
+            tokens = encoder(**batch).last_hidden_state
+            mask = batch["attention_mask"].unsqueeze(-1).to(tokens.dtype)
+            pooled = (tokens * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+            vectors.append(pooled.cpu().numpy().astype(np.float32))
+    return np.vstack(vectors) if vectors else np.zeros((0, encoder.config.hidden_size), dtype=np.float32)
+
+
+def token_embeddings(tokenizer, encoder, texts):
+    """Format cũ: từng câu riêng (không padding), trả về [1][n_tokens][dim] cho mỗi câu."""
+    results = []
+    with torch.no_grad():
+        for text in texts:
+            batch = tokenizer(text, truncation=True, return_tensors="pt")
+            results.append(encoder(**batch).last_hidden_state.cpu().numpy().tolist())
+    return results
+
+
+# -------- INFERENCE FUNCTIONS ----------------
+def model_fn(model_dir):
+    logger.info(f">>> Loading encoder from {model_dir}")
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    encoder = AutoModel.from_pretrained(model_dir).eval()
+    return {"tokenizer": tokenizer, "encoder": encoder}
+
+
+def input_fn(request_body, content_type):
+    if content_type != "application/json":
+        raise ValueError(f"Unsupported content type {content_type}")
+    data = json.loads(request_body)
+    texts = data["inputs"]
+    if isinstance(texts, str):
+        texts = [texts]
+    pooling = data.get("pooling")
+    if pooling is not None and pooling not in POOLING_MODES:
+        raise ValueError(f"Unsupported pooling {pooling}")
+    return {"texts": texts, "pooling": pooling}
+
+
+def predict_fn(data, model):
+    if data["pooling"] == "mean":
+        return embed_texts(model["tokenizer"], model["encoder"], data["texts"]).tolist()
+    return token_embeddings(model["tokenizer"], model["encoder"], data["texts"])
+
+
+def output_fn(prediction, accept):
+    return json.dumps(prediction), "application/json"
@@ -0,0 +1,167 @@
+"""
+Feature transform dùng chung cho preprocessing, training và serving (chỉ numpy + stdlib).
+
+1 artifact có version, sinh 1 lần bởi data_preprocess.py (full mode):
+- feature_transform.json: tham số đã fit (amount scaler, categories one-hot, location classes)
+  + quy ước feature (SELECTED_FEATURES, day_of_month / 31, label2id)
+- feature_transform.manifest.json: version + sha256 của feature_transform.json
+
+load_artifact kiểm tra checksum / format 1 lần lúc load -> train_classifier, inference.py và
+combined_inference.py dùng đúng bộ tham số data_preprocess đã dùng, không phải tự suy lại.
+
+data_preprocess.py import file này qua image processing (docker/Dockerfile copy vào modules/).
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+FORMAT_VERSION = 2
+ARTIFACT_NAME = "feature_transform.json"
+MANIFEST_NAME = "feature_transform.manifest.json"
+
+SELECTED_FEATURES = ["amount_scaled", "day_of_month", "is_weekend", "hour_sin", "hour_cos",
+                     "dow_sin", "dow_cos", "tranx_type_atm_withdrawal", "tranx_type_qrcode_payment",
+                     "tranx_type_transfer_out", "channel_MOBILE", "channel_WEB"]
+OH_COLS = ['tranx_type', 'channel']
+DAY_OF_MONTH_DIVISOR = 31
+LABEL2ID = {
+    'NEC': 0,
+    'FFA': 1,
+    'PLAY': 2,
+    'EDU': 3,
+    'GIVE': 4,
+    'LTSS': 5
+}
+
+
+class FeatureTransform:
+    """Tham số đã fit + các hàm transform, cùng kết quả với StandardScaler / OneHotEncoder / LabelEncoder."""
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.version = params["version"]
+        self.amount_mean = float(params["amount_scaler"]["mean"])
+        self.amount_scale = float(params["amount_scaler"]["scale"])
+        self.day_of_month_divisor = float(params["day_of_month_divisor"])
+        self.categories = params["onehot"]["categories"]
+        self.location_classes = params["location_classes"]
+        self.label2id = params["label2id"]
+        self._location_index = {c: i for i, c in enumerate(self.location_classes)}
+        # Mỗi cột one-hot trong SELECTED_FEATURES -> (vị trí, cột input, category)
+        self.selected_onehot = [
+            (j, c, name[len(c) + 1:])
+            for j, name in enumerate(SELECTED_FEATURES)
+            for c in OH_COLS
+            if name.startswith(f"{c}_")
+        ]
+
+    def amount_features(self, amount):
+        """(amount_log, amount_scaled); StandardScaler.transform = (x - mean_) / scale_."""
+        amount_log = np.log1p(np.asarray(amount, dtype=np.float64))
+        return amount_log, (amount_log - self.amount_mean) / self.amount_scale
+
+    def calendar_features(self, hour, day, dayofweek) -> dict:
+        """Feature thời gian từ giờ, ngày trong tháng, thứ (0 = thứ 2)."""
+        hour = np.asarray(hour)
+        dayofweek = np.asarray(dayofweek)
+        return {
+            "hour": hour,
+            "day_of_month": np.asarray(day) / self.day_of_month_divisor,
+            "dayofweek": dayofweek,
+            "is_weekend": (dayofweek >= 5).astype(int),
+            "hour_sin": np.sin(2 * np.pi * hour / 24),
+            "hour_cos": np.cos(2 * np.pi * hour / 24),
+            "dow_sin": np.sin(2 * np.pi * dayofweek / 7),
+            "dow_cos": np.cos(2 * np.pi * dayofweek / 7),
+        }
+
+    def onehot(self, col: str, values) -> dict:
+        """{'<col>_<category>': cột 0/1}; category lạ -> toàn 0 như handle_unknown='ignore'."""
+        values = np.asarray(values, dtype=object)
+        return {f"{col}_{category}": (values == category).astype(np.float64) for category in self.categories[col]}
+
+    def location_index(self, values) -> np.ndarray:
+        """Như LabelEncoder.transform, location chưa gặp lúc fit -> -1."""
+        return np.array([self._location_index.get(v, -1) for v in values], dtype=np.int64)
+
+    def fill_selected(self, X, amount, hour, day, dayofweek, categorical: dict):
+        """Ghi các cột SELECTED_FEATURES vào X[:, :len(SELECTED_FEATURES)] (categorical: cột OH_COLS -> values)."""
+        col = {name: j for j, name in enumerate(SELECTED_FEATURES)}
+        X[:, col["amount_scaled"]] = self.amount_features(amount)[1]
+        calendar = self.calendar_features(hour, day, dayofweek)
+        for name in ["day_of_month", "is_weekend", "hour_sin", "hour_cos", "dow_sin", "dow_cos"]:
+            X[:, col[name]] = calendar[name]
+        for j, c, category in self.selected_onehot:
+            X[:, j] = np.asarray(categorical[c], dtype=object) == category
+
+
+def build_params(amount_mean, amount_scale, categories: dict, location_classes, version: str) -> dict:
+    """Nội dung feature_transform.json từ tham số đã fit."""
+    return {
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "amount_scaler": {"mean": float(amount_mean), "scale": float(amount_scale)},
+        "day_of_month_divisor": DAY_OF_MONTH_DIVISOR,
+        "onehot": {
+            "columns": list(OH_COLS),
+            "categories": {col: [str(c) for c in categories[col]] for col in OH_COLS}
+        },
+        "location_classes": [str(c) for c in location_classes],
+        "selected_features": list(SELECTED_FEATURES),
+        "label2id": dict(LABEL2ID)
+    }
+
+
+def save_artifact(params: dict, output_dir: str) -> dict:
+    """Ghi feature_transform.json + manifest (sha256 của đúng bytes đã ghi). Trả về manifest."""
+    missing = [name for name in SELECTED_FEATURES if name not in _feature_names(params)]
+    if missing:
+        raise ValueError(f"Fitted transform does not produce features {missing}")
+    os.makedirs(output_dir, exist_ok=True)
+    payload = json.dumps(params, indent=2, ensure_ascii=False).encode("utf-8")
+    with open(os.path.join(output_dir, ARTIFACT_NAME), "wb") as f:
+        f.write(payload)
+    manifest = {
+        "artifact": ARTIFACT_NAME,
+        "format_version": params["format_version"],
+        "version": params["version"],
+        "sha256": hashlib.sha256(payload).hexdigest(),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_artifact(artifact_dir: str) -> FeatureTransform:
+    """Đọc + kiểm tra artifact (checksum, format, version, SELECTED_FEATURES); sai -> ValueError."""
+    with open(os.path.join(artifact_dir, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    with open(os.path.join(artifact_dir, manifest["artifact"]), "rb") as f:
+        payload = f.read()
+    if hashlib.sha256(payload).hexdigest() != manifest["sha256"]:
+        raise ValueError(f"Checksum mismatch for {manifest['artifact']} in {artifact_dir}")
+    params = json.loads(payload)
+    if params.get("format_version") != FORMAT_VERSION or params.get("version") != manifest["version"]:
+        raise ValueError(f"Unsupported feature transform {params.get('format_version')}/{params.get('version')}, "
+                         f"expected format {FORMAT_VERSION} version {manifest['version']}")
+    if params["selected_features"] != SELECTED_FEATURES:
+        raise ValueError("Feature transform was built for a different SELECTED_FEATURES")
+    return FeatureTransform(params)
+
+
+def copy_artifact(src_dir: str, dst_dir: str) -> None:
+    """Copy artifact + manifest nguyên bytes (kèm model output -> serving dùng đúng version model đã train)."""
+    os.makedirs(dst_dir, exist_ok=True)
+    for name in [ARTIFACT_NAME, MANIFEST_NAME]:
+        with open(os.path.join(src_dir, name), "rb") as src, open(os.path.join(dst_dir, name), "wb") as dst:
+            dst.write(src.read())
+
+
+def _feature_names(params: dict):
+    categories = params["onehot"]["categories"]
+    onehot = [f"{c}_{category}" for c in OH_COLS for category in categories[c]]
+    return ["amount_scaled", "day_of_month", "is_weekend", "hour_sin", "hour_cos", "dow_sin", "dow_cos"] + onehot
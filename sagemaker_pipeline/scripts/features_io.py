@@ -0,0 +1,95 @@
+"""
+Đọc output của data_preprocess.py cho các training script.
+
+preprocessed_features.parquet: thư mục run=<run_id>/part-xxxxx.parquet (mỗi lần preprocess
+full / incremental thêm 1 run), gồm các cột structured + sentence_embedding kiểu
+fixed_size_list<float32>[384] -> đọc thẳng thành ma trận numpy (không parse JSON từng dòng).
+Vẫn đọc được preprocessed_features.csv cũ (embedding là JSON string trong 1 ô).
+
+read_features: đọc toàn bộ vào memory. iter_features: từng batch, memory giới hạn theo batch_rows,
+tuỳ chọn xáo thứ tự row group giữa các file (shuffle=True) cho training streaming.
+"""
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Giữ đồng bộ với data_preprocess.py
+EMBEDDING_COL = "sentence_embedding"
+PARQUET_NAME = "preprocessed_features.parquet"
+LEGACY_CSV_NAME = "preprocessed_features.csv"
+
+
+def embedding_matrix(column) -> np.ndarray:
+    """Cột fixed_size_list<float32> -> ma trận (n, dim) float32, view trên buffer Arrow nếu có thể."""
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks() if column.num_chunks != 1 else column.chunk(0)
+    dim = column.type.list_size
+    return column.flatten().to_numpy(zero_copy_only=False).reshape(-1, dim)
+
+
+def read_features(input_dir: str, columns=None):
+    """
+    Trả về (df các cột structured, ma trận embedding (n, dim) float32) cùng thứ tự dòng.
+    columns: chỉ đọc các cột này (ngoài embedding) -> tiết kiệm memory với Parquet.
+    """
+    parquet_path = os.path.join(input_dir, PARQUET_NAME)
+    if os.path.exists(parquet_path):
+        read_cols = None if columns is None else list(columns) + [EMBEDDING_COL]
+        # Không dùng hive partitioning -> thư mục run=<run_id> không thành cột
+        table = ds.dataset(parquet_path, format="parquet").to_table(columns=read_cols)
+        embeddings = embedding_matrix(table.column(EMBEDDING_COL))
+        return table.drop([EMBEDDING_COL]).to_pandas(), embeddings
+
+    df = pd.read_csv(os.path.join(input_dir, LEGACY_CSV_NAME))
+    embeddings = np.array(df.pop(EMBEDDING_COL).map(json.loads).tolist(), dtype=np.float32)
+    if columns is not None:
+        df = df[list(columns)]
+    return df, embeddings
+
+
+def _shuffled_batches(dataset, read_cols, batch_rows: int, rng):
+    """Batch theo thứ tự row group ngẫu nhiên trên mọi file, dòng trong mỗi batch cũng được xáo."""
+    pieces = [piece for fragment in dataset.get_fragments() for piece in fragment.split_by_row_group()]
+    rng.shuffle(pieces)
+    for piece in pieces:
+        for batch in piece.to_batches(columns=read_cols, batch_size=batch_rows):
+            yield batch.take(pa.array(rng.permutation(batch.num_rows)))
+
+
+def iter_features(input_dir: str, columns=None, batch_rows: int = 65536, with_embeddings: bool = True,
+                  shuffle: bool = False, seed=None):
+    """
+    Như read_features nhưng yield từng (df, embeddings) tối đa batch_rows dòng, theo thứ tự file.
+    with_embeddings=False: không đọc cột embedding (embeddings = None), dùng cho các lượt chỉ cần id / label.
+    shuffle=True: thứ tự row group (mọi file) + dòng trong batch ngẫu nhiên theo seed (None = mỗi lần 1 thứ tự).
+    CSV cũ không hỗ trợ shuffle.
+    """
+    parquet_path = os.path.join(input_dir, PARQUET_NAME)
+    if os.path.exists(parquet_path):
+        read_cols = None if columns is None else list(columns) + ([EMBEDDING_COL] if with_embeddings else [])
+        dataset = ds.dataset(parquet_path, format="parquet")
+        if read_cols is None and not with_embeddings:
+            read_cols = [name for name in dataset.schema.names if name != EMBEDDING_COL]
+        if shuffle:
+            batches = _shuffled_batches(dataset, read_cols, batch_rows, np.random.default_rng(seed))
+        else:
+            batches = dataset.to_batches(columns=read_cols, batch_size=batch_rows)
+        for batch in batches:
+            if batch.num_rows == 0:
+                continue
+            table = pa.Table.from_batches([batch])
+            if not with_embeddings:
+                yield table.to_pandas(), None
+                continue
+            yield table.drop([EMBEDDING_COL]).to_pandas(), embedding_matrix(table.column(EMBEDDING_COL))
+        return
+
+    for df in pd.read_csv(os.path.join(input_dir, LEGACY_CSV_NAME), chunksize=batch_rows):
+        raw = df.pop(EMBEDDING_COL)
+        embeddings = np.array(raw.map(json.loads).tolist(), dtype=np.float32) if with_embeddings else None
+        if columns is not None:
+            df = df[list(columns)]
+        yield df.reset_index(drop=True), embeddings
@@ -1,89 +1,123 @@
 # src/inference.py
 print(">>> Inference: Start importing")
+# Chỉ dùng numpy + stdlib: import pandas / sklearn / boto3 chiếm phần lớn cold start của endpoint
 import sys
 import os
-import pandas as pd
 import numpy as np
-import re
 import json
-import boto3
-from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
-import joblib
+import base64
 import logging
+from datetime import datetime
+
+# feature_transform.py nằm cạnh file này trong source_dir (code/)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from feature_transform import SELECTED_FEATURES, OH_COLS, load_artifact
 
 logging.basicConfig(level=logging.INFO,
                     format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 # ------------- CONFIG ------------------------
-SELECTED_FEATURES = ["amount_scaled", "day_of_month", "is_weekend", "hour_sin", "hour_cos",
-                     "dow_sin", "dow_cos", "tranx_type_atm_withdrawal", "tranx_type_qrcode_payment",
-                     "tranx_type_transfer_out", "channel_MOBILE", "channel_WEB"]
-
-
 FEATURE_GROUP_NAME = "user-embeddings"
 EMBED_DIM          = 384
 USER_EMBED_DIM     = 64
 FEATURE_NAME       = "embedding"
-
-fs_runtime = boto3.client(
-    "sagemaker-featurestore-runtime",
-    region_name='ap-southeast-2'
-)
+# Lambda ai_transaction_classify gửi embedding dạng base64 của float32 little-endian
+EMBEDDING_ENCODING = "base64-float32"
+# Model dir = thư mục cha của code/ trong model.tar.gz: train_classifier.py ghi feature_transform.json + manifest
+# cạnh model đã train -> serving luôn dùng đúng transform của model được deploy.
+# FEATURE_TRANSFORM_DIR chỉ để override tường minh (vd. scripts/artefacts do test/get_artefacts.py sinh khi test local).
+MODEL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURE_TRANSFORM_DIR = os.environ.get("FEATURE_TRANSFORM_DIR", MODEL_DIR)
 
 
 # ---------- HELPER FUNCTIONS -----------------
-_ARTIFACTS = {}
+_TRANSFORM = None
 
-def _load_artifacts():
-    global _ARTIFACTS
-    if _ARTIFACTS:
-        return _ARTIFACTS
+REQUIRED_KEYS = ["amount", "txn_time", "location", "channel", "tranx_type"]
+# Contract với Lambda ai_transaction_classify (txn_time đã qua lambda/common/transactions.validate_transaction)
+TXN_TIME_CONTRACT = "ISO 8601: YYYY-MM-DD, YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD HH:MM:SS, optional .ffffff and Z / +HH:MM"
+N_STRUCT = len(SELECTED_FEATURES)
+N_FEATURES = N_STRUCT + EMBED_DIM + USER_EMBED_DIM  # 460
 
-    base_dir = os.path.join(os.path.dirname(__file__), "artefacts")
 
-    _ARTIFACTS["scaler"] = joblib.load(os.path.join(base_dir, "amount_scaler.pkl"))
-    _ARTIFACTS["ohe"] = joblib.load(os.path.join(base_dir, "onehot_encoder.pkl"))
-    _ARTIFACTS["loc_enc"] = joblib.load(os.path.join(base_dir, "location_encoder.pkl"))
+def _load_transform():
+    """Feature transform (mặc định trong model dir) đã kiểm tra checksum lúc load, dùng lại cho mọi request của container."""
+    global _TRANSFORM
+    if _TRANSFORM is None:
+        _TRANSFORM = load_artifact(FEATURE_TRANSFORM_DIR)
+        logger.info(f">>> Loaded feature transform {_TRANSFORM.version}")
+    return _TRANSFORM
 
-    with open(os.path.join(base_dir, "label2id.json"), "r") as f:
-        _ARTIFACTS["label2id"] = json.load(f)
 
-    return _ARTIFACTS
+def _parse_txn_time(value):
+    """
+    txn_time chỉ nhận ISO 8601 (TXN_TIME_CONTRACT), giữ giờ địa phương khi có offset, chấp nhận hậu tố Z.
+    Hẹp hơn pd.to_datetime trước đây: dạng khác (vd. 2024/07/10) -> ValueError rõ ràng thay vì đoán format.
+    """
+    text = str(value).strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"txn_time must be {TXN_TIME_CONTRACT}, got {value!r}") from None
 
 
-def _get_struct_features(features):
-    # Handle amount
-    artefacts = _load_artifacts()
-    features['amount_log'] = np.log1p(features['amount'])
-    features['amount_scaled'] = artefacts['scaler'].transform(features[['amount_log']])
+def _fill_struct_features(records, X):
+    """Ghi 12 cột structured của cả batch vào X[:, :N_STRUCT], cùng FeatureTransform với data_preprocess.py."""
+    txn_time = [_parse_txn_time(r["txn_time"]) for r in records]
+    _load_transform().fill_selected(
+        X,
+        amount=[float(r["amount"]) for r in records],
+        hour=[t.hour for t in txn_time],
+        day=[t.day for t in txn_time],
+        dayofweek=[t.weekday() for t in txn_time],
+        categorical={c: [r[c] for r in records] for c in OH_COLS}
+    )
 
-    # Handle txn_time
-    features['txn_time'] = pd.to_datetime(features['txn_time'])
-    features['hour'] = features['txn_time'].dt.hour
-    features['day_of_month'] = features['txn_time'].dt.day
-    features['day_of_month'] = features['day_of_month'] / 31
-    features['dayofweek'] = features['txn_time'].dt.dayofweek
-    features['is_weekend'] = features['dayofweek'].isin([5, 6]).astype(int)
-    features['hour_sin'] = np.sin(2 * np.pi * features['hour'] / 24)
-    features['hour_cos'] = np.cos(2 * np.pi * features['hour'] / 24)
-    features['dow_sin'] = np.sin(2 * np.pi * features['dayofweek'] / 7)
-    features['dow_cos'] = np.cos(2 * np.pi * features['dayofweek'] / 7)
 
-    # Handle categorical features: tranx_type, channel, location
-    ohe = artefacts['ohe']
-    oh_cols = ['tranx_type', 'channel']
-    X_cat = ohe.transform(features[oh_cols])
-    ohe_feature_names = ohe.get_feature_names_out(oh_cols)
-    df_cat_encoded = pd.DataFrame(X_cat, columns=ohe_feature_names, index=features.index)
-    features = pd.concat([features, df_cat_encoded], axis=1)
+# -------- INFERENCE FUNCTIONS ----------------
+def _decode_vector(raw, encoding, dim, name):
+    """Embedding dạng base64 float32 (encoding = EMBEDDING_ENCODING), CSV string hoặc list số -> float32 (dim,)."""
+    if isinstance(raw, str) and encoding == EMBEDDING_ENCODING:
+        vec = np.frombuffer(base64.b64decode(raw), dtype="<f4")
+    elif isinstance(raw, str):
+        vec = np.fromstring(raw, sep=",", dtype=np.float32)
+    else:
+        vec = np.asarray(raw, dtype=np.float32)
+    if vec.shape != (dim,):
+        raise ValueError(f"{name} must have {dim} dimensions, got {vec.size}")
+    return vec
+
+
+def _to_json_instances(X):
+    """
+    TF Serving REST chỉ nhận số dạng JSON (không có transport nhị phân cho tensor float).
+    '%.9g' đủ để float32 round-trip chính xác, ngắn hơn repr float64 của X.tolist().
+    """
+    rows = ("[" + ",".join(row) + "]" for row in np.char.mod("%.9g", X))
+    return '{"instances": [' + ",".join(rows) + "]}"
 
-    le = artefacts['loc_enc']
-    features['location_idx'] = le.transform(features['location'])
 
-    return features
+def build_features(records):
+    """
+    List transaction (dict như docstring của input_handler) -> ma trận (N, 460) float32 cấp phát 1 lần:
+    [SELECTED_FEATURES | text_emb_0..383 | user_emb_0..63].
+    """
+    for i, record in enumerate(records):
+        for key in REQUIRED_KEYS + ["sentence_embedding", "user_embedding"]:
+            if key not in record:
+                raise ValueError(f"Missing required input: {key} (instance {i})")
+
+    X = np.empty((len(records), N_FEATURES), dtype=np.float32)
+    _fill_struct_features(records, X)
+    for i, record in enumerate(records):
+        encoding = record.get("embedding_encoding")
+        X[i, N_STRUCT:N_STRUCT + EMBED_DIM] = _decode_vector(record["sentence_embedding"], encoding, EMBED_DIM, "sentence_embedding")
+        X[i, N_STRUCT + EMBED_DIM:] = _decode_vector(record["user_embedding"], encoding, USER_EMBED_DIM, "user_embedding")
+    return X
 
 
-# -------- INFERENCE FUNCTIONS ----------------
 def input_handler(data, context):
     """
     :param data:
@@ -91,69 +125,34 @@ def input_handler(data, context):
             "transaction_id": transaction_id
             "user_id": user_id,
             "amount": amount,
-            "txn_time": txn_time,
+            "txn_time": txn_time,                     # ISO 8601 (TXN_TIME_CONTRACT), dạng khác -> ValueError
             "msg_content": msg_content,
             "merchant": merchant,
             "to_account_name": to_account_name,
             "location": location,
             "channel": channel,
             "tranx_type": tranx_type,
-            "sentence_embedding": sentence_embedding
+            "sentence_embedding": sentence_embedding,
+            "user_embedding": user_embedding,
+            "embedding_encoding": "base64-float32"   # tuỳ chọn; không có -> embedding là CSV / list số
         }
+       hoặc batch {"instances": [<dict như trên>, ...]} -> 1 request TF Serving cho cả batch
     """
     logger.info(">>> Inside input_fn")
     try:
         if context.request_content_type != "application/json":
-            raise ValueError(f"Unsupported content type {request_content_type}")
+            raise ValueError(f"Unsupported content type {context.request_content_type}")
 
         data = data.read().decode('utf-8')
         data_dict = json.loads(data)
-        required_keys = ["amount", "txn_time", "location", "channel", "tranx_type"]
-        for key in required_keys:
-            if key not in data_dict:
-                raise ValueError(f"Missing required input: {key}")
-
-        # Handle sentence embedding
-        text_emb_raw = data_dict.pop("sentence_embedding")
-        if isinstance(text_emb_raw, str):
-            text_vec = np.fromstring(text_emb_raw, sep=",")
-        else:
-            text_vec = np.array(text_emb_raw)
-        assert len(text_vec) == EMBED_DIM, f"Current len text emb - {len(text_vec)}. Embedding must have {EMBED_DIM} dimensions"
-
-        # Handle user embedding
-        user_emb_raw = data_dict.pop("user_embedding")
-        if isinstance(user_emb_raw, str):
-            user_vec = np.fromstring(user_emb_raw, sep=",")
-        else:
-            user_vec = np.array(user_emb_raw)
-        assert len(user_vec) == USER_EMBED_DIM, f"Current len text emb - {len(user_vec)}. Embedding must have {USER_EMBED_DIM} dimensions"
-
-        # Concat dataframes
-        df_structured = pd.DataFrame([data_dict])
-        df_structured = _get_struct_features(df_structured)
-        text_emb_df = pd.DataFrame(
-            [text_vec],
-            columns=[f"text_emb_{i}" for i in range(EMBED_DIM)]
-        )
-
-        user_emb_df = pd.DataFrame(
-            [user_vec],
-            columns=[f"user_emb_{i}" for i in range(USER_EMBED_DIM)]
-        )
-        df_full = pd.concat([df_structured, text_emb_df, user_emb_df], axis=1)
-        selected_cols = SELECTED_FEATURES
-        for col in df_full.columns:
-            if col.startswith('user_emb') or col.startswith('text_emb'): selected_cols.append(col)
-        df_full = df_full[selected_cols]
-
-
-        # Convert to numpy to feed model
-        X = df_full.values
-        X = X.astype(np.float32)
+        records = data_dict["instances"] if "instances" in data_dict else [data_dict]
+        if not records:
+            raise ValueError("Empty instances")
+
+        X = build_features(records)
 
         logger.info(f"Final X shape: {X.shape} - {X.dtype}")
-        return json.dumps({"instances": X.tolist()})
+        return _to_json_instances(X)
     except Exception as e:
         logger.error(f"Lỗi trong input_handler: {e}")
         raise
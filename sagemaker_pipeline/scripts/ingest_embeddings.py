@@ -19,6 +19,9 @@ def main():
     parser.add_argument("--region",        default=os.getenv("AWS_REGION", "ap-southeast-2"))
     parser.add_argument("--wait",          default="false")
     parser.add_argument("--max-workers",   type=int, default=4)
+    # Hook cho ai_transaction_classify: đổi giá trị -> các container xoá cache user embedding
+    parser.add_argument("--refresh-param", default="/smart-jarvis/user-embeddings/event_time",
+                        help="SSM parameter nhận event_time sau khi ingest xong, rỗng = bỏ qua")
     args = parser.parse_args()
 
     # Create SageMaker session
@@ -39,15 +42,26 @@ def main():
         df = df[["user_id", "embedding"]]
 
     # Add event_time
-    df["event_time"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    event_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    df["event_time"] = event_time
 
     # Batch put record
     fg = FeatureGroup(name=args.feature_group, sagemaker_session=sagemaker_session)
-    fg.ingest(data_frame=df,
-              max_workers=args.max_workers,
-              wait=args.wait.lower() == "true")
+    wait = args.wait.lower() == "true"
+    manager = fg.ingest(data_frame=df,
+                        max_workers=args.max_workers,
+                        wait=wait)
 
     logger.info(f"✅ Ingested {len(df)} rows into FeatureGroup {args.feature_group}")
 
+    if args.refresh_param:
+        # Chỉ báo refresh khi record mới đã vào online store
+        if not wait:
+            manager.wait()
+        boto_session.client("ssm").put_parameter(
+            Name=args.refresh_param, Value=event_time, Type="String", Overwrite=True
+        )
+        logger.info(f"✅ Published user-embedding refresh {event_time} to {args.refresh_param}")
+
 if __name__ == "__main__":
     main()
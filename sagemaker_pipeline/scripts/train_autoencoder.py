@@ -10,6 +10,7 @@ from tensorflow.keras.layers import (Input, Masking, GRU, Dense,
                                      RepeatVector, TimeDistributed)
 from tensorflow.keras.models import Model
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
+from features_io import read_features, iter_features
 
 
 logging.basicConfig(level=logging.INFO,
@@ -19,7 +20,10 @@ logger = logging.getLogger(__name__)
 TRAIN_DIR = "/opt/ml/input/data/train"
 MODEL_DIR = "/opt/ml/model"
 OUTPUT_DIR = "/opt/ml/output"
-INPUT_PATH= os.path.join(TRAIN_DIR, "preprocessed_features.csv")
+DROP_COLS = {"transaction_id", "txn_time", "user_id",
+             "msg_content", "to_account_name", "merchant",
+             "category_label", "tranx_type", "channel", "location",
+             "is_manual_override", "created_at", "updated_at", "text_joined"}
 
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -34,39 +38,72 @@ def parse_args():
     parser.add_argument("--rng-seed",      type=int,   default=42)
     parser.add_argument("--model_dir",     type=str,   default="/opt/ml/model")
     parser.add_argument("--bucket",        type=str,   default="smart-jarvis-sagemaker")
+    # > 0: đọc features theo batch bấy nhiêu dòng, mỗi user chỉ giữ max-seq-len giao dịch gần nhất
+    parser.add_argument("--stream-batch-rows", type=int, default=0)
     return parser.parse_args()
 
 
-def get_user_sequences(input_path, args):
+def get_user_sequences(input_dir, args):
     """Return padded_seq, user_ids, scaler"""
-    df = pd.read_csv(input_path)
-
-    # Preprocess text embedding
-    df["embedding_list"] = df["sentence_embedding"].apply(json.loads)
-    embedding_df = pd.DataFrame(df["embedding_list"].tolist())
-    df = pd.concat([df, embedding_df], axis=1)
-    df.drop(columns=["sentence_embedding", "embedding_list", "text_joined"], inplace=True)
-    df.columns = df.columns.astype(str)
-
-    # Group by user_id
-    df = df.sort_values(["user_id", "txn_time"])
-    drop_cols = {"transaction_id", "txn_time", "user_id",
-                 "msg_content", "to_account_name", "merchant",
-                 "category_label", "tranx_type", "channel", "location",
-                 "is_manual_override", "created_at", "updated_at"}
-    feature_cols = [c for c in df.columns if c not in drop_cols]
-
+    if args.stream_batch_rows > 0:
+        return get_user_sequences_streaming(input_dir, args)
+    df, text_embeddings = read_features(input_dir)
+
+    # Group by user_id (sort df, lấy embedding theo cùng thứ tự dòng)
+    df = df.reset_index(drop=True).sort_values(["user_id", "txn_time"], kind="stable")
+    text_embeddings = text_embeddings[df.index.to_numpy()]
+    df = df.reset_index(drop=True)
+    feature_cols = [c for c in df.columns if c not in DROP_COLS]
+
+    # Structured features + text embedding -> 1 ma trận float32
+    features = np.hstack([df[feature_cols].to_numpy(dtype=np.float32), text_embeddings])
     scaler = StandardScaler()
-    df[feature_cols] = scaler.fit_transform(df[feature_cols])
+    features = scaler.fit_transform(features).astype(np.float32)
+
+    groups = df.groupby("user_id", sort=False).indices
+    seqs = [features[rows][-args.max_seq_len:] for rows in groups.values()]
+    user_ids = list(groups.keys())
+    seqs = pad_sequences(seqs, maxlen=args.max_seq_len,
+                         dtype="float32", padding="pre", value=0.0)
+    return seqs, user_ids, scaler, features.shape[1]
 
-    seqs = [
-        group[feature_cols].to_numpy()[-args.max_seq_len:]
-        for _, group in df.groupby("user_id", sort=False)
-    ]
-    user_ids = df["user_id"].drop_duplicates().tolist()
+
+def _latest_rows(chunks, n):
+    """Gộp các (txn_time, features) của 1 user, giữ n dòng mới nhất theo thời gian (tăng dần)."""
+    times = np.concatenate([t for t, _ in chunks])
+    features = np.concatenate([f for _, f in chunks])
+    keep = np.argsort(times, kind="stable")[-n:]
+    return times[keep], features[keep]
+
+
+def get_user_sequences_streaming(input_dir, args):
+    """
+    Bản streaming của get_user_sequences: lượt 1 partial_fit scaler theo batch,
+    lượt 2 transform và chỉ giữ max_seq_len giao dịch gần nhất mỗi user
+    -> memory theo số user, không theo số giao dịch.
+    """
+    scaler = StandardScaler()
+    feature_cols = None
+    for df, text_embeddings in iter_features(input_dir, batch_rows=args.stream_batch_rows):
+        feature_cols = feature_cols or [c for c in df.columns if c not in DROP_COLS]
+        scaler.partial_fit(np.hstack([df[feature_cols].to_numpy(dtype=np.float32), text_embeddings]))
+
+    buffers = {}
+    for df, text_embeddings in iter_features(input_dir, batch_rows=args.stream_batch_rows):
+        features = np.hstack([df[feature_cols].to_numpy(dtype=np.float32), text_embeddings])
+        features = scaler.transform(features).astype(np.float32)
+        times = df["txn_time"].to_numpy()
+        for uid, rows in df.groupby("user_id", sort=False).indices.items():
+            chunks = buffers.setdefault(uid, [])
+            chunks.append((times[rows], features[rows]))
+            if sum(len(t) for t, _ in chunks) > 2 * args.max_seq_len:
+                buffers[uid] = [_latest_rows(chunks, args.max_seq_len)]
+
+    user_ids = sorted(buffers)
+    seqs = [_latest_rows(buffers[uid], args.max_seq_len)[1] for uid in user_ids]
     seqs = pad_sequences(seqs, maxlen=args.max_seq_len,
                          dtype="float32", padding="pre", value=0.0)
-    return seqs, user_ids, scaler, len(feature_cols)
+    return seqs, user_ids, scaler, len(feature_cols) + text_embeddings.shape[1]
 
 
 def build_autoencoder(seq_len, feat_dim, args):
@@ -99,7 +136,7 @@ if __name__ == '__main__':
     args = parse_args()
 
     # Preprocess input
-    padded, user_ids, scaler, feat_dim = get_user_sequences(INPUT_PATH, args)
+    padded, user_ids, scaler, feat_dim = get_user_sequences(TRAIN_DIR, args)
     num_users = padded.shape[0]
     split_idx = int(num_users * (1 - args.test_split))
     X_train, X_val = padded[:split_idx], padded[split_idx:]
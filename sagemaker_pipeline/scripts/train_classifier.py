@@ -7,13 +7,15 @@ import pandas as pd
 import numpy as np
 import joblib
 import logging
-import itertools, math
+import itertools, math, zlib
 import tensorflow as tf
 from tensorflow.keras.callbacks import EarlyStopping
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from sagemaker.feature_store.feature_group import FeatureGroup
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import confusion_matrix, classification_report
+from features_io import read_features, iter_features
+from feature_transform import SELECTED_FEATURES, load_artifact, copy_artifact
 
 
 logging.basicConfig(level=logging.INFO,
@@ -24,14 +26,15 @@ logger = logging.getLogger(__name__)
 TRAIN_DIR = "/opt/ml/input/data/train"
 MODEL_DIR = "/opt/ml/model"
 OUTPUT_DIR = "/opt/ml/output"
-
-INPUT_PATH = os.path.join(TRAIN_DIR, "preprocessed_features.csv")
+# Feature transform (có manifest + checksum) do data_preprocess.py sinh cùng dataset
+TRANSFORM_DIR = os.path.join(TRAIN_DIR, "preprocessors")
 
 EMBED_DIM = 64
 
-SELECTED_FEATURES = ["amount_scaled", "day_of_month", "is_weekend", "hour_sin", "hour_cos",
-                     "dow_sin", "dow_cos", "tranx_type_atm_withdrawal", "tranx_type_qrcode_payment",
-                     "tranx_type_transfer_out", "channel_MOBILE", "channel_WEB"]
+SELECTED_TRANX_TYPES = {'transfer_out', 'qrcode_payment', 'atm_withdrawal'}
+READ_COLUMNS = SELECTED_FEATURES + ["transaction_id", "category_label", "user_id", "tranx_type"]
+# Streaming: chia train / val / test theo hash transaction_id (ổn định giữa các epoch, không cần giữ index)
+SPLIT_BUCKETS = {"train": (0, 70), "val": (70, 85), "test": (85, 100)}
 # -------- PROCESSING FUNCTIONS --------
 def parse_args():
     parser = argparse.ArgumentParser()
@@ -44,6 +47,8 @@ def parse_args():
     parser.add_argument("--hidden-units",        type=int, default=128)
 
     parser.add_argument("--feature-group-name",  type=str, default="user-embeddings")
+    # > 0: đọc features theo batch bấy nhiêu dòng, train bằng tf.data (memory không phụ thuộc kích thước dataset)
+    parser.add_argument("--stream-batch-rows",   type=int, default=0)
 
     parser.add_argument("--bucket", type=str, default="smart-jarvis-sagemaker")
     parser.add_argument("--model_dir", type=str,
@@ -112,7 +117,7 @@ def fetch_all_embeddings(unique_ids, max_workers=8, args=None):
     return uid_to_emb
 
 
-def preprocess_data(args):
+def preprocess_data(label2id, args):
     """
     Assemble the full training set by merging structured features, text‑field
     embeddings, and user‑level embeddings.
@@ -123,43 +128,57 @@ def preprocess_data(args):
     y : np.ndarray
         Target vector of shape ``(n_samples,)`` and dtype ``int`` (class indices).
     num_classes : int
-        The count of unique values in ``y`` (needed for a soft‑max output layer).
+        The number of ids in ``label2id`` (soft‑max output layer), kể cả class không có trong data.
     """
-    # Read struct_df & filter transactions & preprocess features
-    df = pd.read_csv(INPUT_PATH)
-    df = df[df["user_id"].notna()]
-    df = df[df["user_id"].str.lower() != 'nan']
-    df = df[df['tranx_type'].isin({'transfer_out', 'qrcode_payment', 'atm_withdrawal'})]
-
-    df['day_of_month'] = df['day_of_month'] / 31
-    df = df[SELECTED_FEATURES + ["transaction_id", "category_label", "user_id", "sentence_embedding"]]
-
-    # Handle text embedding
-    df["embedding_list"] = df["sentence_embedding"].apply(json.loads)
-    embedding_df = pd.DataFrame(
-        df["embedding_list"].tolist(),
-        columns=[f"text_emb_{i}" for i in range(len(df["embedding_list"].iloc[0]))]
-    )
-    df = pd.concat([df, embedding_df], axis=1)
-    df.drop(columns=["sentence_embedding", "embedding_list"], inplace=True)
-
-    # Validate user_id
-    unique_ids = df["user_id"].unique()
-    unique_ids = (
-        pd.Series(unique_ids)  # chấp nhận cả list, np.ndarray
-        .dropna()  # loại float('nan')
-        .astype(str)  # ép về chuỗi
-        .loc[lambda s: s.str.lower() != "nan"]  # loại chuỗi 'nan'
-        .tolist()  # chuyển thành list
-    )
-    df = df[df['user_id'].isin(unique_ids)]
+    # Read struct_df + ma trận text embedding (Parquet, không parse JSON) & filter transactions
+    df, text_embeddings = filter_transactions(*read_features(TRAIN_DIR, columns=READ_COLUMNS), label2id)
+    unique_ids = df["user_id"].unique().tolist()
 
     # Merge with user_emb
     uid_to_vec = fetch_all_embeddings(unique_ids, max_workers=8, args=args)
-    user_embeddings = np.vstack(df["user_id"].map(uid_to_vec).to_list())
+    upload_columns(text_embeddings.shape[1], args)
+
+    X = assemble_features(df, text_embeddings, uid_to_vec)
+    y = df["category_label"].map(label2id).to_numpy(dtype=np.int64)
+    num_classes = len(label2id)
+    logger.info(f"✅ Preprocessed data X - {X.shape}, y - {y.shape} ")
+    return X, y, num_classes
+
+
+def filter_transactions(df, text_embeddings, label2id):
+    """
+    Lọc bằng mask trên cả df lẫn ma trận embedding -> 2 bên luôn cùng thứ tự dòng.
+    Dòng có category_label không thuộc label2id (thiếu / label lạ) bị bỏ -> map sang id luôn hợp lệ.
+    """
+    user_ids = df["user_id"].astype("string")
+    mask = (
+        user_ids.notna()
+        & (user_ids.str.lower() != "nan")
+        & df["tranx_type"].isin(SELECTED_TRANX_TYPES)
+        & df["category_label"].isin(list(label2id))
+    ).to_numpy(dtype=bool)
+    df = df[mask].reset_index(drop=True)
+    df["user_id"] = df["user_id"].astype(str)
+    if text_embeddings is not None:
+        text_embeddings = text_embeddings[mask]
+    return df, text_embeddings
+
+
+def assemble_features(df, text_embeddings, uid_to_vec):
+    """X = structured features (đã transform trong data_preprocess) | text embedding | user embedding, float32."""
+    zeros = np.zeros(EMBED_DIM, dtype=np.float32)
+    user_embeddings = np.vstack([uid_to_vec.get(uid, zeros) for uid in df["user_id"]])
+    X = np.hstack([
+        df[SELECTED_FEATURES].to_numpy(dtype=np.float32),
+        text_embeddings,
+        user_embeddings
+    ])
+    X[~np.isfinite(X)] = 0  # loại bỏ cả NaN, inf, -inf
+    return X
 
-    # Get X and y
-    X_columns = df.drop(columns=["transaction_id", "category_label", "user_id"]).columns.tolist()
+
+def upload_columns(text_dim, args):
+    X_columns = SELECTED_FEATURES + [f"text_emb_{i}" for i in range(text_dim)]
     with open(os.path.join(OUTPUT_DIR, "cols_model.json"), "w") as f:
         json.dump(X_columns, f)
     bucket = args.bucket
@@ -168,17 +187,64 @@ def preprocess_data(args):
     s3.upload_file(os.path.join(OUTPUT_DIR, "cols_model.json"), bucket, key)
     logger.info(f"✅ Uploaded list of columns to s3://{bucket}/{key}")
 
-    X = np.hstack([
-        df.drop(columns=["transaction_id", "category_label", "user_id"]).values,
-        user_embeddings
-    ])
-    X = X.astype(np.float32)
-    X[~np.isfinite(X)] = 0  # loại bỏ cả NaN, inf, -inf
 
-    y = df["category_label"].to_numpy()
-    num_classes = len(np.unique(y))
-    logger.info(f"✅ Preprocessed data X - {X.shape}, y - {y.shape} ")
-    return X, y, num_classes
+def split_mask(transaction_ids, split):
+    """Dòng thuộc split ('train' / 'val' / 'test') theo crc32(transaction_id) % 100."""
+    low, high = SPLIT_BUCKETS[split]
+    buckets = np.fromiter((zlib.crc32(str(t).encode("utf-8")) % 100 for t in transaction_ids),
+                          dtype=np.int64, count=len(transaction_ids))
+    return (buckets >= low) & (buckets < high)
+
+
+def prepare_streaming(label2id, args):
+    """
+    Bản streaming của preprocess_data.
+    Lượt 1 chỉ đọc id / label (không đọc embedding) để lấy user cần fetch embedding;
+    các lượt sau (mỗi epoch) đọc lại dataset theo batch trong make_dataset.
+    :return: uid_to_vec, input_dim, num_classes (= len(label2id), kể cả class không có trong data)
+    """
+    unique_ids, labels, n_rows, n_unknown = set(), set(), 0, 0
+    for df, _ in iter_features(TRAIN_DIR, columns=READ_COLUMNS, batch_rows=args.stream_batch_rows,
+                               with_embeddings=False):
+        n_unknown += int((~df["category_label"].isin(list(label2id))).sum())
+        df, _ = filter_transactions(df, None, label2id)
+        unique_ids.update(df["user_id"])
+        labels.update(df["category_label"])
+        n_rows += len(df)
+    if n_unknown:
+        logger.warning(f"Skipped {n_unknown:,} rows with a category_label outside label2id")
+    _, text_embeddings = next(iter_features(TRAIN_DIR, columns=["transaction_id"], batch_rows=1))
+    text_dim = text_embeddings.shape[1]
+
+    uid_to_vec = fetch_all_embeddings(sorted(unique_ids), max_workers=8, args=args)
+    upload_columns(text_dim, args)
+    logger.info(f"✅ Streaming {n_rows:,} rows, {len(unique_ids):,} users, {len(labels)}/{len(label2id)} classes present")
+    return uid_to_vec, len(SELECTED_FEATURES) + text_dim + EMBED_DIM, len(label2id)
+
+
+def make_dataset(split, uid_to_vec, input_dim, label2id, args, shuffle=False):
+    """
+    tf.data.Dataset của 1 split, đọc lại features từng batch mỗi lần iterate.
+    shuffle: mỗi epoch đọc row group theo thứ tự ngẫu nhiên (iter_features) + shuffle buffer batch_rows dòng.
+    """
+    def generator():
+        for df, text_embeddings in iter_features(TRAIN_DIR, columns=READ_COLUMNS, batch_rows=args.stream_batch_rows,
+                                                 shuffle=shuffle):
+            df, text_embeddings = filter_transactions(df, text_embeddings, label2id)
+            mask = split_mask(df["transaction_id"].to_numpy(), split)
+            if not mask.any():
+                continue
+            df, text_embeddings = df[mask], text_embeddings[mask]
+            yield (assemble_features(df, text_embeddings, uid_to_vec),
+                   df["category_label"].map(label2id).to_numpy(dtype=np.int64))
+
+    dataset = tf.data.Dataset.from_generator(generator, output_signature=(
+        tf.TensorSpec(shape=(None, input_dim), dtype=tf.float32),
+        tf.TensorSpec(shape=(None,), dtype=tf.int64)
+    )).unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=args.stream_batch_rows)
+    return dataset.batch(args.training_batch_size).prefetch(tf.data.AUTOTUNE)
 
 
 def build_mlp(input_dim: int,
@@ -224,6 +290,26 @@ def train_model(model: tf.keras.Model,
     return history
 
 
+def train_model_streaming(model: tf.keras.Model,
+                          train_ds: tf.data.Dataset,
+                          val_ds: tf.data.Dataset,
+                          epochs: int = 30) -> tf.keras.callbacks.History:
+    callbacks = [
+        EarlyStopping(monitor="val_loss",
+                      patience=5,
+                      restore_best_weights=True)
+    ]
+
+    history = model.fit(
+        train_ds,
+        validation_data=val_ds,
+        epochs=epochs,
+        callbacks=callbacks,
+        verbose=2,
+    )
+    return history
+
+
 def evaluate_model(model: tf.keras.Model,
                    X_test: np.ndarray,
                    y_test: np.ndarray) -> dict:
@@ -232,7 +318,20 @@ def evaluate_model(model: tf.keras.Model,
     """
     test_loss, test_acc = model.evaluate(X_test, y_test, verbose=0)
     y_pred = model.predict(X_test).argmax(axis=1)
+    return classification_metrics(y_test, y_pred, test_loss, test_acc)
+
 
+def evaluate_model_streaming(model: tf.keras.Model, test_ds: tf.data.Dataset) -> dict:
+    """evaluate_model trên tf.data.Dataset: chỉ giữ label thật / dự đoán (int) của tập test."""
+    test_loss, test_acc = model.evaluate(test_ds, verbose=0)
+    y_test, y_pred = [], []
+    for X_batch, y_batch in test_ds:
+        y_test.append(y_batch.numpy())
+        y_pred.append(model.predict_on_batch(X_batch).argmax(axis=1))
+    return classification_metrics(np.concatenate(y_test), np.concatenate(y_pred), test_loss, test_acc)
+
+
+def classification_metrics(y_test, y_pred, test_loss, test_acc) -> dict:
     metrics = {
         "test_accuracy": float(test_acc),
         "test_loss": float(test_loss),
@@ -244,14 +343,31 @@ def evaluate_model(model: tf.keras.Model,
     return metrics
 
 
+def export_mlp_weights(model: tf.keras.Model, path: str, feature_transform_version: str) -> None:
+    """
+    Trọng số của build_mlp dạng npz cho endpoint gộp (scripts/combined_inference.py chạy MLP bằng numpy).
+    Kèm version feature transform đã train -> endpoint từ chối load nếu transform khác version.
+    """
+    dense_1, batch_norm, dense_2 = [layer for layer in model.layers if layer.weights]
+    w1, b1 = dense_1.get_weights()
+    gamma, beta, moving_mean, moving_variance = batch_norm.get_weights()
+    w2, b2 = dense_2.get_weights()
+    np.savez(path, w1=w1, b1=b1, gamma=gamma, beta=beta,
+             moving_mean=moving_mean, moving_variance=moving_variance,
+             epsilon=np.float32(batch_norm.epsilon), w2=w2, b2=b2,
+             feature_transform_version=np.array(feature_transform_version))
+
+
 def save_artifacts(model: tf.keras.Model,
                    history: tf.keras.callbacks.History,
-                   test_metrics: dict) -> None:
+                   test_metrics: dict,
+                   feature_transform_version: str) -> None:
     """
     Persist the TensorFlow SavedModel and evaluation.json side‑by‑side.
     """
     # Save model in container
     model.save(os.path.join(MODEL_DIR, "tf_model"))
+    export_mlp_weights(model, os.path.join(MODEL_DIR, "mlp_weights.npz"), feature_transform_version)
     logger.info(f"✅ Model and metrics saved to {MODEL_DIR}")
 
     # Save metrics in container
@@ -280,38 +396,47 @@ if __name__ == '__main__':
         "sagemaker-featurestore-runtime",
         region_name='ap-southeast-2'
     )
-    X,y, num_classes = preprocess_data(args)
-
-    label2id = {
-        'NEC': 0,
-        'FFA': 1,
-        'PLAY': 2,
-        'EDU': 3,
-        'GIVE': 4,
-        'LTSS': 5
-    }
-    y = np.vectorize(label2id.get)(y)
-
-    X_train, X_temp, y_train, y_temp = train_test_split(
-        X, y, test_size=0.30, random_state=42, stratify=y
-    )
-    X_val, X_test, y_val, y_test = train_test_split(
-        X_temp, y_temp, test_size=0.50, random_state=42, stratify=y_temp
-    )
-    logger.info(f"Train: {X_train.shape}, Val: {X_val.shape}, Test: {X_test.shape}")
-
-    # Build and train model MLP+Softmax
-    model = build_mlp(input_dim=X_train.shape[1],
-                      num_classes=num_classes,
-                      hidden_units=args.hidden_units)
-
-    history = train_model(model,
-                          X_train, y_train,
-                          X_val, y_val,
-                          epochs=args.epochs,
-                          batch_size=args.training_batch_size)
-
-    # Evaluate & Save output
-    test_metrics = evaluate_model(model, X_test, y_test)
-    save_artifacts(model, history, test_metrics)
-
+    # Kiểm tra checksum / version của feature transform đã dùng để tạo dataset
+    transform = load_artifact(TRANSFORM_DIR)
+    logger.info(f"✅ Feature transform version {transform.version}")
+    if args.stream_batch_rows > 0:
+        # Streaming: không giữ toàn bộ X trong memory
+        uid_to_vec, input_dim, num_classes = prepare_streaming(transform.label2id, args)
+        train_ds = make_dataset("train", uid_to_vec, input_dim, transform.label2id, args, shuffle=True)
+        val_ds = make_dataset("val", uid_to_vec, input_dim, transform.label2id, args)
+        test_ds = make_dataset("test", uid_to_vec, input_dim, transform.label2id, args)
+
+        model = build_mlp(input_dim=input_dim,
+                          num_classes=num_classes,
+                          hidden_units=args.hidden_units)
+        history = train_model_streaming(model, train_ds, val_ds, epochs=args.epochs)
+
+        test_metrics = evaluate_model_streaming(model, test_ds)
+    else:
+        X,y, num_classes = preprocess_data(transform.label2id, args)
+
+        X_train, X_temp, y_train, y_temp = train_test_split(
+            X, y, test_size=0.30, random_state=42, stratify=y
+        )
+        X_val, X_test, y_val, y_test = train_test_split(
+            X_temp, y_temp, test_size=0.50, random_state=42, stratify=y_temp
+        )
+        logger.info(f"Train: {X_train.shape}, Val: {X_val.shape}, Test: {X_test.shape}")
+
+        # Build and train model MLP+Softmax
+        model = build_mlp(input_dim=X_train.shape[1],
+                          num_classes=num_classes,
+                          hidden_units=args.hidden_units)
+
+        history = train_model(model,
+                              X_train, y_train,
+                              X_val, y_val,
+                              epochs=args.epochs,
+                              batch_size=args.training_batch_size)
+
+        # Evaluate & Save output
+        test_metrics = evaluate_model(model, X_test, y_test)
+    save_artifacts(model, history, test_metrics, transform.version)
+    # model.tar.gz kèm đúng feature transform đã train -> endpoint load từ model dir, không copy tay
+    copy_artifact(TRANSFORM_DIR, MODEL_DIR)
+    logger.info(f"✅ Feature transform {transform.version} saved to {MODEL_DIR}")
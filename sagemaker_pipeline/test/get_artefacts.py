@@ -5,40 +5,37 @@ import numpy as np
 import json
 import boto3
 from sklearn.preprocessing import StandardScaler, OneHotEncoder, LabelEncoder
-import joblib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from feature_transform import OH_COLS, build_params, save_artifact
 
 # BUCKET = os.getenv('S3_BUCKET')
 # AWS_PROFILE = os.getenv('AWS_PROFILE')
 # AWS_REGION = os.getenv('AWS_REGION')
 
-def save_amt_standard_scaler(df, output_path):
+def fit_amt_standard_scaler(df):
     df['amount_log'] = np.log1p(df['amount'])
     scaler = StandardScaler()
     df['amount_scaled'] = scaler.fit_transform(df[['amount_log']])
-    joblib.dump(scaler, output_path)
-
-def save_label2id(output_path):
-    label2id = {
-        'NEC': 0,
-        'FFA': 1,
-        'PLAY': 2,
-        'EDU': 3,
-        'GIVE': 4,
-        'LTSS': 5
-    }
-    with open(output_path, 'w') as f:
-        json.dump(label2id, f)
-
-def save_onehot_encoder(df, output_path):
+    return scaler
+
+def fit_onehot_encoder(df):
     ohe = OneHotEncoder(sparse_output=False, handle_unknown='ignore')
-    oh_cols = ['tranx_type', 'channel']
-    X_cat = ohe.fit_transform(df[oh_cols])
-    joblib.dump(ohe, output_path)
+    ohe.fit(df[OH_COLS])
+    return ohe
 
-def save_location_label_encoder(df, output_path):
+def fit_location_label_encoder(df):
     le = LabelEncoder()
     df['location_idx'] = le.fit_transform(df['location'])
-    joblib.dump(le, output_path)
+    return le
+
+def save_feature_transform(scaler, ohe, le, output_dir, version):
+    """
+    1 artifact cùng format với data_preprocess.py: feature_transform.json (tham số đã fit + label2id)
+    + feature_transform.manifest.json (version, sha256) -> scripts/inference.py load và kiểm tra checksum.
+    """
+    params = build_params(scaler.mean_[0], scaler.scale_[0], dict(zip(OH_COLS, ohe.categories_)), le.classes_, version)
+    return save_artifact(params, output_dir)
 
 
 if __name__ == '__main__':
@@ -46,11 +43,12 @@ if __name__ == '__main__':
     df_raw = pd.read_csv('test/data/synthetic_transactions.csv')
     print(df_raw.shape)
 
-    # Get artefacts
-    save_amt_standard_scaler(df=df_raw, output_path='artefacts/amount_scaler.pkl')
-    save_label2id(output_path='artefacts/label2id.json')
-    save_onehot_encoder(df=df_raw, output_path='artefacts/onehot_encoder.pkl')
-    save_location_label_encoder(df=df_raw, output_path='artefacts/location_encoder.pkl')
+    # Get artefacts để test local: serving mặc định load từ model dir, dùng FEATURE_TRANSFORM_DIR=scripts/artefacts để override
+    scaler = fit_amt_standard_scaler(df=df_raw)
+    ohe = fit_onehot_encoder(df=df_raw)
+    le = fit_location_label_encoder(df=df_raw)
+    manifest = save_feature_transform(scaler, ohe, le, output_dir='scripts/artefacts', version='synthetic')
+    print(manifest)
 
 
 
@@ -0,0 +1,143 @@
+"""
+Regression check: EXPLAIN các query nóng của crud_* Lambda, fail nếu query nào rơi về full scan.
+
+Chạy sau migrate.py trên DB có dữ liệu đại diện (bảng gần rỗng thì optimizer có thể chọn scan
+dù có index). Exit code 1 nếu có query vi phạm -> dùng được trong CI / trước khi deploy.
+
+    python sql/check_explain.py [--user-id <uuid>]
+"""
+import sys
+import argparse
+import logging
+import pymysql
+
+from migrate import get_db_connection
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+SAMPLE_TIME = "2025-01-01 00:00:00"
+
+# (tên, bảng chính, SQL, params builder) — giữ đồng bộ với WHERE/ORDER BY trong lambda/crud_*/index.py
+HOT_QUERIES = [
+    ("transaction.search",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s ORDER BY txn_time DESC, transaction_id DESC LIMIT 20 OFFSET 0",
+     lambda uid: (uid,)),
+    ("transaction.search.cursor",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s AND (txn_time < %s OR (txn_time = %s AND transaction_id < %s)) "
+     "ORDER BY txn_time DESC, transaction_id DESC LIMIT 21",
+     lambda uid: (uid, SAMPLE_TIME, SAMPLE_TIME, "ffffffff-ffff-ffff-ffff-ffffffffffff")),
+    ("transaction.search.category_label",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s AND category_label = %s ORDER BY txn_time DESC, transaction_id DESC LIMIT 20",
+     lambda uid: (uid, "NEC")),
+    ("transaction.search.tranx_type",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s AND tranx_type = %s ORDER BY txn_time DESC, transaction_id DESC LIMIT 20",
+     lambda uid: (uid, "qrcode_payment")),
+    ("transaction.search.date_range",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s AND txn_time >= %s AND txn_time <= %s ORDER BY txn_time DESC, transaction_id DESC LIMIT 20",
+     lambda uid: (uid, "2024-01-01", SAMPLE_TIME)),
+    ("transaction.search.count",
+     "transactions",
+     "SELECT COUNT(*) as total FROM transactions WHERE user_id = %s",
+     lambda uid: (uid,)),
+    ("transaction.search.search_text",
+     "transactions",
+     "SELECT * FROM transactions WHERE user_id = %s AND MATCH(search_norm) AGAINST (%s IN BOOLEAN MODE) "
+     "ORDER BY txn_time DESC, transaction_id DESC LIMIT 20",
+     lambda uid: (uid, '"di cho"')),
+    ("notification.search",
+     "notifications",
+     "SELECT * FROM notifications WHERE user_id = %s ORDER BY created_at DESC LIMIT 20 OFFSET 0",
+     lambda uid: (uid,)),
+    ("notification.search.status",
+     "notifications",
+     "SELECT * FROM notifications WHERE user_id = %s AND status = %s ORDER BY created_at DESC LIMIT 20 OFFSET 0",
+     lambda uid: (uid, 0)),
+    ("goal.search",
+     "saving_goals",
+     "SELECT * FROM saving_goals WHERE user_id = %s ORDER BY created_at DESC LIMIT 20 OFFSET 0",
+     lambda uid: (uid,)),
+    ("goal.active",
+     "saving_goals",
+     "SELECT * FROM saving_goals WHERE user_id = %s AND status = 1",
+     lambda uid: (uid,)),
+    ("goal.allocate",
+     "saving_goals",
+     "SELECT goal_id FROM saving_goals WHERE user_id = %s AND status = 1 AND sent_money = 0",
+     lambda uid: (uid,)),
+    ("label.lookup.own",
+     "counterparty_label_stats",
+     "SELECT user_id, counterparty_key, tranx_type, category_label, hits, manual_hits, updated_at "
+     "FROM counterparty_label_stats WHERE (user_id, counterparty_key, tranx_type) IN ((%s, %s, %s))",
+     lambda uid: (uid, "highlands coffee|", "qrcode_payment")),
+    ("label.lookup.global",
+     "counterparty_label_totals",
+     "SELECT counterparty_key, tranx_type, category_label, hits "
+     "FROM counterparty_label_totals WHERE (counterparty_key, tranx_type) IN ((%s, %s))",
+     lambda uid: ("highlands coffee|", "qrcode_payment")),
+    ("jar.list",
+     "user_jar_spending",
+     "SELECT * FROM user_jar_spending WHERE user_id = %s ORDER BY y_month DESC, jar_code",
+     lambda uid: (uid,)),
+]
+
+
+def explain(cursor, sql, params):
+    cursor.execute("EXPLAIN " + sql, params)
+    return cursor.fetchall()
+
+
+def check_plan(table, plan):
+    """Trả về lý do fail, hoặc None nếu bảng chính được truy cập qua index."""
+    rows = [r for r in plan if r.get('table') == table]
+    if not rows:
+        return f"table {table} not found in plan"
+    for r in rows:
+        if r.get('type') in (None, 'ALL', 'index') or not r.get('key'):
+            return f"full scan (type={r.get('type')}, key={r.get('key')}, rows={r.get('rows')})"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--user-id", default=None, help="user_id mẫu; mặc định lấy user có nhiều transaction nhất")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    failures = []
+    with conn:
+        with conn.cursor() as cursor:
+            user_id = args.user_id
+            if not user_id:
+                cursor.execute("SELECT user_id FROM transactions GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+                row = cursor.fetchone()
+                user_id = row['user_id'] if row else "00000000-0000-0000-0000-000000000000"
+            for name, table, sql, build_params in HOT_QUERIES:
+                try:
+                    plan = explain(cursor, sql, build_params(user_id))
+                except pymysql.MySQLError as e:
+                    failures.append((name, f"EXPLAIN failed: {e}"))
+                    logger.error(f"✘ {name}: EXPLAIN failed: {e}")
+                    continue
+                reason = check_plan(table, plan)
+                if reason:
+                    failures.append((name, reason))
+                    logger.error(f"✘ {name}: {reason}")
+                else:
+                    keys = ", ".join(f"{r['table']}:{r['type']}/{r['key']}" for r in plan)
+                    logger.info(f"✔ {name}: {keys}")
+
+    if failures:
+        logger.error(f"{len(failures)}/{len(HOT_QUERIES)} hot queries fall back to a full scan")
+        return 1
+    logger.info(f"✔ All {len(HOT_QUERIES)} hot queries use an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Chạy các migration trong sql/migrations theo thứ tự version (NNN_ten.sql).
+
+Version đã chạy được lưu ở bảng schema_migrations nên chạy lại nhiều lần vẫn an toàn.
+DB tạo mới từ các file DDL trong sql/ đã có sẵn schema mới nhất -> dùng --baseline
+để đánh dấu các migration tương ứng là đã chạy.
+
+Kết nối qua cùng biến môi trường với các Lambda: DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME.
+
+    python sql/migrate.py                 # chạy các migration chưa chạy
+    python sql/migrate.py --dry-run       # chỉ liệt kê
+    python sql/migrate.py --baseline 002  # đánh dấu <= 002 là đã chạy
+"""
+import os
+import re
+import sys
+import glob
+import argparse
+import logging
+import pymysql
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+_FILE_RE = re.compile(r"^(\d+)_(.+)\.sql$")
+
+
+def get_db_connection():
+    return pymysql.connect(
+        host=os.environ['DB_HOST'].split(':')[0],
+        port=int(os.environ.get('DB_PORT', 3306)),
+        user=os.environ['DB_USER'],
+        password=os.environ['DB_PASSWORD'],
+        database=os.environ['DB_NAME'],
+        cursorclass=pymysql.cursors.DictCursor
+    )
+
+
+def list_migrations():
+    migrations = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        match = _FILE_RE.match(os.path.basename(path))
+        if not match:
+            raise ValueError(f"Invalid migration file name: {path}")
+        migrations.append((match.group(1), match.group(2), path))
+    versions = [v for v, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions: {versions}")
+    return migrations
+
+
+def split_statements(sql):
+    """Bỏ comment '--' và tách theo ';' (migration không chứa ';' trong string literal)."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [stmt.strip() for stmt in "\n".join(lines).split(";") if stmt.strip()]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version    VARCHAR(32)  NOT NULL PRIMARY KEY,
+            name       VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP    DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--baseline", default=None,
+                        help="Đánh dấu các version <= BASELINE là đã chạy mà không thực thi")
+    args = parser.parse_args()
+
+    migrations = list_migrations()
+    conn = get_db_connection()
+    with conn:
+        with conn.cursor() as cursor:
+            done = applied_versions(cursor)
+            pending = [m for m in migrations if m[0] not in done]
+            if not pending:
+                logger.info("✔ Schema is up to date")
+                return 0
+            for version, name, path in pending:
+                baseline = args.baseline is not None and int(version) <= int(args.baseline)
+                if args.dry_run:
+                    logger.info(f"Pending {version}_{name}{' (baseline)' if baseline else ''}")
+                    continue
+                if not baseline:
+                    with open(path, encoding="utf-8") as f:
+                        statements = split_statements(f.read())
+                    logger.info(f"▶ Applying {version}_{name} ({len(statements)} statements)")
+                    for stmt in statements:
+                        cursor.execute(stmt)
+                else:
+                    logger.info(f"▶ Baseline {version}_{name}")
+                # DDL của MySQL tự commit; ghi version ngay sau mỗi migration
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+                conn.commit()
+    logger.info("✔ Migrations done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+-- 001: Cột shadow search_norm + FULLTEXT (ngram) cho search_text của transaction & goal
+-- search_norm được Lambda ghi sẵn ở dạng lower-case, bỏ dấu (unidecode), giống FastTextEmbedder._normalise,
+-- nên tìm "di cho" hay "Đi chợ" đều khớp và không cần quét LIKE '%x%' trên toàn bộ row của user.
+--
+-- Yêu cầu parameter group: ngram_token_size = 2, innodb_ft_enable_stopword = 0
+-- (stopword tiếng Anh mặc định như "an", "to" sẽ làm mất token tiếng Việt).
+--
+-- Sau khi chạy: invoke crud_transaction / crud_goal với {"action": "backfill_search_norm"}
+-- lặp lại đến khi "remaining" = 0 để điền search_norm cho dữ liệu cũ.
+
+ALTER TABLE transactions
+    ADD COLUMN search_norm TEXT NULL COMMENT 'msg_content + merchant, lower-case, bỏ dấu (full-text search)';
+ALTER TABLE transactions
+    ADD FULLTEXT INDEX ft_transactions_search_norm (search_norm) WITH PARSER ngram;
+
+ALTER TABLE saving_goals
+    ADD COLUMN search_norm VARCHAR(512) NULL COMMENT 'goal_name, lower-case, bỏ dấu (full-text search)';
+ALTER TABLE saving_goals
+    ADD FULLTEXT INDEX ft_saving_goals_search_norm (search_norm) WITH PARSER ngram;
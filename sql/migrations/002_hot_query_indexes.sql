@@ -0,0 +1,25 @@
+-- 002: Composite index cho các query nóng của crud_* Lambda
+-- Mỗi index khớp WHERE user_id = ? + filter/ORDER BY thực tế (xem check_explain.py).
+
+-- crud_transaction.search_transactions: ORDER BY txn_time DESC, transaction_id DESC (+ keyset cursor)
+-- Index này cũng thay thế index tự tạo cho FK fk_transactions_user.
+ALTER TABLE transactions
+    ADD INDEX idx_transactions_user_time (user_id, txn_time, transaction_id);
+-- search_transactions với filters.category_label / filters.tranx_type
+ALTER TABLE transactions
+    ADD INDEX idx_transactions_user_label_time (user_id, category_label, txn_time);
+ALTER TABLE transactions
+    ADD INDEX idx_transactions_user_type_time (user_id, tranx_type, txn_time);
+
+-- crud_notification.search_notifications: ORDER BY created_at DESC, filter status
+ALTER TABLE notifications
+    ADD INDEX idx_notifications_user_created (user_id, created_at);
+ALTER TABLE notifications
+    ADD INDEX idx_notifications_user_status_created (user_id, status, created_at);
+
+-- crud_goal: set_goal / pause / delete (status = 1), allocate_saving (status = 1 AND sent_money = 0)
+ALTER TABLE saving_goals
+    ADD INDEX idx_saving_goals_user_status (user_id, status, sent_money);
+-- crud_goal.search_goals: ORDER BY created_at DESC
+ALTER TABLE saving_goals
+    ADD INDEX idx_saving_goals_user_created (user_id, created_at);
@@ -0,0 +1,21 @@
+-- 003: Idempotency cho luồng SQS -> transaction -> jar
+-- SQS giao lại message (retry, batchItemFailures) không được tạo giao dịch trùng hay cộng spent_amount 2 lần.
+
+-- crud_transaction.create_transaction: key = idempotency_key của client hoặc SQS messageId.
+-- NULL không bị ràng buộc unique -> transaction tạo trực tiếp không có key vẫn như cũ.
+ALTER TABLE transactions
+    ADD COLUMN idempotency_key VARCHAR(128) NULL COMMENT 'SQS messageId hoặc key do client gửi; chống tạo trùng khi retry';
+ALTER TABLE transactions
+    ADD CONSTRAINT uq_transactions_idempotency UNIQUE (user_id, idempotency_key);
+
+-- crud_jar.update_jar_amount: ghi nhận key đã áp dụng, cùng DB transaction với UPDATE spent_amount
+CREATE TABLE IF NOT EXISTS user_jar_spending_events (
+    idempotency_key VARCHAR(160)   NOT NULL PRIMARY KEY,
+    user_id         CHAR(36)       NOT NULL,
+    y_month         CHAR(7)        NOT NULL,
+    jar_code        VARCHAR(10)    NOT NULL,
+    amount          DECIMAL(15, 2) NOT NULL,
+    created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT fk_user_jar_spending_events_user
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
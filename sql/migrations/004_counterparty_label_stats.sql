@@ -0,0 +1,19 @@
+-- 004: Label lịch sử theo đối tác giao dịch (merchant / to_account_name + tranx_type)
+-- sqs_processor tra bảng này trước khi gọi AI classify; đủ tin cậy thì bỏ qua embed + classifier.
+--
+-- Sau khi chạy: invoke crud_transaction với {"action": "backfill_counterparty_labels"}
+-- rồi lặp lại với "after" = giá trị trả về cho đến khi "done" = true để dựng từ các transaction đã có label.
+
+CREATE TABLE IF NOT EXISTS counterparty_label_stats (
+    user_id          CHAR(36)     NOT NULL,
+    counterparty_key VARCHAR(255) NOT NULL COMMENT 'merchant|to_account_name, lower-case, bỏ dấu',
+    tranx_type       VARCHAR(30)  NOT NULL,
+    category_label   VARCHAR(10)  NOT NULL,
+    hits             INT DEFAULT 0 NOT NULL,
+    manual_hits      INT DEFAULT 0 NOT NULL COMMENT 'số lần user tự sửa sang label này',
+    updated_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, counterparty_key, tranx_type, category_label),
+    CONSTRAINT fk_counterparty_label_stats_user
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE,
+    INDEX idx_counterparty_label_stats_key (counterparty_key, tranx_type)
+);
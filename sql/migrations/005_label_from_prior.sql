@@ -0,0 +1,8 @@
+-- 005: Đánh dấu giao dịch lấy label từ counterparty_label_stats (không gọi AI)
+-- Label này không được đếm lại vào counterparty_label_stats: nếu đếm, mỗi lần dùng label lịch sử lại
+-- tăng chính số đếm của nó -> model không bao giờ được hỏi lại cho đối tác đó.
+--
+-- Giao dịch cũ không biết nguồn label -> mặc định FALSE (vẫn được backfill_counterparty_labels đếm).
+ALTER TABLE transactions
+    ADD COLUMN label_from_prior BOOLEAN DEFAULT FALSE NOT NULL COMMENT 'label lấy từ counterparty_label_stats, không đếm lại'
+    AFTER is_manual_override;
@@ -0,0 +1,24 @@
+-- 006: Số lần gán label theo đối tác, cộng sẵn cho mọi user (global prior)
+-- labels.lookup_many đọc lịch sử của user theo primary key của counterparty_label_stats và lịch sử chung
+-- từ bảng này -> không còn quét dòng của mọi user cùng đối tác (merchant phổ biến là trường hợp tệ nhất).
+-- labels.record_label / record_labels cập nhật cả 2 bảng trong cùng DB transaction.
+--
+-- Chạy lúc ít traffic; nếu có label được gán trong lúc migrate, chạy lại backfill_counterparty_labels
+-- (swap_rebuild dựng lại bảng này từ counterparty_label_stats).
+
+CREATE TABLE IF NOT EXISTS counterparty_label_totals (
+    counterparty_key VARCHAR(255) NOT NULL COMMENT 'merchant|to_account_name, lower-case, bỏ dấu',
+    tranx_type       VARCHAR(30)  NOT NULL,
+    category_label   VARCHAR(10)  NOT NULL,
+    hits             INT DEFAULT 0 NOT NULL COMMENT 'tổng hits của counterparty_label_stats trên mọi user',
+    updated_at       TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (counterparty_key, tranx_type, category_label)
+);
+
+INSERT INTO counterparty_label_totals (counterparty_key, tranx_type, category_label, hits)
+SELECT counterparty_key, tranx_type, category_label, SUM(hits)
+FROM counterparty_label_stats
+GROUP BY counterparty_key, tranx_type, category_label;
+
+-- lookup không còn query theo (counterparty_key, tranx_type) trên bảng của từng user
+ALTER TABLE counterparty_label_stats DROP INDEX idx_counterparty_label_stats_key;
@@ -0,0 +1,13 @@
+-- 007: user_jar_spending.year_month -> y_month
+-- crud_jar / common.jars / check_explain.py đều dùng y_month; DB dựng từ DDL cũ (user_jars.sql) có cột year_month.
+-- DB đã có y_month (tạo ngoài repo) -> không đổi gì.
+
+SET @rename_year_month = IF(
+    EXISTS(SELECT 1 FROM information_schema.columns
+           WHERE table_schema = DATABASE() AND table_name = 'user_jar_spending' AND column_name = 'year_month'),
+    'ALTER TABLE user_jar_spending RENAME COLUMN year_month TO y_month',
+    'DO 0'
+);
+PREPARE rename_year_month FROM @rename_year_month;
+EXECUTE rename_year_month;
+DEALLOCATE PREPARE rename_year_month;
@@ -13,5 +13,7 @@ CREATE TABLE notifications
     created_at        TIMESTAMP                DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_notifications_user 
         FOREIGN KEY (user_id) REFERENCES users(user_id)
-        ON DELETE CASCADE
+        ON DELETE CASCADE,
+    INDEX idx_notifications_user_created (user_id, created_at),
+    INDEX idx_notifications_user_status_created (user_id, status, created_at)
 );
\ No newline at end of file
@@ -13,10 +13,49 @@ CREATE TABLE transactions
     tranx_type         VARCHAR(30)                               NOT NULL,
     category_label     VARCHAR(10),
     is_manual_override BOOLEAN                  DEFAULT FALSE,
+    label_from_prior   BOOLEAN                  DEFAULT FALSE    NOT NULL COMMENT 'label lấy từ counterparty_label_stats, không đếm lại',
+    search_norm        TEXT                                      NULL COMMENT 'msg_content + merchant, lower-case, bỏ dấu (full-text search)',
+    idempotency_key    VARCHAR(128)                              NULL COMMENT 'SQS messageId hoặc key do client gửi; chống tạo trùng khi retry',
     created_at         TIMESTAMP                DEFAULT CURRENT_TIMESTAMP,
     updated_at         TIMESTAMP                DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     CONSTRAINT valid_amount CHECK (amount <> 0),
     CONSTRAINT fk_transactions_user 
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+        ON DELETE CASCADE,
+    CONSTRAINT uq_transactions_idempotency
+        UNIQUE (user_id, idempotency_key),
+    INDEX idx_transactions_user_time (user_id, txn_time, transaction_id),
+    INDEX idx_transactions_user_label_time (user_id, category_label, txn_time),
+    INDEX idx_transactions_user_type_time (user_id, tranx_type, txn_time),
+    FULLTEXT INDEX ft_transactions_search_norm (search_norm) WITH PARSER ngram
+);
+
+-- Đếm số lần mỗi label được gán cho 1 đối tác (merchant|to_account_name đã normalise) theo user
+-- -> sqs_processor dùng label lịch sử thay cho AI khi đủ tin cậy (xem lambda/common/labels.py)
+CREATE TABLE counterparty_label_stats
+(
+    user_id          CHAR(36)                                  NOT NULL,
+    counterparty_key VARCHAR(255)                              NOT NULL COMMENT 'merchant|to_account_name, lower-case, bỏ dấu',
+    tranx_type       VARCHAR(30)                               NOT NULL,
+    category_label   VARCHAR(10)                               NOT NULL,
+    hits             INT                      DEFAULT 0        NOT NULL,
+    manual_hits      INT                      DEFAULT 0        NOT NULL COMMENT 'số lần user tự sửa sang label này',
+    updated_at       TIMESTAMP                DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, counterparty_key, tranx_type, category_label),
+    CONSTRAINT fk_counterparty_label_stats_user
         FOREIGN KEY (user_id) REFERENCES users(user_id)
         ON DELETE CASCADE
+);
+
+-- Tổng hits của counterparty_label_stats trên mọi user theo (đối tác, tranx_type, label) -> global prior
+-- đọc vài dòng thay vì dòng của mọi user cùng đối tác. Cập nhật cùng DB transaction với counterparty_label_stats
+-- (user bị xoá không trừ ở đây; backfill_counterparty_labels dựng lại cả 2 bảng).
+CREATE TABLE counterparty_label_totals
+(
+    counterparty_key VARCHAR(255)                              NOT NULL COMMENT 'merchant|to_account_name, lower-case, bỏ dấu',
+    tranx_type       VARCHAR(30)                               NOT NULL,
+    category_label   VARCHAR(10)                               NOT NULL,
+    hits             INT                      DEFAULT 0        NOT NULL COMMENT 'tổng hits của counterparty_label_stats trên mọi user',
+    updated_at       TIMESTAMP                DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (counterparty_key, tranx_type, category_label)
 );
\ No newline at end of file
@@ -15,11 +15,15 @@ CREATE TABLE saving_goals
     initial_target_date DATE,                                        NOT NULL,
     sent_money          BOOLEAN                   DEFAULT FALSE,
     month_req           NUMERIC(15,2)                                NOT NULL,
+    search_norm         VARCHAR(512)                                 NULL COMMENT 'goal_name, lower-case, bỏ dấu (full-text search)',
     created_at          TIMESTAMP                 DEFAULT CURRENT_TIMESTAMP,
     updated_at          TIMESTAMP                 DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT valid_amounts 
         CHECK (target_amount > 0 AND current_amount >= 0),
     CONSTRAINT fk_goal_setting_user
         FOREIGN KEY (user_id) REFERENCES users(user_id)
-        ON DELETE CASCADE
+        ON DELETE CASCADE,
+    INDEX idx_saving_goals_user_status (user_id, status, sent_money),
+    INDEX idx_saving_goals_user_created (user_id, created_at),
+    FULLTEXT INDEX ft_saving_goals_search_norm (search_norm) WITH PARSER ngram
 );
@@ -1,6 +1,6 @@
 CREATE TABLE user_jar_spending (
     user_id                CHAR(36)                                  NOT NULL,
-    year_month             CHAR(7)                                   NOT NULL,
+    y_month                CHAR(7)                                   NOT NULL,
     jar_code               VARCHAR(10)                               NOT NULL,
     percent                DECIMAL(5,2) DEFAULT 0.00                 NOT NULL,
     virtual_budget_amount  DECIMAL(15, 2) DEFAULT 0.00               NOT NULL,
@@ -11,7 +11,7 @@ CREATE TABLE user_jar_spending (
     created_at             TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at             TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     income_type            TINYINT,
-    PRIMARY KEY (user_id, year_month, jar_code),
+    PRIMARY KEY (user_id, y_month, jar_code),
 
     CONSTRAINT valid_jar_code_spending
         CHECK (jar_code IN ('NEC', 'FFA', 'EDU', 'LTSS', 'PLY', 'GIV')),
@@ -22,3 +22,17 @@ CREATE TABLE user_jar_spending (
     CONSTRAINT fk_user_jar_spending_user
         FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );
+
+-- Mỗi lần cộng/trừ spent_amount có idempotency key được ghi 1 dòng trong cùng DB transaction
+-- -> retry (SQS, async invoke) với cùng key không cộng trùng
+CREATE TABLE user_jar_spending_events (
+    idempotency_key VARCHAR(160)                              NOT NULL PRIMARY KEY,
+    user_id         CHAR(36)                                  NOT NULL,
+    y_month         CHAR(7)                                   NOT NULL,
+    jar_code        VARCHAR(10)                               NOT NULL,
+    amount          DECIMAL(15, 2)                            NOT NULL,
+    created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT fk_user_jar_spending_events_user
+        FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
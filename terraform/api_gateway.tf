@@ -41,6 +41,13 @@ resource "aws_api_gateway_resource" "transaction_search" {
   path_part   = "search"
 }
 
+# /transaction/bulk resource
+resource "aws_api_gateway_resource" "transaction_bulk" {
+  rest_api_id = aws_api_gateway_rest_api.test_api.id
+  parent_id   = aws_api_gateway_resource.transaction.id
+  path_part   = "bulk"
+}
+
 # /transaction/{id} resource
 resource "aws_api_gateway_resource" "transaction_id" {
   rest_api_id = aws_api_gateway_rest_api.test_api.id
@@ -289,6 +296,14 @@ resource "aws_api_gateway_method" "transaction_search_post" {
   authorization = "NONE"
 }
 
+# POST method for /transaction/bulk
+resource "aws_api_gateway_method" "transaction_bulk_post" {
+  rest_api_id   = aws_api_gateway_rest_api.test_api.id
+  resource_id   = aws_api_gateway_resource.transaction_bulk.id
+  http_method   = "POST"
+  authorization = "NONE"
+}
+
 # PATCH method for /transaction/{id}/classify
 resource "aws_api_gateway_method" "transaction_id_classify_patch" {
   rest_api_id   = aws_api_gateway_rest_api.test_api.id
@@ -492,6 +507,17 @@ resource "aws_api_gateway_integration" "transaction_search_lambda" {
   uri                     = aws_lambda_function.crud_transaction.invoke_arn
 }
 
+# Lambda integration for POST /transaction/bulk
+resource "aws_api_gateway_integration" "transaction_bulk_lambda" {
+  rest_api_id = aws_api_gateway_rest_api.test_api.id
+  resource_id = aws_api_gateway_resource.transaction_bulk.id
+  http_method = aws_api_gateway_method.transaction_bulk_post.http_method
+
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = aws_lambda_function.crud_transaction.invoke_arn
+}
+
 # Lambda integration for PATCH /transaction/{id}/classify
 resource "aws_api_gateway_integration" "transaction_id_classify_lambda" {
   rest_api_id = aws_api_gateway_rest_api.test_api.id
@@ -833,6 +859,8 @@ resource "aws_api_gateway_deployment" "test" {
     aws_api_gateway_integration_response.transaction_create_sqs_200,
     aws_api_gateway_method.transaction_search_post,
     aws_api_gateway_integration.transaction_search_lambda,
+    aws_api_gateway_method.transaction_bulk_post,
+    aws_api_gateway_integration.transaction_bulk_lambda,
     aws_api_gateway_method.transaction_id_classify_patch,
     aws_api_gateway_integration.transaction_id_classify_lambda,
     # Jar routes
@@ -888,12 +916,15 @@ resource "aws_api_gateway_deployment" "test" {
       aws_api_gateway_resource.transaction.id,
       aws_api_gateway_resource.transaction_create.id,
       aws_api_gateway_resource.transaction_search.id,
+      aws_api_gateway_resource.transaction_bulk.id,
       aws_api_gateway_resource.transaction_id_classify.id,
       aws_api_gateway_method.transaction_create_post.id,
       aws_api_gateway_method.transaction_search_post.id,
+      aws_api_gateway_method.transaction_bulk_post.id,
       aws_api_gateway_method.transaction_id_classify_patch.id,
       aws_api_gateway_integration.transaction_create_sqs.id,
       aws_api_gateway_integration.transaction_search_lambda.id,
+      aws_api_gateway_integration.transaction_bulk_lambda.id,
       aws_api_gateway_integration.transaction_id_classify_lambda.id,
       # Jar resources
       aws_api_gateway_resource.jar.id,
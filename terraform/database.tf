@@ -31,6 +31,27 @@ resource "aws_security_group" "rds" {
   }
 }
 
+# Full-text search (ngram) cho search_norm của transactions / saving_goals
+resource "aws_db_parameter_group" "mysql" {
+  name   = "${var.project_name}-mysql8"
+  family = "mysql8.0"
+
+  parameter {
+    name         = "ngram_token_size"
+    value        = "2"
+    apply_method = "pending-reboot"
+  }
+
+  parameter {
+    name  = "innodb_ft_enable_stopword"
+    value = "0"
+  }
+
+  tags = {
+    Name = "${var.project_name}-mysql8"
+  }
+}
+
 resource "aws_db_instance" "mysql" {
   identifier = "${var.project_name}-mysql-private"
 
@@ -49,6 +70,7 @@ resource "aws_db_instance" "mysql" {
 
   vpc_security_group_ids = [aws_security_group.rds.id]
   db_subnet_group_name   = aws_db_subnet_group.private.name
+  parameter_group_name   = aws_db_parameter_group.mysql.name
   publicly_accessible    = false
 
   backup_retention_period = var.backup_retention_period
@@ -2,6 +2,7 @@
 resource "null_resource" "crud_user_lambda_layer" {
   triggers = {
     requirements = filemd5("${path.module}/../lambda/crud_user/requirements.txt")
+    common       = sha1(join("", [for f in sort(fileset("${path.module}/../lambda/common", "*.py")) : filemd5("${path.module}/../lambda/common/${f}")]))
   }
 
   provisioner "local-exec" {
@@ -9,6 +10,7 @@ resource "null_resource" "crud_user_lambda_layer" {
       rm -rf ${path.module}/../lambda/crud_user/layer
       mkdir -p ${path.module}/../lambda/crud_user/layer/python
       pip install -r ${path.module}/../lambda/crud_user/requirements.txt -t ${path.module}/../lambda/crud_user/layer/python
+      cp -r ${path.module}/../lambda/common ${path.module}/../lambda/crud_user/layer/python/
     EOF
   }
 }
@@ -57,6 +57,7 @@ resource "aws_iam_role_policy" "sqs_processor_lambda_sqs_access" {
 resource "null_resource" "sqs_processor_lambda_layer" {
   triggers = {
     requirements = filemd5("${path.module}/../lambda/sqs_processor/requirements.txt")
+    common       = sha1(join("", [for f in sort(fileset("${path.module}/../lambda/common", "*.py")) : filemd5("${path.module}/../lambda/common/${f}")]))
   }
 
   provisioner "local-exec" {
@@ -64,6 +65,7 @@ resource "null_resource" "sqs_processor_lambda_layer" {
       rm -rf ${path.module}/../lambda/sqs_processor/layer
       mkdir -p ${path.module}/../lambda/sqs_processor/layer/python
       pip install -r ${path.module}/../lambda/sqs_processor/requirements.txt -t ${path.module}/../lambda/sqs_processor/layer/python
+      cp -r ${path.module}/../lambda/common ${path.module}/../lambda/sqs_processor/layer/python/
     EOF
   }
 }
@@ -120,11 +122,14 @@ resource "aws_lambda_function" "sqs_processor" {
 
   environment {
     variables = {
-      DB_HOST     = aws_db_instance.mysql.address
-      DB_PORT     = aws_db_instance.mysql.port
-      DB_NAME     = aws_db_instance.mysql.db_name
-      DB_USER     = aws_db_instance.mysql.username
-      DB_PASSWORD = var.db_password
+      DB_HOST         = aws_db_instance.mysql.address
+      DB_PORT         = aws_db_instance.mysql.port
+      DB_NAME         = aws_db_instance.mysql.db_name
+      DB_USER         = aws_db_instance.mysql.username
+      DB_PASSWORD     = var.db_password
+      SQS_MAX_WORKERS = 10
+      DB_POOL_SIZE    = 10
+      PIPELINE_MODE   = "inprocess"
     }
   }
 
@@ -138,6 +143,9 @@ resource "aws_lambda_event_source_mapping" "sqs_processor_trigger" {
   event_source_arn = aws_sqs_queue.transactions_fifo.arn
   function_name    = aws_lambda_function.sqs_processor.arn
   batch_size       = 10
+
+  # Only messages listed in batchItemFailures are redelivered
+  function_response_types = ["ReportBatchItemFailures"]
   
   depends_on = [aws_iam_role_policy.sqs_processor_lambda_sqs_access]
 }
\ No newline at end of file
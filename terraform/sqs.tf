@@ -1,8 +1,27 @@
+# Dead-letter queue for transactions that keep failing
+resource "aws_sqs_queue" "transactions_fifo_dlq" {
+  name                      = "transactions-queue-dlq.fifo"
+  fifo_queue                = true
+  message_retention_seconds = 1209600
+
+  tags = {
+    Name = "transactions-fifo-dlq"
+  }
+}
+
 # SQS FIFO Queue for Transactions
 resource "aws_sqs_queue" "transactions_fifo" {
   name                        = "transactions-queue.fifo"
   fifo_queue                  = true
   content_based_deduplication = true
+
+  # At least 6x the sqs_processor timeout so in-flight messages are not redelivered
+  visibility_timeout_seconds = 180
+
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.transactions_fifo_dlq.arn
+    maxReceiveCount     = 5
+  })
   
   tags = {
     Name = "transactions-fifo-queue"